@@ -0,0 +1,137 @@
+"""
+A scan cache keeps the listing of every directory between runs in an SQLite database together with the directory's
+mtime and inode. A directory whose mtime and inode are unchanged has the same entries so its cached listing is used
+instead of listing it again; only directories which changed are read from the filesystem. The size, mtime and inode
+of files are cached with the listing and served with it so that a warm scan makes no call per file. A file rewritten
+in place does not change the mtime of its directory, so its new size is only seen once the directory changes or the
+cache is rebuilt (`--rebuild-cache`).
+"""
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+# kinds of entries in listings
+DIRECTORY = 'd'
+SYMLINK = 'l'
+FILE = 'f'
+KINDS = (DIRECTORY, SYMLINK, FILE)
+
+# bumped whenever the encoding of the listings changes; listings in another version are discarded
+VERSION = 3
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path BLOB PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    device INTEGER NOT NULL,
+    entries BLOB NOT NULL
+)
+"""
+
+
+def default_path() -> str:
+    """~/.cache/bandbox/scan.sqlite or under $XDG_CACHE_HOME"""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'bandbox', 'scan.sqlite')
+
+
+def _encode(name: str, kind: str, size: int, mtime: int, inode: typing.Optional[tuple]) -> bytes:
+    inode = "" if inode is None else f"{inode[0]}:{inode[1]}"
+    return kind.encode('ascii') + os.fsencode(name) + f"/{size},{mtime},{inode}".encode('ascii')
+
+
+def _decode(item: bytes) -> tuple:
+    name, _, metadata = item[1:].partition(b'/')
+    size, mtime, inode = metadata.decode('ascii').split(',')
+    inode = tuple(map(int, inode.split(':'))) if inode else None
+    return os.fsdecode(name), item[:1].decode('ascii'), int(size), int(mtime), inode
+
+
+class ScanCache:
+    """Directory listings cached on disk
+
+    Listings are encoded as NUL-separated names each preceded by their kind: 'd' (directory), 'l' (symbolic link) or
+    'f' (anything else) and followed by '/' and the size, mtime and 'st_dev:st_ino' (empty unless the file has more
+    than one hard link) separated by commas; -1 where they were not read. No name holds a '/' or a NUL. Links are
+    stored as such whatever they point to so that the same listing serves scans which follow links and scans which do
+    not. Directories modified less than `RACY_SECONDS` before they were listed are not cached because a change within
+    the same mtime tick would go unnoticed.
+    """
+    RACY_SECONDS = 2
+
+    def __init__(self, path: str, rebuild: bool = False):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute(SCHEMA)
+            if rebuild or self._connection.execute("PRAGMA user_version").fetchone()[0] != VERSION:
+                self._connection.execute("DELETE FROM directories")
+                self._connection.execute(f"PRAGMA user_version = {VERSION}")
+            self._connection.commit()
+        self._visited = set()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path) -> bytes:
+        return os.fsencode(os.path.abspath(path))
+
+    def get(self, path, stat: os.stat_result) -> typing.Optional[list]:
+        """The cached (name, kind, size, mtime, inode) of the entries of the directory if it is unchanged; see `KINDS`
+        and `put`"""
+        key = self._key(path)
+        with self._lock:
+            self._visited.add(key)
+            row = self._connection.execute(
+                "SELECT mtime_ns, inode, device, entries FROM directories WHERE path = ?", (key,)
+            ).fetchone()
+            if row is None or tuple(row[:3]) != (stat.st_mtime_ns, stat.st_ino, stat.st_dev):
+                self.misses += 1
+                return None
+            self.hits += 1
+        if not row[3]:
+            return list()
+        return [_decode(item) for item in bytes(row[3]).split(b'\0')]
+
+    def put(self, path, stat: os.stat_result, entries: typing.Iterable) -> None:
+        """Cache the (name, kind, size, mtime, inode) of the entries of the directory; size and mtime are -1 and inode
+        (st_dev, st_ino) is None if unknown"""
+        if time.time() - stat.st_mtime < self.RACY_SECONDS:
+            return
+        encoded = b'\0'.join(_encode(*entry) for entry in entries)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO directories (path, mtime_ns, inode, device, entries) VALUES (?, ?, ?, ?, ?)",
+                (self._key(path), stat.st_mtime_ns, stat.st_ino, stat.st_dev, encoded)
+            )
+
+    def prune(self, root) -> int:
+        """Forget directories below `root` which were not seen during the last scan"""
+        key = self._key(root)
+        with self._lock:
+            # every path under root/ sorts between root/ and root0 ('0' follows '/')
+            rows = self._connection.execute(
+                "SELECT path FROM directories WHERE path >= ? AND path < ?", (key + b'/', key + b'0')
+            ).fetchall()
+            stale = [(row[0],) for row in rows if bytes(row[0]) not in self._visited]
+            self._connection.executemany("DELETE FROM directories WHERE path = ?", stale)
+        return len(stale)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def __str__(self):
+        return f"{self.hits} cache hits; {self.misses} cache misses; {self.hit_rate:.1%} hit rate ({self.path})"
@@ -0,0 +1,277 @@
+"""
+Checksum manifests (M3)
+
+Manifests are files of digests such as those written by `md5sum` or `sha256sum` ('<digest>  <path>') or by BSD tools
+('SHA256 (<path>) = <digest>'), found by name (`RuleSet.checksum_manifest_re` e.g. `MD5SUMS`, `data.sha256`). Paths in
+a manifest are relative to the directory it is in. The algorithm is taken from the line, the name of the manifest or
+else the length of the digest.
+
+`check` compares the manifests with the tree: files which are listed but not in the tree are missing and files below
+the directory of a manifest which no manifest lists are unlisted. With `verify` the listed files are hashed in a pool of processes (see `verify`) and
+those whose digest differs are mismatched.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import mmap
+import os
+import posixpath
+import re
+import time
+
+# digest lengths in hex digits
+ALGORITHMS = {'md5': 32, 'sha1': 40, 'sha224': 56, 'sha256': 64, 'sha384': 96, 'sha512': 128}
+CHUNK_SIZE = 8 << 20  # files smaller than this are read in one go; larger files are mapped
+BATCH_BYTES = 256 << 20
+BATCH_FILES = 256
+READS_PER_FILESYSTEM = 4
+
+_GNU_RE = re.compile(r"^(\\?)([0-9a-fA-F]+) [ *](.+)$")
+_BSD_RE = re.compile(r"^(MD5|SHA1|SHA224|SHA256|SHA384|SHA512) ?\((.+)\) ?= ?([0-9a-fA-F]+)$", re.IGNORECASE)
+_LENGTHS = {length: algorithm for algorithm, length in ALGORITHMS.items()}
+
+
+def algorithm_from_name(name: str):
+    """The algorithm a manifest is named after or None"""
+    name = name.lower()
+    for algorithm in ALGORITHMS:
+        if algorithm in name:
+            return algorithm
+    return None
+
+
+def _unescape(path: str) -> str:
+    """Undo the escaping of `md5sum` for names with a backslash or a newline"""
+    return re.sub(r"\\(.)", lambda match: "\n" if match.group(1) == "n" else match.group(1), path)
+
+
+def parse(text: str, directory: str = "", algorithm=None) -> tuple:
+    """The (path, algorithm, digest) listed in a manifest and the number of lines which could not be read
+
+    :param text: the contents of the manifest
+    :param directory: the path of the directory of the manifest in the tree e.g. 'data/'
+    :param algorithm: the algorithm the manifest is named after if any
+    """
+    entries, invalid = list(), 0
+    for line in text.splitlines():
+        line = line.rstrip("\r")
+        if not line.strip() or line.startswith("#"):
+            continue
+        match = _GNU_RE.match(line)
+        if match:
+            escaped, digest, path = match.groups()
+            path = _unescape(path) if escaped else path
+            line_algorithm = None
+        else:
+            match = _BSD_RE.match(line)
+            if match is None:
+                invalid += 1
+                continue
+            line_algorithm, path, digest = match.group(1).lower(), match.group(2), match.group(3)
+        line_algorithm = line_algorithm or algorithm or _LENGTHS.get(len(digest))
+        if line_algorithm is None or len(digest) != ALGORITHMS[line_algorithm]:
+            invalid += 1
+            continue
+        entries.append((posixpath.normpath(posixpath.join(directory, path)), line_algorithm, digest.lower()))
+    return entries, invalid
+
+
+def hash_file(path: str, algorithm: str) -> tuple:
+    """The hex digest and size of a file; large files are mapped into memory rather than read"""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < CHUNK_SIZE:
+            data = f.read()
+            digest.update(data)
+            return digest.hexdigest(), len(data)
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # e.g. special files
+            mapped = None
+        if mapped is not None:
+            with mapped:
+                if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                digest.update(mapped)  # the GIL is released while hashing
+                return digest.hexdigest(), len(mapped)
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        size = 0
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+            size += read
+        return digest.hexdigest(), size
+
+
+def _hash_batch(batch: list) -> list:
+    """(digest or None, bytes read, error or None) for each (path, algorithm) of a batch"""
+    results = list()
+    for path, algorithm in batch:
+        try:
+            digest, size = hash_file(path, algorithm)
+        except OSError as error:
+            results.append((None, 0, error.strerror or str(error)))
+            continue
+        results.append((digest, size, None))
+    return results
+
+
+def _batches(files: list) -> dict:
+    """Batches of (index, path, algorithm) per filesystem of up to `BATCH_FILES` files or `BATCH_BYTES` bytes"""
+    batches = collections.defaultdict(list)  # st_dev -> batches
+    open_batches = dict()  # st_dev -> [batch, bytes]
+    for index, (path, algorithm) in enumerate(files):
+        try:
+            stat = os.stat(path)
+            device, size = stat.st_dev, stat.st_size
+        except OSError:
+            device, size = None, 0  # hashed anyway so that the error is reported
+        batch = open_batches.get(device)
+        if batch is None or len(batch[0]) >= BATCH_FILES or batch[1] + size > BATCH_BYTES:
+            batch = open_batches[device] = [list(), 0]
+            batches[device].append(batch[0])
+        batch[0].append((index, path, algorithm))
+        batch[1] += size
+    return batches
+
+
+def verify(files: list, workers: int = None, reads_per_filesystem: int = READS_PER_FILESYSTEM) -> tuple:
+    """Hash files in a pool of processes
+
+    Files are hashed in batches (one process reading a few large files or many small ones at a time) and no more
+    than `reads_per_filesystem` batches per filesystem are in flight so that a slow filesystem is not swamped while
+    the others are kept busy.
+
+    :param files: (path, algorithm) pairs
+    :param workers: the number of processes [default: the number of CPUs]
+    :param reads_per_filesystem: the number of batches being read at once from each filesystem
+    :return: (digest or None, error or None) per file and the number of bytes hashed
+    """
+    results = [(None, None)] * len(files)
+    if not files:
+        return results, 0
+    queues = {device: collections.deque(batches) for device, batches in _batches(files).items()}
+    reading = collections.Counter()
+    hashed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = dict()
+
+        def _fill():
+            for device, queue in queues.items():
+                while queue and reading[device] < reads_per_filesystem:
+                    batch = queue.popleft()
+                    future = executor.submit(_hash_batch, [(path, algorithm) for _, path, algorithm in batch])
+                    in_flight[future] = device, batch
+                    reading[device] += 1
+
+        _fill()
+        while in_flight:
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                device, batch = in_flight.pop(future)
+                reading[device] -= 1
+                for (index, _, _), (digest, size, error) in zip(batch, future.result()):
+                    results[index] = (digest, error)
+                    hashed += size
+            _fill()
+    return results, hashed
+
+
+def _below(path: str, directories: set) -> bool:
+    """Whether a path is in one of the directories or below it"""
+    directory, parent = path, posixpath.dirname(path)
+    while parent != directory:
+        if parent in directories:
+            return True
+        directory, parent = parent, posixpath.dirname(parent)
+    return False
+
+
+class Check:
+    """What the manifests of a tree say about its files"""
+
+    def __init__(self):
+        self.manifests = list()  # paths in the tree
+        self.missing = list()
+        self.unlisted = list()
+        self.mismatched = list()
+        self.unreadable = list()  # manifests or files which could not be read
+        self.invalid_lines = 0
+        self.verified = 0  # files hashed
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """GB/s hashed"""
+        return self.bytes / self.seconds / 1e9 if self.seconds else 0.0
+
+    def problems(self) -> list:
+        """(kind, paths) of each kind of problem"""
+        return [
+            ('missing', self.missing), ('unlisted', self.unlisted), ('mismatched', self.mismatched),
+            ('unreadable', self.unreadable)
+        ]
+
+    def findings(self) -> list:
+        return [f"{kind}: {path}" for kind, paths in self.problems() for path in paths]
+
+
+def check(tree, root: str = "", manifest_re=None, verify_files: bool = False, workers: int = None,
+          reads_per_filesystem: int = READS_PER_FILESYSTEM) -> Check:
+    """Compare the manifests in the tree with its files
+
+    :param tree: the `models.Tree`
+    :param root: the directory on disk the paths in the tree are relative to
+    :param manifest_re: how manifests are named
+    :param verify_files: hash the listed files which are present and compare their digests
+    :param workers: passed on to `verify`
+    :param reads_per_filesystem: passed on to `verify`
+    """
+    result = Check()
+    # as in the manifests e.g. 'data/a.txt' rather than './data/a.txt' when the path scanned is '.'
+    paths = [posixpath.normpath(path) for path in tree.file_paths()]
+    result.manifests = [path for path in paths if manifest_re.match(posixpath.basename(path))]
+    if not result.manifests:
+        return result
+    listed = dict()  # path -> (algorithm, digest)
+    for manifest in result.manifests:
+        try:
+            with open(os.path.join(root, manifest), 'rb') as f:
+                text = f.read().decode('utf-8', 'surrogateescape')
+        except OSError:
+            result.unreadable.append(manifest)
+            continue
+        entries, invalid = parse(
+            text, directory=posixpath.dirname(manifest), algorithm=algorithm_from_name(posixpath.basename(manifest))
+        )
+        result.invalid_lines += invalid
+        for path, algorithm, digest in entries:
+            listed.setdefault(path, (algorithm, digest))
+    present = set(paths)
+    manifests = set(result.manifests)
+    result.missing = [path for path in listed if path not in present]
+    # a manifest only speaks for the files below its own directory
+    covered = {posixpath.dirname(manifest) for manifest in result.manifests}
+    result.unlisted = [
+        path for path in paths if path not in listed and path not in manifests and _below(path, covered)
+    ]
+    if verify_files:
+        files = [(path, algorithm, digest) for path, (algorithm, digest) in listed.items() if path in present]
+        start = time.perf_counter()
+        digests, result.bytes = verify(
+            [(os.path.join(root, path), algorithm) for path, algorithm, _ in files], workers=workers,
+            reads_per_filesystem=reads_per_filesystem
+        )
+        result.seconds = time.perf_counter() - start
+        result.verified = len(files)
+        for (path, _, expected), (digest, error) in zip(files, digests):
+            if error is not None:
+                result.unreadable.append(path)
+            elif digest != expected:
+                result.mismatched.append(path)
+    return result
@@ -1,10 +1,13 @@
 import argparse
 import configparser
+import functools
 import os
 import pathlib
 import shlex
 import sys
-from typing import Union, Iterable, Optional, List
+from typing import Union, Iterable, Optional
+
+from bandbox import checksums, columnar, engines, sources
 
 # options
 hide_file_counts = {
@@ -15,13 +18,22 @@ hide_file_counts = {
         help="display file counts [default: True]"
     )
 }
+no_compress = {
+    'args': ['--no-compress'],
+    'kwargs': dict(
+        default=False,
+        action='store_true',
+        help="list every file instead of collapsing numbered runs into one sequence e.g. "
+             "'image_[001-100].tif (100 files)' [default: False]"
+    )
+}
 path = {
     'args': ['path'],
     'kwargs': {
         'nargs': '?',
         'default': '',
         'type': pathlib.Path,
-        'help': "path to diagnose [default: '.']"
+        'help': "path to diagnose; tar and zip archives are read without extracting them [default: '.']"
     }
 }
 
@@ -32,6 +44,112 @@ prefix = {
         'help': "prefix to exclude [default: '']"
     }
 }
+SCAN_WORKERS = 1
+scan_workers = {
+    'args': ['-w', '--scan-workers'],
+    'kwargs': {
+        'default': SCAN_WORKERS,
+        'type': int,
+        'help': f"number of threads listing directories concurrently [default: {SCAN_WORKERS}]"
+    }
+}
+input_file = {
+    'args': ['-f', '--input-file'],
+    'kwargs': {
+        'help': "read the entries from a listing instead of scanning; gzipped listings and '-' for standard input "
+                "are accepted [default: None]"
+    }
+}
+input_format = {
+    'args': ['--input-format'],
+    'kwargs': {
+        'default': 'auto',
+        'choices': ['auto', 'print0', 'printf', 'lines', 'comma'],
+        'help': "format of the listing: 'print0' from `find -print0`, 'printf' from `find -printf '%%y %%s %%p\\n'`, "
+                "'lines' with a path per line or 'comma' with paths separated by ', ' [default: auto]"
+    }
+}
+cache = {
+    'args': ['--cache'],
+    'kwargs': {
+        'help': "scan cache file [default: ~/.cache/bandbox/scan.sqlite]"
+    }
+}
+no_cache = {
+    'args': ['--no-cache'],
+    'kwargs': {
+        'default': False,
+        'action': 'store_true',
+        'help': "list every directory instead of reusing unchanged listings from the scan cache [default: False]"
+    }
+}
+rebuild_cache = {
+    'args': ['--rebuild-cache'],
+    'kwargs': {
+        'default': False,
+        'action': 'store_true',
+        'help': "discard the scan cache before scanning e.g. to see files rewritten in place, whose sizes are cached "
+                "with their directory [default: False]"
+    }
+}
+sort_entries = {
+    'args': ['--sort-entries'],
+    'kwargs': {
+        'default': False,
+        'action': 'store_true',
+        'help': "order the entries of each directory by name [default: False]"
+    }
+}
+no_stat = {
+    'args': ['--no-stat'],
+    'kwargs': {
+        'default': False,
+        'action': 'store_true',
+        'help': "only read the names of entries and not the size and modification time of files; faster on some "
+                "filesystems but the size rules are skipped [default: False]"
+    }
+}
+follow_symlinks = {
+    'args': ['-L', '--follow-symlinks'],
+    'kwargs': {
+        'default': False,
+        'action': 'store_true',
+        'help': "enter symbolic links to directories outside the path; no directory is entered twice so that link "
+                "cycles end [default: False]"
+    }
+}
+profile = {
+    'args': ['--profile'],
+    'kwargs': {
+        'default': False,
+        'action': 'store_true',
+        'help': "report the wall and CPU time of each phase, counters and peak memory on standard error "
+                "[default: False]"
+    }
+}
+profile_output = {
+    'args': ['--profile-output'],
+    'kwargs': {
+        'metavar': 'JSON_FILE',
+        'help': "with --profile, write the report as JSON to JSON_FILE instead [default: None]"
+    }
+}
+trace_memory = {
+    'args': ['--trace-memory'],
+    'kwargs': {
+        'default': False,
+        'action': 'store_true',
+        'help': "with --profile, also trace Python allocations to report their peak; slows the run down "
+                "[default: False]"
+    }
+}
+cprofile = {
+    'args': ['--cprofile'],
+    'kwargs': {
+        'metavar': 'STATS_FILE',
+        'help': "with --profile, also run cProfile and dump its statistics to STATS_FILE [default: None]"
+    }
+}
 
 
 def _add_arg(parser_: argparse.ArgumentParser, option: dict):
@@ -61,6 +179,12 @@ class LocalConfigParser(configparser.ConfigParser):
         self._filenames = filenames
         super().read(filenames, encoding)
 
+    def __getstate__(self):
+        # compiled rules are not pickled; they are compiled again on first use
+        state = self.__dict__.copy()
+        state.pop('_ruleset', None)
+        return state
+
     def __str__(self):
         string = ""
         for section in self.sections():
@@ -86,6 +210,7 @@ class LocalConfigParser(configparser.ConfigParser):
         return eval(value)
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def getcre(value):
         """Evaluate a compiled regular expression"""
         import re
@@ -127,6 +252,53 @@ analyse_parser.add_argument(
     help=f"summarise size [default: {SUMMARY_SIZE}]"
 )
 _add_arg(analyse_parser, hide_file_counts)
+_add_arg(analyse_parser, no_compress)
+analyse_parser.add_argument('--stream', default=False, action='store_true',
+                            help="apply the rules while scanning without building the tree; "
+                                 "memory then depends on the depth of the tree [default: False]")
+analyse_parser.add_argument('--since', metavar='RESULTS_FILE',
+                            help="reuse the rule results saved in RESULTS_FILE by a previous run for unchanged "
+                                 "directories and save the new results there [default: None]")
+analyse_parser.add_argument('-j', '--jobs', default=1, type=int,
+                            help="number of processes evaluating the rules on separate subtrees [default: 1]")
+ENGINE_THREADS = 4
+analyse_parser.add_argument('--engine-threads', default=ENGINE_THREADS, type=int,
+                            help="number of threads running the engines once the rules have been evaluated "
+                                 f"[default: {ENGINE_THREADS}]")
+analyse_parser.add_argument('--engines', type=lambda value: value.split(','), metavar='PATTERNS',
+                            help="comma-separated engine names to run; wildcards are allowed e.g. 'n2_*,s2_*' "
+                                 "[default: all]")
+analyse_parser.add_argument('--skip-engines', type=lambda value: value.split(','), metavar='PATTERNS',
+                            help="comma-separated engine names not to run; their rules are not evaluated "
+                                 "[default: None]")
+analyse_parser.add_argument('--backend', default='auto', choices=columnar.BACKENDS,
+                            help="how the naming rules are applied: 'python' one name at a time or 'numpy' to all the "
+                                 "names at once; 'auto' uses NumPy if it is installed [default: auto]")
+analyse_parser.add_argument('--format', default='text', choices=['text', 'json', 'ndjson'],
+                            help="output format; 'ndjson' writes one record per finding as it is found and 'json' a "
+                                 "single document with the findings and counts per rule [default: text]")
+analyse_parser.add_argument('--verify-checksums', default=False, action='store_true',
+                            help="hash the files listed in checksum manifests (e.g. MD5SUMS, *.sha256) and report "
+                                 "those whose digest differs [default: False]")
+analyse_parser.add_argument('--checksum-workers', default=os.cpu_count() or 1, type=int,
+                            help="number of processes hashing files with --verify-checksums [default: number of "
+                                 "CPUs]")
+analyse_parser.add_argument('--reads-per-filesystem', default=checksums.READS_PER_FILESYSTEM, type=int,
+                            help="number of batches of files read at once from each filesystem with "
+                                 f"--verify-checksums [default: {checksums.READS_PER_FILESYSTEM}]")
+_add_arg(analyse_parser, input_file)
+_add_arg(analyse_parser, input_format)
+_add_arg(analyse_parser, scan_workers)
+_add_arg(analyse_parser, sort_entries)
+_add_arg(analyse_parser, no_stat)
+_add_arg(analyse_parser, follow_symlinks)
+_add_arg(analyse_parser, cache)
+_add_arg(analyse_parser, no_cache)
+_add_arg(analyse_parser, rebuild_cache)
+_add_arg(analyse_parser, profile)
+_add_arg(analyse_parser, profile_output)
+_add_arg(analyse_parser, trace_memory)
+_add_arg(analyse_parser, cprofile)
 
 # view
 view_parser = subparsers.add_parser(
@@ -140,8 +312,51 @@ _add_arg(view_parser, prefix)
 # todo: remove
 # view_parser.add_argument('-v', '--verbose', default=False, action='store_true',
 #                          help="verbose output which will display all the directories found [default: False]")
-view_parser.add_argument('-f', '--input-file', help="input data from a file")
+_add_arg(view_parser, input_file)
+_add_arg(view_parser, input_format)
 _add_arg(view_parser, hide_file_counts)
+view_parser.add_argument('--max-depth', type=int,
+                         help="do not show the contents of directories deeper than this [default: None]")
+view_parser.add_argument('--max-children', type=int,
+                         help="show at most this many entries per directory [default: None]")
+view_parser.add_argument('--show-files', default=False, action='store_true',
+                         help="list the files of each directory below its file counts [default: False]")
+_add_arg(view_parser, no_compress)
+_add_arg(view_parser, scan_workers)
+_add_arg(view_parser, sort_entries)
+_add_arg(view_parser, follow_symlinks)
+_add_arg(view_parser, cache)
+_add_arg(view_parser, no_cache)
+_add_arg(view_parser, rebuild_cache)
+_add_arg(view_parser, profile)
+_add_arg(view_parser, profile_output)
+_add_arg(view_parser, trace_memory)
+_add_arg(view_parser, cprofile)
+
+# summary
+summary_parser = subparsers.add_parser(
+    'summary',
+    description='summarise the contents of the dataset',
+    help='count the files, folders and bytes in the dataset',
+    parents=[parent_parser]
+)
+_add_arg(summary_parser, path)
+_add_arg(summary_parser, input_file)
+_add_arg(summary_parser, input_format)
+TOP = 10
+summary_parser.add_argument('-n', '--top', default=TOP, type=int,
+                            help=f"number of the heaviest folders to list [default: {TOP}]")
+summary_parser.add_argument('--by', default='files', choices=['files', 'directories', 'bytes'],
+                            help="what makes a folder heavy [default: files]")
+summary_parser.add_argument('--format', default='text', choices=['text', 'json'],
+                            help="output format [default: text]")
+_add_arg(summary_parser, scan_workers)
+_add_arg(summary_parser, sort_entries)
+_add_arg(summary_parser, no_stat)
+_add_arg(summary_parser, follow_symlinks)
+_add_arg(summary_parser, cache)
+_add_arg(summary_parser, no_cache)
+_add_arg(summary_parser, rebuild_cache)
 
 
 def parse_args():
@@ -155,18 +370,68 @@ def parse_args():
         try:
             args.config_file = os.environ['BANDBOX_CONFIG']
         except KeyError:
-            print(f"error: no configs found; please set BANDBOX_CONFIG envvar or provide --config-file path",
+            print("error: no configs found; please set BANDBOX_CONFIG envvar or provide --config-file path",
                   file=sys.stderr)
-            print(f"info: copy and modify the config file from https://raw.githubusercontent.com/emdb-empiar/bandbox/master/bandbox.cfg", file=sys.stderr)
+            print("info: copy and modify the config file from https://raw.githubusercontent.com/emdb-empiar/bandbox/master/bandbox.cfg", file=sys.stderr)
             return None
     # read configs
     configs = LocalConfigParser()
     configs.read(args.config_file)
     args._configs = configs
+    if args.command == 'analyse' and args.stream and args.show_tree:
+        print("error: cannot display the tree with --stream", file=sys.stderr)
+        return None
+    if args.command == 'analyse' and args.format != 'text' and args.show_tree:
+        print(f"error: cannot display the tree with --format {args.format}", file=sys.stderr)
+        return None
+    if args.command == 'analyse' and args.format != 'text' and args.since:
+        print(f"error: cannot use --format {args.format} with --since", file=sys.stderr)
+        return None
+    if args.command == 'analyse' and args.stream and args.since:
+        print("error: cannot reuse previous results with --stream", file=sys.stderr)
+        return None
+    if args.command == 'analyse' and args.jobs < 1:
+        print(f"error: invalid number of jobs '{args.jobs}'", file=sys.stderr)
+        return None
+    if args.command == 'analyse':
+        for option in ('engine_threads', 'checksum_workers', 'reads_per_filesystem'):
+            if getattr(args, option) < 1:
+                print(f"error: invalid {option.replace('_', '-')} '{getattr(args, option)}'", file=sys.stderr)
+                return None
+    if args.command == 'analyse' and args.verify_checksums and (args.stream or args.input_file or args.path.is_file()):
+        print("error: --verify-checksums needs the files on disk; it cannot be used with --stream, --input-file "
+              "or an archive", file=sys.stderr)
+        return None
+    if args.command == 'analyse' and args.backend == 'numpy' and not columnar.AVAILABLE:
+        print("error: --backend numpy requires NumPy; install it with 'pip install numpy'", file=sys.stderr)
+        return None
+    if args.command == 'analyse':
+        for pattern in (args.engines or []) + (args.skip_engines or []):
+            if not engines._get_engines(include=[pattern]):
+                print(f"error: no engine matching '{pattern}'", file=sys.stderr)
+                return None
+    if args.command == 'view':
+        for option in ('max_depth', 'max_children'):
+            if getattr(args, option) is not None and getattr(args, option) < 1:
+                print(f"error: invalid {option.replace('_', '-')} '{getattr(args, option)}'", file=sys.stderr)
+                return None
+    if args.command == 'summary' and args.top < 0:
+        print(f"error: invalid number of folders '{args.top}'", file=sys.stderr)
+        return None
+    if args.command != 'summary' and (args.profile_output or args.trace_memory or args.cprofile) and not args.profile:
+        print("error: --profile-output, --trace-memory and --cprofile require --profile", file=sys.stderr)
+        return None
+    if args.scan_workers < 1:
+        print(f"error: invalid number of scan workers '{args.scan_workers}'", file=sys.stderr)
+        return None
     # the path must exist
     if not args.path.exists():
         print(f"error: invalid path '{args.path}'", file=sys.stderr)
         return None
+    # a file must be an archive
+    if args.path.is_file() and not sources.is_archive(args.path):
+        print(f"error: not a directory, tar or zip archive '{args.path}'", file=sys.stderr)
+        return None
     return args
 
 
@@ -0,0 +1,159 @@
+"""
+Columnar evaluation of the naming rules with NumPy (optional)
+
+The naming rules classify one name at a time (`rules.RuleSet.classifier`). Here the names are instead encoded back to
+back into a single byte array and the checks which only depend on the characters present are computed for all of
+them at once: lengths in characters and bytes, the presence of upper and lower case letters (before the extension for
+files), the number of periods and the presence of odd characters. Checks on configured patterns which cannot be
+expressed this way (dates, accessions, extensions...) are still matched one name at a time.
+
+The verdicts are the same as `RuleSet.classifier`: the bulk checks are only used when the configured pattern is the
+one they implement, and names on which a pattern behaves differently (a newline stops `.*`; lone surrogates cannot be
+encoded) are passed to the per-name predicate.
+
+NumPy is optional; `AVAILABLE` tells whether it could be imported.
+"""
+import string
+import time
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+AVAILABLE = numpy is not None
+BACKENDS = ['auto', 'python', 'numpy']
+
+_CLASS_METACHARACTERS = set('\\]^-[')
+
+
+def use(backend: str = 'auto') -> bool:
+    """Whether names should be classified in bulk for this backend"""
+    if backend == 'numpy' and not AVAILABLE:
+        raise RuntimeError("the numpy backend requires NumPy")
+    return backend == 'numpy' or (backend == 'auto' and AVAILABLE)
+
+
+def _lookup(characters: str):
+    """A table flagging the given ASCII characters"""
+    table = numpy.zeros(256, dtype=bool)
+    table[list(characters.encode('ascii'))] = True
+    return table
+
+
+_UPPER = _lookup(string.ascii_uppercase) if AVAILABLE else None
+_LOWER = _lookup(string.ascii_lowercase) if AVAILABLE else None
+
+
+class _Columns:
+    """Names encoded as utf-8 back to back, each followed by a NUL, with where each starts and ends"""
+
+    def __init__(self, names: list):
+        self.names = names
+        self.buffer = numpy.frombuffer(("\0".join(names) + "\0").encode('utf-8', 'surrogatepass'), dtype=numpy.uint8)
+        self.ends = numpy.flatnonzero(self.buffer == 0)
+        self.starts = numpy.empty_like(self.ends)
+        self.starts[0] = 0
+        self.starts[1:] = self.ends[:-1] + 1
+        self.lengths = numpy.fromiter(map(len, names), dtype=numpy.int64, count=len(names))
+        self._stem_ends = None
+
+    def count(self, table, ends=None):
+        """The number of bytes of each name (up to `ends`) flagged in the table"""
+        flags = table[self.buffer]
+        if ends is None:  # each name runs up to the next one; the NUL in between is never flagged
+            return numpy.add.reduceat(flags, self.starts, dtype=numpy.int64)
+        bounds = numpy.empty(2 * len(self.starts), dtype=numpy.int64)
+        bounds[0::2], bounds[1::2] = self.starts, ends
+        counts = numpy.add.reduceat(flags, bounds, dtype=numpy.int64)[0::2]
+        counts[ends == self.starts] = 0  # reduceat gives the flag at the start of an empty range
+        return counts
+
+    @property
+    def stem_ends(self):
+        """Where the last period of each name is or its end if it has none"""
+        if self._stem_ends is None:
+            positions = numpy.where(self.buffer == ord('.'), numpy.arange(len(self.buffer)), -1)
+            last = numpy.maximum.reduceat(positions, self.starts)
+            self._stem_ends = numpy.where(last >= 0, last, self.ends)
+        return self._stem_ends
+
+    def irregular(self):
+        """Names the bulk checks do not apply to: with a newline or a lone surrogate (encoded as 0xED 0xA0-0xBF)"""
+        flags = self.buffer == ord('\n')
+        flags[:-1] |= (self.buffer[:-1] == 0xED) & (self.buffer[1:] >= 0xA0)
+        return numpy.flatnonzero(numpy.logical_or.reduceat(flags, self.starts))
+
+
+def _long_names(columns, ruleset, directory):
+    return columns.lengths > ruleset.max_name_length
+
+
+def _non_ascii_characters(columns, ruleset, directory):
+    return columns.lengths != columns.ends - columns.starts
+
+
+def _mixed_case(columns, ruleset, directory):
+    ends = None if directory else columns.stem_ends  # files are checked without their extension
+    return (columns.count(_UPPER, ends=ends) > 0) & (columns.count(_LOWER, ends=ends) > 0)
+
+
+def _odd_characters_in_names(columns, ruleset, directory):
+    characters = ruleset._configs.get('bandbox', 'odd_chars', fallback=None)
+    if characters is None or ruleset.odd_chars_re.pattern != f".*[{characters}].*" \
+            or any(ord(character) > 127 for character in characters) or _CLASS_METACHARACTERS.intersection(characters):
+        return None
+    return columns.count(_lookup(characters)) > 0
+
+
+def _excessive_periods_in_names(columns, ruleset, directory):
+    minimum = ruleset._configs.get('bandbox', 'periods_in_name_fewer_than', fallback=None)
+    if minimum is None or not minimum.isdigit() \
+            or ruleset.periods_in_name_fewer_than_re.pattern != f".*([.].*){{{minimum},}}.*":
+        return None
+    return columns.count(_lookup(".")) >= int(minimum)
+
+
+# rule name -> check on all the names; a check returns None if the configured pattern is not the one it implements
+CHECKS = {
+    'long_names': _long_names,
+    'non_ascii_characters': _non_ascii_characters,
+    'mixed_case': _mixed_case,
+    'odd_characters_in_names': _odd_characters_in_names,
+    'excessive_periods_in_names': _excessive_periods_in_names,
+}
+
+
+def classify(ruleset, names: list, directory: bool = False, rule_names=None, timings: dict = None) -> dict:
+    """A boolean array per naming rule telling which of the names it matches
+
+    :param ruleset: the `rules.RuleSet` of the configs
+    :param names: the names to classify
+    :param directory: whether the names are directories
+    :param rule_names: restrict the classification to these rules
+    :param timings: add the seconds spent on each rule to this dictionary
+    """
+    predicates = [
+        (rule_name, predicate) for rule_name, predicate in ruleset._predicates(directory=directory)
+        if rule_names is None or rule_name in rule_names
+    ]
+    if not names:
+        return {rule_name: numpy.zeros(0, dtype=bool) for rule_name, _ in predicates}
+    columns = _Columns(names)
+    irregular = None
+    verdicts = dict()
+    for rule_name, predicate in predicates:
+        start = time.perf_counter()
+        check = CHECKS.get(rule_name)
+        verdict = None if check is None else check(columns, ruleset, directory)
+        if verdict is None:
+            verdict = numpy.fromiter(map(predicate, names), dtype=bool, count=len(names))
+        else:
+            if irregular is None:
+                irregular = columns.irregular()
+            for index in irregular:
+                verdict[index] = bool(predicate(names[index]))
+        verdicts[rule_name] = verdict
+        if timings is not None:
+            timings[rule_name] = timings.get(rule_name, 0.0) + time.perf_counter() - start
+    return verdicts
@@ -1,45 +1,76 @@
 """
-Engines perform analyses on the tree. They are all run concurrently for performance.
+Engines perform analyses on the tree. Each engine declares the rules it reports on and returns a `Report`; the engines
+are run by `managers._analyse_engines` and their reports are rendered in the order of the engine names.
 
 quick wins
 - [DONE] detect redundant dirs [S2.a]
 - [DONE] detect obvious folders e.g tiff/*.tif* [S2.b]
 - [DONE] detect excessive files per directory [S2.c]
 - [DONE] detect directories with mixed files [S3.a]
-- detect cryptic names (against a dictionary) [N1]
+- [DONE] detect cryptic names (against a dictionary) [N1]
 - [DONE] detect dates in names [N1.b]
 - [DONE] detect accessions e.g. 'EMPIAR' [N1.c]
 - [DONE] detect mixed case in names [N2.a]
 - [DONE] detect periods in names [N2.a]
 - [DONE] detect odd characters in names [N2.b]
 - [DONE] detect long names [N2.d]
-- detect inconsistent names [N3.a]
+- [DONE] detect inconsistent names [N3.a]
 - [DONE] detect external references e.g. 'figure' [N3.c]
 - [DONE] detect words to avoid e.g. 'files', 'data' [N3.c]
-- detect missing padding [N3.e]
+- [DONE] detect missing padding [N3.e]
 - detect embedded paths (needs file format library) [N3.f]
 - [DONE] detect unknown extensions [M1.a]
 - [DONE] detect proprietary extensions [M1.b]
 - detect presence of documentation e.g. README [M2.a]
-- detect presence of checksums [M3]
-- detect hard links
-- detect symbolic links
-- detect broken symbolic links
+- [DONE] detect presence of checksums [M3]
+- [DONE] detect tiny (e.g. empty) files
+- [DONE] detect large files
+- [DONE] detect directories over a size budget
+- [DONE] detect hard links
+- [DONE] detect symbolic links
+- [DONE] detect broken symbolic links
 """
 
+import fnmatch
+import inspect
 import shutil
+import sys
 
 import styled
 
 import bandbox
+from bandbox import checksums, rules, sequences, utils
 
 width, height = shutil.get_terminal_size((80, 60))
 RIGHT_COL_WIDTH = 40
 LEFT_COL_WIDTH = width - RIGHT_COL_WIDTH - 1
 
 
-async def _report(dirs: list, rule_text: str, fail_text: str = '', args=None) -> None:
+class Report:
+    """What an engine found, ready to be rendered
+
+    Engines without rules also give their findings as (rule name, kind, finding) `records` for the JSON and NDJSON
+    formats; the findings of rules are recorded as they are made. Numbered runs in `dirs` are only compressed if they
+    are `paths` rather than e.g. bare names.
+    """
+
+    def __init__(self, dirs: list, rule_text: str, fail_text: str = '', records: list = None, paths: bool = True):
+        self.dirs = dirs
+        self.rule_text = rule_text
+        self.fail_text = fail_text
+        self.records = list() if records is None else records
+        self.paths = paths
+        self.engine = None  # set by the scheduler
+
+
+def _report(dirs: list, rule_text: str, fail_text: str = '', records: list = None, paths: bool = True) -> Report:
     """Reporting function"""
+    return Report(dirs, rule_text, fail_text=fail_text, records=records, paths=paths)
+
+
+def _render(report: Report, args=None) -> None:
+    """Print a report"""
+    dirs, rule_text, fail_text = report.dirs, report.rule_text, report.fail_text
     summarise = getattr(args, 'summarise', False)
     _all = getattr(args, 'all', False)
     summarise_size = getattr(args, 'summarise_size', 5)
@@ -50,21 +81,79 @@ async def _report(dirs: list, rule_text: str, fail_text: str = '', args=None) ->
         else:
             fail_text = f"[{len(dirs)} directories] nok".rjust(RIGHT_COL_WIDTH)
             print(styled.Styled(f"[[ '{fail_text}'|fg-red:bold ]]"))
-        if _all: # and len(dirs) > summarise_size:
-            dirs_ = dirs
+        # numbered runs of files in the same directory are listed as one sequence e.g. 'image_[001-100].tif'
+        items = dirs if getattr(args, 'no_compress', False) or not report.paths else sequences.compress_paths(dirs)
+        if _all: # and len(items) > summarise_size:
+            items_ = items
         else:
-            dirs_ = dirs[:summarise_size]
-        for item in dirs_:
+            items_ = items[:summarise_size]
+        for item in items_:
             print(f"  * {item}")
-        if not _all and len(dirs) > summarise_size:
-            print(styled.Styled("[[ '{}'|fg-yellow ]]", f"  * [+{len(dirs) - summarise_size} other results (include the -a/--all option to view the full list)]"))
+        if not _all and len(items) > summarise_size:
+            more = f"  * [+{len(items) - summarise_size} other results " \
+                   f"(include the -a/--all option to view the full list)]"
+            print(styled.Styled("[[ '{}'|fg-yellow ]]", more))
     else:
         ok_text = "ok".rjust(RIGHT_COL_WIDTH)
         print(styled.Styled(f"[[ '{ok_text}'|fg-green:bold ]]"))
     print()
 
 
-async def s2_detect_redundant_directories(tree, args):
+def _uses(*rule_classes, keep=None, reads=False):
+    """Declare the rules an engine reports on so that only the rules of the selected engines are evaluated
+
+    `keep(finding, args)` tells which findings of these rules the engine reports if not all of them, so that the other
+    output formats leave out the same ones (see `_filter_records`). `reads` marks an engine which reads files so it
+    needs them on disk rather than in an archive or a listing.
+    """
+
+    def decorator(engine):
+        engine.rules = [rule_class.name for rule_class in rule_classes]
+        engine.stat = any(rule_class.stat for rule_class in rule_classes)
+        engine.keep = keep
+        engine.reads = reads
+        return engine
+
+    return decorator
+
+
+def _filter_records(records, engines_: list, args):
+    """A record callback passing on only the findings the engines report"""
+    keep = {rule_name: engine.keep for _, engine in engines_ if engine.keep is not None for rule_name in engine.rules}
+    if not keep:
+        return records
+
+    def record(rule_name, kind, finding):
+        if rule_name not in keep or keep[rule_name](finding, args):
+            records(rule_name, kind, finding)
+
+    return record
+
+
+def _below_root(finding, args):
+    """Top-level directories are only reported with --include-root"""
+    return args.include_root or rules.EmptyDirectories.below_root(finding)
+
+
+def _get_engines(include: list = None, exclude: list = None) -> list:
+    """(name, engine) for the engines matching any of the `include` patterns and none of the `exclude` patterns
+
+    Patterns are shell-style wildcards on the engine names e.g. 'n2_*'. Engines are sorted by name.
+    """
+    engines_ = list()
+    for engine_name, engine in inspect.getmembers(sys.modules[__name__], inspect.isfunction):
+        if engine_name.startswith('_'):  # skip private methods
+            continue
+        if include and not any(fnmatch.fnmatchcase(engine_name, pattern) for pattern in include):
+            continue
+        if exclude and any(fnmatch.fnmatchcase(engine_name, pattern) for pattern in exclude):
+            continue
+        engines_.append((engine_name, engine))
+    return engines_
+
+
+@_uses(rules.EmptyDirectories, keep=_below_root)
+def s2_detect_redundant_directories(tree, args):
     """Detect the presence of redundant directories
 
     A directory is redundant if:
@@ -73,72 +162,181 @@ async def s2_detect_redundant_directories(tree, args):
     """
     # empty folders
     empty_folders = tree.find_empty_directories(include_root=args.include_root)
-    await _report(empty_folders, f"{'structure':<17} => - redundant directories...", args=args)
+    return _report(empty_folders, f"{'structure':<17} => - redundant directories...")
 
 
-async def s2_detect_obvious_directories(tree, args):
+@_uses(rules.ObviousDirectories)
+def s2_detect_obvious_directories(tree, args):
     """Detect obvious folders"""
     obvious_folders = tree.find_obvious_directories(include_root=args.include_root)
-    await _report(obvious_folders, f"{'structure warning':<17} => - obvious directory names...", args=args)
+    return _report(obvious_folders, f"{'structure warning':<17} => - obvious directory names...")
 
 
-async def s2_detect_excessive_files_per_directory(tree, args):
+@_uses(rules.ExcessiveFilesPerDirectory)
+def s2_detect_excessive_files_per_directory(tree, args):
     """Detect excessive files per directory"""
     excess_files = tree.find_excessive_files_per_directory()
-    await _report(excess_files, f"{'structure':<17} => - excessives (>{args._configs.getint('bandbox', 'max_files')}) files per directory...", args=args)
+    max_files = args._configs.getint('bandbox', 'max_files')
+    return _report(excess_files, f"{'structure':<17} => - excessives (>{max_files}) files per directory...")
 
 
-async def s3_detect_directories_with_mixed_files(tree, args):
+@_uses(rules.DirectoriesWithMixedFiles)
+def s3_detect_directories_with_mixed_files(tree, args):
     """Detect folders with mixed files"""
     mixed_files = tree.find_directories_with_mixed_files()
-    await _report(mixed_files, f"{'structure':<17} => - directories with mixed files...", args=args)
+    return _report(mixed_files, f"{'structure':<17} => - directories with mixed files...")
 
 
-async def n2_detect_long_names(tree, args):
+@_uses(rules.LongNames)
+def n2_detect_long_names(tree, args):
     """Detect entities with very long names"""
     # print(f"info: working on {tree} with {args}...")
     dirs = tree.find_long_names()
-    await _report(dirs, f"{'naming':<17} => - long names (>{args._configs.getint('bandbox', 'max_name_length')} chars)...", args=args)
+    max_name_length = args._configs.getint('bandbox', 'max_name_length')
+    return _report(dirs, f"{'naming':<17} => - long names (>{max_name_length} chars)...")
 
 
-async def n1_detect_dates_in_names(tree, args):
+@_uses(rules.DateNames)
+def n1_detect_dates_in_names(tree, args):
     """Detect dates of various formats in names"""
     dirs = tree.find_with_date_names()
-    await _report(dirs, f"{'naming':<17} => - entities with dates in names...", args=args)
+    return _report(dirs, f"{'naming':<17} => - entities with dates in names...")
 
 
-async def n1_detect_accessions_in_names(tree, args):
+@_uses(rules.AccessionsInNames)
+def n1_detect_accessions_in_names(tree, args):
     """Detect accessions in names"""
     dirs = tree.find_accessions_in_names()
-    await _report(dirs, f"{'naming':<17} => - accessions in names...", args=args)
+    return _report(dirs, f"{'naming':<17} => - accessions in names...")
 
 
-async def n2_detect_mixed_case(tree, args):
+@_uses(rules.MixedCase)
+def n2_detect_mixed_case(tree, args):
     """Detect mixed case"""
     dirs = tree.find_mixed_case()
-    await _report(dirs, f"{'naming':<17} => - mixed case in names...", args=args)
+    return _report(dirs, f"{'naming':<17} => - mixed case in names...")
 
 
-async def n2_detect_odd_characets_in_names(tree, args):
+@_uses(rules.OddCharactersInNames)
+def n2_detect_odd_characets_in_names(tree, args):
     dirs = tree.find_odd_characters_in_names()
-    await _report(dirs, f"{'naming':<17} => - odd characters [one of '{args._configs.get('bandbox', 'odd_chars')}'] in names...", args=args)
+    odd_chars = args._configs.get('bandbox', 'odd_chars')
+    return _report(dirs, f"{'naming':<17} => - odd characters [one of '{odd_chars}'] in names...")
 
 
-async def n2_detect_excessive_periods_in_names(tree, args):
+@_uses(rules.ExcessivePeriodsInNames)
+def n2_detect_excessive_periods_in_names(tree, args):
     dirs = tree.find_excessive_periods_in_names()
-    await _report(dirs, f"{'naming':<17} => - excessive periods in names...", args=args)
+    return _report(dirs, f"{'naming':<17} => - excessive periods in names...")
 
 
-async def n3_detect_external_references_in_names(tree, args):
+@_uses(rules.ExternalReferencesInNames)
+def n3_detect_external_references_in_names(tree, args):
     dirs = tree.find_external_references_in_names()
-    await _report(dirs, f"{'naming':<17} => - external references in names...", args=args)
+    return _report(dirs, f"{'naming':<17} => - external references in names...")
 
 
-async def m1_detect_unknown_file_extensions(tree, args):
+@_uses(rules.UnknownFileExtensions)
+def m1_detect_unknown_file_extensions(tree, args):
     dirs = tree.find_unknown_file_extensions()
-    await _report(dirs, f"{'misc.':<17} => - unknown file extensions...", args=args)
+    return _report(dirs, f"{'misc.':<17} => - unknown file extensions...")
 
 
-async def n2_detect_non_ascii_characters_in_names(tree, args):
+@_uses(rules.NonAsciiCharacters)
+def n2_detect_non_ascii_characters_in_names(tree, args):
     dirs = tree.find_non_ascii_characters()
-    await _report(dirs, f"{'naming':<17} => - non-ascii characters in names...", args=args)
+    # bare names from anywhere in the tree
+    return _report(dirs, f"{'naming':<17} => - non-ascii characters in names...", paths=False)
+
+
+@_uses(rules.CrypticNames)
+def n1_detect_cryptic_names(tree, args):
+    """Detect names made mostly of words which are not in the dictionary"""
+    dirs = tree.find_cryptic_names()
+    return _report(dirs, f"{'naming':<17} => - cryptic names...")
+
+
+@_uses(rules.InconsistentNames)
+def n3_detect_inconsistent_names(tree, args):
+    """Detect files named unlike most of their siblings of the same type"""
+    dirs = tree.find_inconsistent_names()
+    return _report(dirs, f"{'naming':<17} => - names inconsistent with their siblings...")
+
+
+@_uses(rules.MissingPadding)
+def n3_detect_missing_padding(tree, args):
+    """Detect numbered files without leading zeros e.g. 'image_9.tif' next to 'image_10.tif'"""
+    dirs = tree.find_missing_padding()
+    return _report(dirs, f"{'naming':<17} => - numbers without padding...")
+
+
+@_uses(rules.SmallFiles)
+def s4_detect_small_files(tree, args):
+    """Detect files smaller than the minimum size e.g. empty files left by failed transfers"""
+    dirs = tree.find_small_files()
+    min_file_size = rules.RuleSet.from_configs(args._configs).min_file_size
+    return _report(dirs, f"{'size':<17} => - files smaller than {utils.format_size(min_file_size)}...")
+
+
+@_uses(rules.LargeFiles)
+def s4_detect_large_files(tree, args):
+    """Detect files larger than the maximum size"""
+    dirs = tree.find_large_files()
+    max_file_size = rules.RuleSet.from_configs(args._configs).max_file_size
+    return _report(dirs, f"{'size':<17} => - files larger than {utils.format_size(max_file_size)}...")
+
+
+@_uses(rules.LargeDirectories)
+def s4_detect_large_directories(tree, args):
+    """Detect directories whose files add up to more than the maximum size"""
+    dirs = tree.find_large_directories()
+    max_directory_size = rules.RuleSet.from_configs(args._configs).max_directory_size
+    return _report(
+        dirs, f"{'size':<17} => - directories with more than {utils.format_size(max_directory_size)} of files..."
+    )
+
+
+@_uses(rules.HardLinks)
+def m4_detect_hard_links(tree, args):
+    """Detect files with more than one hard link"""
+    dirs = tree.find_hard_links()
+    return _report(dirs, f"{'links':<17} => - hard links...", paths=False)
+
+
+@_uses(rules.SymbolicLinks)
+def m4_detect_symbolic_links(tree, args):
+    """Detect symbolic links; they are only followed with --follow-symlinks"""
+    dirs = tree.find_symbolic_links()
+    return _report(dirs, f"{'links':<17} => - symbolic links...")
+
+
+@_uses(rules.BrokenSymbolicLinks)
+def m4_detect_broken_symbolic_links(tree, args):
+    """Detect symbolic links pointing to nothing"""
+    dirs = tree.find_broken_symbolic_links()
+    return _report(dirs, f"{'links':<17} => - broken symbolic links...")
+
+
+@_uses(reads=True)
+def m3_detect_checksums(tree, args):
+    """Detect checksum manifests and the files they miss or list in vain; with --verify-checksums also the files
+    whose digest differs"""
+    # paths in the tree are relative to the prefix
+    root = str(args.prefix)
+    if root in ('', '.'):
+        root = '/' if args.path.is_absolute() else ''
+    check = checksums.check(
+        tree, root=root, manifest_re=rules.RuleSet.from_configs(args._configs).checksum_manifest_re,
+        verify_files=args.verify_checksums, workers=args.checksum_workers,
+        reads_per_filesystem=args.reads_per_filesystem
+    )
+    rule_text = f"{'checksums':<17} => - checksum manifests..."
+    if args.verify_checksums:
+        rule_text = f"{'checksums':<17} => - checksums ({check.verified} files at {check.throughput:.2f} GB/s)..."
+        if args.verbose:
+            print(f"info: verified {check.verified} files ({check.bytes:,} bytes) in {check.seconds:.3f}s: "
+                  f"{check.throughput:.2f} GB/s", file=sys.stderr)
+    if not check.manifests:  # nothing to check against, which is not a fault of the dataset
+        return _report([], f"{'checksums':<17} => - checksum manifests (none found)...")
+    records = [(f"checksums_{kind}", rules.FILE, path) for kind, paths in check.problems() for path in paths]
+    return _report(check.findings(), rule_text, records=records, paths=False)
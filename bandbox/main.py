@@ -15,6 +15,8 @@ def main():
             return managers.analyse(args)
         elif args.command == 'view':
             return managers.view(args)
+        elif args.command == 'summary':
+            return managers.summary(args)
     except KeyboardInterrupt:
         pass
     return os.EX_OK
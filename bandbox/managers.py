@@ -1,22 +1,115 @@
-import asyncio
+import concurrent.futures
 import json
+import os
 import sys
+import time
 
-from bandbox import utils
+from bandbox import cache, engines, profiling, rules, sources, utils
 from bandbox.models import Tree
 
 
-async def _analyse_engines(tree, args):
-    """Run engines concurrently"""
-    from bandbox import engines
-    import inspect
-    engines_ = inspect.getmembers(engines, inspect.isfunction)
-    awaitables = list()
-    for engine_name, engine in engines_:
-        if engine_name.startswith('_'):  # skip private methods
-            continue
-        awaitables.append(engine(tree, args))
-    await asyncio.gather(*awaitables)
+def _run_engine(engine_name, engine, tree, args):
+    """Run a single engine"""
+    report = engine(tree, args)
+    report.engine = engine_name
+    return report
+
+
+def _ndjson_writer(stream):
+    """A record callback writing one JSON object per line as each finding is made"""
+    write = stream.write
+
+    def record(rule_name, kind, finding):
+        # rule names and kinds are plain identifiers
+        write(f'{{"rule": "{rule_name}", "path": {json.dumps(finding)}, "kind": "{kind}"}}\n')
+
+    return record
+
+
+def _analyse_engines(tree, args, engines_=None, profile=None):
+    """Run engines in a pool of threads then render their reports in the order of the engine names
+
+    The rules have already been evaluated so most engines only pick up findings; the pool is for those which do work
+    of their own e.g. verifying checksums.
+    """
+    if engines_ is None:
+        engines_ = engines._get_engines(include=args.engines, exclude=args.skip_engines)
+    if profile is None:
+        profile = profiling.Profile()
+    with profile.phase('engines'):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.engine_threads) as executor:
+            futures = [
+                executor.submit(_run_engine, engine_name, engine, tree, args) for engine_name, engine in engines_
+            ]
+            reports = [future.result() for future in futures]
+    with profile.phase('render'):
+        for report in reports:
+            engines._render(report, args=args)
+    return reports
+
+
+def _entries(args, counter=None, stat=True):
+    """Entries from the listing given on the command line, the archive members or from scanning the path; `stat` reads
+    the size and mtime of scanned files"""
+    if args.input_file:
+        return _counted(sources.read_listing(args.input_file, format=args.input_format), counter)
+    if args.path.is_file():
+        return _counted(sources.read_archive(args.path), counter)
+    return _scan(args, counter=counter, stat=stat)
+
+
+def _counted(entries, counter=None):
+    count = 0
+    for entry in entries:
+        count += 1
+        yield entry
+    if counter is not None:
+        counter.add('entries', count)
+
+
+def _scan(args, counter=None, stat=True):
+    """Walk the path given on the command line"""
+    scan_cache = None
+    if not args.no_cache:
+        scan_cache = cache.ScanCache(args.cache or cache.default_path(), rebuild=args.rebuild_cache)
+    try:
+        if args.scan_workers > 1:
+            yield from utils.scandir_parallel(
+                args.path, workers=args.scan_workers, sort=args.sort_entries, counter=counter, cache=scan_cache,
+                stat=stat, follow_symlinks=args.follow_symlinks
+            )
+        else:
+            yield from utils.scandir_recursive(
+                args.path, sort=args.sort_entries, counter=counter, cache=scan_cache, stat=stat,
+                follow_symlinks=args.follow_symlinks
+            )
+        if scan_cache is not None:
+            scan_cache.prune(args.path)
+    finally:
+        if scan_cache is not None:
+            scan_cache.close()
+            if args.verbose:
+                print(f"info: {scan_cache}", file=sys.stderr)
+
+
+def _load_results(path):
+    """Results saved by a previous run or None"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        print(f"warning: ignoring invalid results file '{path}'", file=sys.stderr)
+        return None
+
+
+def _save_results(path, results):
+    """Replace the results file in one step so that an interrupted run leaves the previous one"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(results, f, separators=(',', ':'))
+    os.replace(temp_path, path)
 
 
 def analyse(args):
@@ -24,30 +117,161 @@ def analyse(args):
     # decide which engines we will include
     # e.g. n2_long_names -> list of entities with long names
     # entry point
-    dir_entries = utils.scandir_recursive(args.path)
-    tree = Tree.from_data(dir_entries, prefix=str(args.prefix), show_file_counts=args.hide_file_counts, args=args)
-    if args.show_tree:
-        print(tree)
-    if sys.version_info.minor > 6:  # 3.7+
-        asyncio.run(_analyse_engines(tree, args))
-    else:  # python 3.6
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(_analyse_engines(tree, args))
-        loop.close()
+    counter = utils.ScanCounter()
+    profile = profiling.Profile.from_args(args)
+    profile.start()
+    engines_ = engines._get_engines(include=args.engines, exclude=args.skip_engines)
+    if args.no_stat:  # nothing to go on
+        engines_ = [(engine_name, engine) for engine_name, engine in engines_ if not engine.stat]
+    if args.stream:  # engines without rules look at the tree itself, which is not built
+        engines_ = [(engine_name, engine) for engine_name, engine in engines_ if engine.rules]
+    if args.input_file or args.path.is_file():  # the files are not on disk
+        engines_ = [(engine_name, engine) for engine_name, engine in engines_ if not engine.reads]
+    # only the rules reported by the selected engines are evaluated
+    rules_ = rules.get_rules(args._configs, names={rule_name for _, engine in engines_ for rule_name in engine.rules})
+    records, collected = None, None
+    if args.format == 'ndjson':
+        records = _ndjson_writer(sys.stdout)
+    elif args.format == 'json':
+        collected = {rule.name: list() for rule in rules_}
+
+        def records(rule_name, kind, finding):
+            collected.setdefault(rule_name, list()).append({'path': finding, 'kind': kind})
+    if records is not None:
+        # the same findings as the engines report
+        records = engines._filter_records(records, engines_, args)
+    # the seconds spent in the checks of each rule
+    timings = profile.rules if profile.enabled or args.verbose else None
+    dir_entries = profile.iterate(_entries(args, counter=counter, stat=not args.no_stat), 'scan')
+    try:
+        if args.stream:
+            with profile.phase('from_stream'):
+                tree = Tree.from_stream(
+                    dir_entries, prefix=str(args.prefix), args=args, rules_=rules_, records=records, timings=timings
+                )
+        else:
+            with profile.phase('from_data'):
+                tree = Tree.from_data(
+                    dir_entries, prefix=str(args.prefix), show_file_counts=args.hide_file_counts, args=args
+                )
+        if args.verbose:
+            print(f"info: scanned {counter}", file=sys.stderr)
+        if args.show_tree:
+            with profile.phase('render tree'):
+                print(tree)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        if args.since:
+            # only directories which changed since the previous run are evaluated
+            previous = _load_results(args.since)
+            with profile.phase('evaluate_rules_since'):
+                _, results = tree.evaluate_rules_since(rules_, previous=previous, timings=timings)
+            _save_results(args.since, results)
+        elif not args.stream:
+            # one pass over the tree for all rules; engines pick up their findings from the tree
+            with profile.phase('evaluate_rules'):
+                tree.evaluate_rules(
+                    rules_, jobs=args.jobs, records=records, backend=args.backend, timings=timings
+                )
+        if profile.enabled:
+            if not args.since:
+                # computed from the number of entries and the rules, not counted
+                profile.counters['name_checks_estimate'] = rules.name_checks(
+                    rules_, profile.counters['entries'] - profile.counters['directories'],
+                    profile.counters['directories']
+                )
+            profile.results.update((rule_name, len(found)) for rule_name, found in tree._findings.items())
+        if args.verbose:
+            if not args.stream:
+                print(f"info: evaluated {len(rules_)} rules: {time.perf_counter() - wall_start:.3f}s wall; "
+                      f"{time.process_time() - cpu_start:.3f}s cpu", file=sys.stderr)
+            for rule_name, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+                print(f"info: rule {rule_name}: {seconds:.3f}s", file=sys.stderr)
+        if args.format != 'text':
+            # engines without rules look at the tree themselves
+            with profile.phase('engines'):
+                for engine_name, engine in engines_:
+                    if not engine.rules:
+                        for record in _run_engine(engine_name, engine, tree, args).records:
+                            records(*record)
+        if args.format == 'json':
+            with profile.phase('render'):
+                json.dump({
+                    'path': str(args.path),
+                    'rules': {
+                        rule_name: {'count': len(found), 'findings': found} for rule_name, found in collected.items()
+                    },
+                }, sys.stdout, indent=4)
+                print()
+        elif args.format == 'text':
+            _analyse_engines(tree, args, engines_=engines_, profile=profile)
+    except BrokenPipeError:
+        pass
+    finally:
+        profile.stop()
+    if profile.enabled:
+        profile.report(args.profile_output)
 
 
 def view(args):
     """View the given dataset"""
-    if args.input_file:
-        with open(args.input_file) as f:
-            data = f.read().strip().split(', ')
-    else:
-        data = utils.scandir_recursive(args.path)
-    tree = Tree.from_data(data, prefix=str(args.path.parent), show_file_counts=args.hide_file_counts, args=args)
+    counter = utils.ScanCounter()
+    profile = profiling.Profile.from_args(args)
+    profile.start()
+    # sizes are not shown
+    data = profile.iterate(_entries(args, counter=counter, stat=False), 'scan')
+    with profile.phase('from_data'):
+        tree = Tree.from_data(data, prefix=str(args.path.parent), show_file_counts=args.hide_file_counts, args=args)
     if args.verbose:
-        print(f"info: displaying nested tree data...", file=sys.stderr)
-        print(json.dumps(tree.data, indent=4), file=sys.stderr)
+        print(f"info: scanned {counter}", file=sys.stderr)
+        print("info: displaying nested tree data...", file=sys.stderr)
+        print(json.dumps(tree.to_dict(), indent=4), file=sys.stderr)
     try:
-        print(tree)
+        # lines are written as they are rendered; plain text unless writing to a terminal
+        with profile.phase('render'):
+            sys.stdout.writelines(
+                tree.render(
+                    max_depth=args.max_depth, max_children=args.max_children, files=args.show_files,
+                    compress=not args.no_compress, style=sys.stdout.isatty()
+                )
+            )
+            print()
+            sys.stdout.flush()
     except BrokenPipeError:
-        pass
+        # the reader has gone (e.g. `bandbox view | head`); stop quietly without a failed flush at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        profile.stop()
+    if profile.enabled:
+        profile.report(args.profile_output)
+
+
+def summary(args):
+    """Summarise the given dataset"""
+    counter = utils.ScanCounter()
+    tree = Tree.from_data(_entries(args, counter=counter, stat=not args.no_stat), prefix=str(args.path), args=args)
+    if args.verbose:
+        print(f"info: scanned {counter}", file=sys.stderr)
+    # one pass over the tree for the totals of every folder
+    totals = tree.subtree()
+    heaviest = [
+        dict(path=os.path.join(str(args.path), tree.path(index)), **tree.subtree(index))
+        for index in tree.heaviest(args.top, by=args.by)
+    ]
+    try:
+        if args.format == 'json':
+            json.dump(dict(path=str(args.path), **totals, heaviest=heaviest), sys.stdout, indent=4)
+            print()
+            return
+        print(f"{args.path}: {_totals(totals)}")
+        print(f"extensions: {''.join(f'{ext}={count}; ' for ext, count in totals['extensions'].items())}")
+        if heaviest:
+            print(f"heaviest folders by {args.by}:")
+        for subtree in heaviest:
+            print(f"  {subtree['path']}: {_totals(subtree)}")
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+def _totals(subtree):
+    sizes = "" if subtree['bytes'] is None else f"{subtree['bytes']:,} bytes; "
+    return f"{subtree['files']} files; {subtree['directories']} folders; {sizes}{subtree['max_depth']} levels"
@@ -1,17 +1,308 @@
+import array
+import concurrent.futures
+import hashlib
+import heapq
 import os
-import re
-import sys
-from collections import UserDict
+from collections.abc import ItemsView, Mapping
 
-import bandbox
+from bandbox import columnar, rules, sequences, utils
 
+# node kinds
+FILE = 0
+DIRECTORY = 1
+LINK = 2  # a symbolic link which is not entered; neither a file nor a directory to the rules
+
+# rendering
+_DESCEND = object()  # marks the start of the contents of a directory
+_DIRECTORY = "\x1b[1;34m"
+_DIM = "\x1b[2m"
+_RESET = "\x1b[0m"
+
+ROOT = 0
+
+
+def _common_prefix_length(first: bytes, second: bytes, limit: int) -> int:
+    """Length of the common prefix of two byte strings by bisection"""
+    low, high = 0, min(len(first), len(second), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class StringTable:
+    """Names stored back to back as utf-8 in a single front-coded buffer
+
+    A name is referred to by its id. Each name only stores the bytes that differ from the name added before it (the
+    length of the shared prefix is kept in `_shared`); every `RESTART`th name is stored in full so that any name can be
+    rebuilt from at most `RESTART` pieces. Sibling names such as 'FoilHole_1234_Data_0001.mrc', '..._0002.mrc' then
+    cost a few bytes each. Directory names are interned so that names repeated across the tree (e.g. 'raw') are
+    stored once.
+    """
+    RESTART = 16
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offsets = array.array('I', [0])
+        self._shared = array.array('B')
+        self._previous = b''
+        self._ids = dict()  # interned name -> id
+        self._interned = dict()  # id -> interned name
+
+    def add(self, name: str, intern: bool = False) -> int:
+        if intern:
+            name_id = self._ids.get(name)
+            if name_id is not None:
+                return name_id
+        encoded = name.encode('utf-8', 'surrogatepass')
+        name_id = len(self._shared)
+        shared = 0
+        if name_id % self.RESTART:
+            shared = _common_prefix_length(self._previous, encoded, 255)
+        self._buffer += encoded[shared:]
+        self._offsets.append(len(self._buffer))
+        self._shared.append(shared)
+        self._previous = encoded
+        if intern:
+            self._ids[name] = name_id
+            self._interned[name_id] = name
+        return name_id
+
+    def find(self, name: str):
+        """The id of an interned name or None"""
+        return self._ids.get(name)
+
+    def _piece(self, name_id: int) -> bytes:
+        return self._buffer[self._offsets[name_id]:self._offsets[name_id + 1]]
+
+    def __getitem__(self, name_id: int) -> str:
+        name = self._interned.get(name_id)
+        if name is not None:
+            return name
+        value = b''
+        for piece_id in range(name_id - name_id % self.RESTART, name_id + 1):
+            value = value[:self._shared[piece_id]] + self._piece(piece_id)
+        return value.decode('utf-8', 'surrogatepass')
+
+    def get_many(self, name_ids) -> list:
+        """Decode several names; consecutive ids are decoded incrementally"""
+        names = list()
+        previous_id, value = -2, b''
+        for name_id in name_ids:
+            if name_id == previous_id + 1 and name_id % self.RESTART:
+                value = value[:self._shared[name_id]] + self._piece(name_id)
+            else:
+                value = b''
+                for piece_id in range(name_id - name_id % self.RESTART, name_id + 1):
+                    value = value[:self._shared[piece_id]] + self._piece(piece_id)
+            names.append(value.decode('utf-8', 'surrogatepass'))
+            previous_id = name_id
+        return names
+
+    def __len__(self):
+        return len(self._shared)
+
+    def __sizeof__(self):
+        arrays = (self._buffer, self._offsets, self._shared, self._ids, self._interned)
+        return sum(item.__sizeof__() for item in arrays) + sum(name.__sizeof__() for name in self._ids)
+
+
+class Node(Mapping):
+    """Read-only view of a directory in the tree
+
+    Presents a directory the way the tree has always been laid out: a mapping from directory names to their views and
+    a `rules.FILES_KEY` ('_files/', which no directory name can be) key with the list of file names in the directory.
+    Views are created on demand so the tree itself only holds its arrays.
+    """
+    __slots__ = ('_tree', 'index')
+
+    def __init__(self, tree, index: int):
+        self._tree = tree
+        self.index = index
+
+    def __getitem__(self, key):
+        if key == rules.FILES_KEY:
+            files = self._tree.files(self.index)
+            if files:
+                return files
+        else:
+            index = self._tree.lookup_directory(self.index, key)
+            if index is not None:
+                return Node(self._tree, index)
+        raise KeyError(key)
+
+    def _items(self):
+        tree = self._tree
+        files_seen = False
+        for index in tree.children(self.index):
+            if tree.kind(index) == DIRECTORY:
+                yield tree.name(index), Node(tree, index)
+            elif tree.kind(index) == FILE and not files_seen:  # where the first file went
+                files_seen = True
+                yield rules.FILES_KEY, tree.files(self.index)
+
+    def __iter__(self):
+        for key, _ in self._items():
+            yield key
+
+    def __len__(self):
+        kinds = self._tree._kinds
+        directories, has_files = 0, False
+        for index in self._tree.children(self.index):
+            if kinds[index] == DIRECTORY:
+                directories += 1
+            elif kinds[index] == FILE:
+                has_files = True
+        return directories + has_files
+
+    def __contains__(self, key):
+        if key == rules.FILES_KEY:
+            kinds = self._tree._kinds
+            return any(kinds[index] == FILE for index in self._tree.children(self.index))
+        return self._tree.lookup_directory(self.index, key) is not None
+
+    def items(self):
+        return _NodeItems(self)
+
+    def listing(self) -> rules.Listing:
+        """The number of files in this directory and how many there are per extension"""
+        return self._tree.listing(self.index)
+
+    def sizes(self):
+        """Sizes of the files in this directory (see `Tree.sizes`)"""
+        return self._tree.sizes(self.index)
+
+    def subtree(self) -> dict:
+        """Totals for everything below this directory (see `Tree.subtree`)"""
+        return self._tree.subtree(self.index)
+
+    def to_dict(self) -> dict:
+        """The nested dictionary for this directory"""
+        return {key: value.to_dict() if isinstance(value, Node) else value for key, value in self._items()}
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self._tree.path(self.index)!r}>"
+
+
+class _NodeItems(ItemsView):
+    def __iter__(self):
+        yield from self._mapping._items()
+
+
+def _merge_listing(extensions: dict, listing) -> None:
+    for ext, count in listing.extensions.items():
+        extensions[ext] = extensions.get(ext, 0) + count
+
+
+class _Recorder:
+    """Sinks collecting the findings of one part of the tree at a time"""
+
+    def __init__(self, rule_names):
+        self._rule_names = list(rule_names)
+        self._found = dict()
+        self._records = list()
+
+    def sinks(self) -> dict:
+        return {rule_name: self._sink(rule_name) for rule_name in self._rule_names}
+
+    def _sink(self, rule_name):
+        def sink(finding):
+            self._found.setdefault(rule_name, list()).append(finding)
+
+        return sink
+
+    def record(self, rule_name, kind, finding):
+        self._records.append((rule_name, kind, finding))
+
+    def collect(self, function, *args) -> dict:
+        """Call `function` and return the findings it produced per rule name"""
+        self._found = dict()
+        function(*args)
+        return self._found
+
+    def collect_records(self, function, *args) -> list:
+        """Call `function` and return the (rule name, kind, finding) it produced in order; see `rules.Dispatch`"""
+        self._records = list()
+        function(*args)
+        return self._records
+
+
+def _discard(finding):
+    pass
+
+
+def _on_directory(dispatch, parent, name, children):
+    dispatch.directory_name(parent, name)
+    dispatch.directory(parent, name, children)
+
+
+# state of a worker process evaluating subtrees
+_worker = None
+
+
+def _init_worker(configs, rule_names, table, timed=False):
+    global _worker
+    recorder = _Recorder(rule_names)
+    timings = dict() if timed else None
+    _worker = recorder, rules.Dispatch(
+        rules.get_rules(configs, names=rule_names), configs, dict.fromkeys(rule_names, _discard),
+        records=recorder.record, timings=timings
+    ), Tree._from_table(table, configs), timings
+
+
+def _evaluate_subtree(parent: str, index: int) -> tuple:
+    """Findings for a directory node and everything below it as (rule name, kind, finding) and the seconds spent in
+    each rule if timed"""
+    recorder, dispatch, tree, timings = _worker
+    node, name = Node(tree, index), tree.name(index)
+
+    def _evaluate():
+        _on_directory(dispatch, parent, name, node)
+        Tree._evaluate_rules(
+            node, dispatch.files, lambda *args_: _on_directory(dispatch, *args_), parent=f"{parent}{name}/"
+        )
+
+    records = recorder.collect_records(_evaluate)
+    if timings is None:
+        return records, None
+    spent = dict(timings)
+    timings.clear()
+    return records, spent
+
+
+class Tree(Mapping):
+    """The tree of directories and files
+
+    Nodes live in parallel arrays indexed by node id: the parent, name id (into a `StringTable`), kind and, once known,
+    size and mtime of every entry. Node 0 is a virtual root above the top-level entries. The children of a node are
+    found as a contiguous range of an index built (lazily) by sorting nodes on their parent. `data` presents the tree
+    as the nested mapping of directories with a list of files (under `rules.FILES_KEY`) per directory.
+    """
 
-class Tree(UserDict):
     def __new__(cls, sep='/', show_file_counts=True):
         cls.sep = sep
         cls.show_file_counts = show_file_counts
         return super().__new__(cls)
 
+    def __init__(self, *args, **kwargs):
+        self._parents = array.array('i', [-1])
+        self._names = array.array('i', [-1])
+        self._kinds = array.array('b', [DIRECTORY])
+        self._sizes = None  # allocated once sizes are known
+        self._mtimes = None  # likewise
+        self._strings = StringTable()
+        self._directories = dict()  # (parent, name id) -> directory node
+        self._last_directory = (None, ROOT)  # (path components, node) of the previous insertion
+        self._child_starts = None
+        self._child_nodes = None
+        self._listings = dict()  # directory node -> rules.Listing of its files
+        self._links = rules.Links()
+        self._rollup = None  # totals per directory; see `rollup`
+        self._findings = dict()
+
     @classmethod
     def from_data(cls, data, prefix="", show_file_counts=True, args=None):
         tree = cls()
@@ -22,70 +313,388 @@ class Tree(UserDict):
             tree.insert(t, prefix=prefix)
         return tree
 
+    @classmethod
+    def from_stream(cls, data, prefix="", args=None, rules_=None, records=None, timings=None):
+        """Apply the rules to the entries as they are scanned without inserting them
+
+        The tree stays empty; only the findings are kept for the `find_*` methods. `records` and `timings` are passed
+        on to `rules.evaluate_stream`.
+        """
+        tree = cls()
+        tree._args = args
+        tree._configs = args._configs
+        if rules_ is None:
+            rules_ = rules.get_rules(args._configs)
+        tree._findings.update(
+            rules.evaluate_stream(
+                data, rules_, args._configs, prefix=prefix, sep=tree.sep, records=records, timings=timings
+            )
+        )
+        return tree
+
+    @property
+    def data(self) -> Node:
+        return Node(self, ROOT)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def items(self):
+        return self.data.items()
+
+    def to_dict(self) -> dict:
+        """The tree as nested dictionaries"""
+        return self.data.to_dict()
+
+    def _table(self) -> tuple:
+        """What a worker process needs to rebuild the tree (see `_from_table`): the arrays, the string table, the
+        directories, the listings and the index of children"""
+        if self._child_starts is None:
+            self._build_index()
+        return (
+            self._parents, self._names, self._kinds, self._sizes, self._strings, self._directories, self._listings,
+            self._child_starts, self._child_nodes
+        )
+
+    @classmethod
+    def _from_table(cls, table: tuple, configs):
+        tree = cls()
+        tree._configs = configs
+        (tree._parents, tree._names, tree._kinds, tree._sizes, tree._strings, tree._directories, tree._listings,
+         tree._child_starts, tree._child_nodes) = table
+        return tree
+
+    def _add_node(self, parent: int, name: str, kind: int, size: int = -1, mtime: int = -1) -> int:
+        self._parents.append(parent)
+        self._names.append(self._strings.add(name, intern=kind == DIRECTORY))
+        self._kinds.append(kind)
+        self._sizes = self._append_known(self._sizes, size)
+        self._mtimes = self._append_known(self._mtimes, mtime)
+        self._child_starts = None  # index is stale
+        self._rollup = None
+        return len(self._parents) - 1
+
+    def _append_known(self, column, value: int):
+        """Append to a column which is only allocated (filled with -1) once a value is known"""
+        if column is not None:
+            column.append(value)
+        elif value >= 0:
+            column = array.array('q', [-1]) * (len(self._kinds) - 1)
+            column.append(value)
+        return column
+
+    def _directory(self, parent: int, name: str) -> int:
+        """The node for the directory, created if necessary"""
+        name_id = self._strings.find(name)
+        if name_id is not None:
+            index = self._directories.get((parent, name_id))
+            if index is not None:
+                return index
+        index = self._add_node(parent, name, DIRECTORY)
+        self._directories[(parent, self._names[index])] = index
+        return index
+
     def insert(self, dir_entry: os.DirEntry, prefix: str = ''):
         """Insert the path into the tree creating nodes if necessary"""
-        if prefix == '.':
-            path_list = dir_entry.path.strip(self.sep).split(self.sep)
-        else:
-            path_list = dir_entry.path[len(prefix):].strip(self.sep).split(self.sep)
-        # first, deal with directories
-        insertion_point = self.data
-        for element in path_list[:-1]:
-            if element not in insertion_point:
-                insertion_point[element] = dict()
-                insertion_point = insertion_point[element]
-            else:
-                insertion_point = insertion_point[element]
+        if self._findings:  # stale
+            self._findings.clear()
+        path_list = utils.split_path(dir_entry.path, prefix=prefix, sep=self.sep)
+        if path_list == ['']:  # the prefix itself e.g. the first line of a `find` listing
+            return
+        if getattr(dir_entry, 'link', None) is not None or getattr(dir_entry, 'inode', None) is not None:
+            self._links.add(self.sep.join(path_list) + (self.sep if dir_entry.is_dir() else ''), dir_entry)
+        # first, deal with directories; consecutive entries usually share them
+        directories = path_list[:-1]
+        last_directories, parent = self._last_directory
+        if directories != last_directories:
+            parent = ROOT
+            for element in directories:
+                parent = self._directory(parent, element)
+            self._last_directory = (directories, parent)
         # last item
         if dir_entry.is_file():
-            if '_files' not in insertion_point:
-                insertion_point['_files'] = [path_list[-1]]
-            else:
-                insertion_point['_files'] += [path_list[-1]]
-        else:
-            insertion_point[path_list[-1]] = dict()
+            size = getattr(dir_entry, 'size', -1)
+            self._add_node(parent, path_list[-1], FILE, size=size, mtime=getattr(dir_entry, 'mtime', -1))
+            # the file count, extensions and size of the directory are kept up to date as files arrive
+            listing = self._listings.get(parent)
+            if listing is None:
+                listing = self._listings[parent] = rules.Listing(self._file_re())
+            listing.add(path_list[-1], size=size)
+        elif dir_entry.is_dir():
+            self._directory(parent, path_list[-1])
+        else:  # a link which is not entered
+            self._add_node(parent, path_list[-1], LINK)
+
+    def _build_index(self):
+        """Sort node ids by parent so that the children of a node are contiguous"""
+        size = len(self._parents)
+        parents = self._parents
+        starts = array.array('i', bytes(4 * (size + 1)))
+        for index in range(1, size):
+            starts[parents[index] + 1] += 1
+        for index in range(size):
+            starts[index + 1] += starts[index]
+        positions = array.array('i', starts)
+        nodes = array.array('i', bytes(4 * max(size - 1, 0)))
+        for index in range(1, size):
+            parent = parents[index]
+            nodes[positions[parent]] = index
+            positions[parent] += 1
+        self._child_starts, self._child_nodes = starts, nodes
+
+    def children(self, index: int = ROOT):
+        """Node ids of the children of a node in insertion order"""
+        if self._child_starts is None:
+            self._build_index()
+        return self._child_nodes[self._child_starts[index]:self._child_starts[index + 1]]
+
+    def name(self, index: int) -> str:
+        return self._strings[self._names[index]]
+
+    def kind(self, index: int) -> int:
+        return self._kinds[index]
+
+    def size(self, index: int) -> int:
+        """The size of a node in bytes; -1 if unknown"""
+        if self._sizes is None:
+            return -1
+        return self._sizes[index]
+
+    def mtime(self, index: int) -> int:
+        """The modification time of a node in whole seconds since the epoch; -1 if unknown"""
+        if self._mtimes is None:
+            return -1
+        return self._mtimes[index]
+
+    def parent(self, index: int) -> int:
+        return self._parents[index]
+
+    def path(self, index: int) -> str:
+        """The path of a node from the top of the tree"""
+        names = list()
+        while index > ROOT:
+            names.append(self.name(index))
+            index = self._parents[index]
+        return self.sep.join(reversed(names))
+
+    def files(self, index: int = ROOT) -> list:
+        """Names of the files in a directory"""
+        kinds, names = self._kinds, self._names
+        return self._strings.get_many(names[child] for child in self.children(index) if kinds[child] == FILE)
+
+    def file_paths(self, index: int = ROOT):
+        """Paths of the files in a directory and in every directory below it, one directory at a time"""
+        kinds, sep = self._kinds, self.sep
+        stack = [(index, self.path(index))]
+        while stack:
+            index_, path = stack.pop()
+            prefix = f"{path}{sep}" if path else ""
+            directories = list()
+            for child in self.children(index_):
+                if kinds[child] == FILE:
+                    yield prefix + self.name(child)
+                elif kinds[child] == DIRECTORY:
+                    directories.append((child, prefix + self.name(child)))
+            stack.extend(reversed(directories))
+
+    def sizes(self, index: int = ROOT):
+        """Sizes of the files in a directory in the order of `files`; None if no sizes are known"""
+        if self._sizes is None:
+            return None
+        kinds, sizes = self._kinds, self._sizes
+        return [sizes[child] for child in self.children(index) if kinds[child] == FILE]
+
+    def _file_re(self):
+        configs = getattr(self, '_configs', None)
+        return None if configs is None else rules.RuleSet.from_configs(configs).file_re
+
+    def listing(self, index: int = ROOT) -> rules.Listing:
+        """The number of files in a directory and how many there are per extension"""
+        listing = self._listings.get(index)
+        return rules.Listing() if listing is None else listing
+
+    def rollup(self) -> None:
+        """Total the contents of every directory in a single pass from the leaves up
+
+        A node is always added after its parent so visiting the nodes in reverse order reaches every child before its
+        parent; each node then only adds its totals to those of its parent. The totals are kept in arrays indexed by
+        node (see `subtree`) until the tree changes.
+        """
+        if self._rollup is not None:
+            return
+        size = len(self._parents)
+        parents, kinds, sizes, listings = self._parents, self._kinds, self._sizes, self._listings
+        files = array.array('q', bytes(8 * size))
+        directories = array.array('q', bytes(8 * size))
+        total_bytes = array.array('q', bytes(8 * size))
+        depths = array.array('i', bytes(4 * size))
+        extensions = dict()  # directory node -> files per extension below it
+
+        def _merge(index, into):
+            merged = extensions.setdefault(into, dict())
+            for ext, count in extensions.get(index, dict()).items():
+                merged[ext] = merged.get(ext, 0) + count
+
+        for index in range(size - 1, 0, -1):
+            parent = parents[index]
+            if kinds[index] == FILE:
+                files[parent] += 1
+                if sizes is not None and sizes[index] > 0:
+                    total_bytes[parent] += sizes[index]
+                if depths[parent] < 1:
+                    depths[parent] = 1
+                continue
+            if kinds[index] == LINK:
+                continue
+            # all the children of the directory have been seen
+            if index in listings:
+                _merge_listing(extensions.setdefault(index, dict()), listings[index])
+            files[parent] += files[index]
+            directories[parent] += directories[index] + 1
+            total_bytes[parent] += total_bytes[index]
+            if depths[parent] <= depths[index]:
+                depths[parent] = depths[index] + 1
+            _merge(index, parent)
+        if ROOT in listings:
+            _merge_listing(extensions.setdefault(ROOT, dict()), listings[ROOT])
+        self._rollup = files, directories, total_bytes, depths, extensions
+
+    def subtree(self, index: int = ROOT) -> dict:
+        """Totals for everything below a directory: files, directories, bytes (None if sizes are unknown), the number
+        of levels and the files per extension"""
+        self.rollup()
+        files, directories, total_bytes, depths, extensions = self._rollup
+        return {
+            'files': files[index],
+            'directories': directories[index],
+            'bytes': None if self._sizes is None else total_bytes[index],
+            'max_depth': depths[index],
+            'extensions': dict(sorted(extensions.get(index, dict()).items(), key=lambda item: -item[1])),
+        }
+
+    def heaviest(self, count: int = 10, by: str = 'files') -> list:
+        """The `count` directories with the most files, directories or bytes below them, heaviest first"""
+        self.rollup()
+        column = self._rollup[['files', 'directories', 'bytes'].index(by)]
+        kinds = self._kinds
+        return heapq.nlargest(
+            count, (index for index in range(1, len(kinds)) if kinds[index] == DIRECTORY), key=column.__getitem__
+        )
+
+    def lookup_directory(self, index: int, name: str):
+        """The node of the named subdirectory or None"""
+        name_id = self._strings.find(name)
+        if name_id is None:
+            return None
+        return self._directories.get((index, name_id))
+
+    def __sizeof__(self):
+        arrays = (self._parents, self._names, self._kinds, self._sizes, self._mtimes)
+        size = sum(a.__sizeof__() for a in arrays if a is not None)
+        size += self._strings.__sizeof__() + self._directories.__sizeof__() + self._listings.__sizeof__()
+        size += sum(listing.extensions.__sizeof__() for listing in self._listings.values())
+        size += sum(key.__sizeof__() for key in self._directories)
+        if self._child_starts is not None:
+            size += self._child_starts.__sizeof__() + self._child_nodes.__sizeof__()
+        return size
 
-    # @staticmethod
     def file_counts(self, file_list):
-        file_counts = dict()
-        for file_ in file_list:
-            file_match = self._configs.getcre('regex', 'file_re').match(file_)
-            if file_match:
-                ext = file_.split('.')[-1]
-                if ext not in file_counts:
-                    file_counts[ext] = 1
-                else:
-                    file_counts[ext] += 1
-        return file_counts
-
-    def _recursive_string(self, extraction_point, indent=""):
-        string = ""
-        for key, value in extraction_point.items():
-            if isinstance(value, dict):
-                string += f"{indent}└── {key}\n"
-                indent += "\t"
-                string += f" {self._recursive_string(extraction_point=extraction_point[key], indent=indent)}"
-                indent = indent[:-1]
+        return rules.file_counts(file_list, rules.RuleSet.from_configs(self._configs).file_re)
+
+    def _files_line(self, listing, indent, style=False):
+        item = "file" if listing.count == 1 else "files"
+        if self.show_file_counts:
+            file_counts_str = "".join(f"{ext}={count}; " for ext, count in listing.extensions.items())
+            line = f"[{listing.count} {item}: {file_counts_str}]"
+        else:
+            line = f"[{listing.count} {item}]"
+        if style:
+            return f"{indent}└── {_DIM}{line}{_RESET}\n"
+        return f"{indent}└── {line}\n"
+
+    def _entries(self, index):
+        """The child directories of a node and None where its files go, in the order of `Node.items`"""
+        kinds = self._kinds
+        files_seen = False
+        for child in self.children(index):
+            if kinds[child] == DIRECTORY:
+                yield child
+            elif kinds[child] == FILE and not files_seen:
+                files_seen = True
+                yield None
+
+    def _files_lines(self, index, indent, max_children=None, compress=True, style=False):
+        """The names of the files in a directory below its files line; numbered runs as one sequence if `compress`"""
+        names = self.files(index)
+        items = sequences.compress(names) if compress else names
+        for shown, item in enumerate(items):
+            if max_children is not None and shown == max_children:
+                more = f"... {len(items) - shown} more"
+                yield f"{indent}└── {_DIM}{more}{_RESET}\n" if style else f"{indent}└── {more}\n"
+                return
+            yield f"{indent}└── {item}\n"
+
+    def _render(self, index, indent="", depth=1, max_depth=None, max_children=None, files=False, compress=True,
+                style=False):
+        # file names are only decoded with `files`; the files line comes from the listing kept by `insert`
+        listing = self.listing(index)
+        entries = self._entries(index)
+        shown = 0
+        for child in entries:
+            if max_children is not None and shown == max_children:
+                remaining = sum(1 if other is not None else listing.count for other in entries)
+                remaining += 1 if child is not None else listing.count
+                more = f"... {remaining} more"
+                yield f"{indent}└── {_DIM}{more}{_RESET}\n" if style else f"{indent}└── {more}\n"
+                return
+            shown += 1
+            if child is not None:
+                name = self.name(child)
+                yield f"{indent}└── {_DIRECTORY}{name}{_RESET}\n" if style else f"{indent}└── {name}\n"
+                yield _DESCEND
+                if max_depth is None or depth < max_depth:
+                    yield from self._render(
+                        child, indent=f"{indent}\t", depth=depth + 1, max_depth=max_depth, max_children=max_children,
+                        files=files, compress=compress, style=style
+                    )
             else:
-                if len(value) == 1:
-                    item = "file"
-                else:
-                    item = "files"
-                if self.show_file_counts:
-                    file_counts_str = ""
-                    file_counts = self.file_counts(value)
-                    for ext, count in file_counts.items():
-                        file_counts_str += f"{ext}={count}; "
-                    string += f"{indent}└── [{len(value)} {item}: {file_counts_str}]\n"
-                else:
-                    string += f"{indent}└── [{len(value)} {item}]\n"
+                yield self._files_line(listing, indent, style=style)
+                if files:
+                    yield from self._files_lines(
+                        index, f"{indent}\t", max_children=max_children, compress=compress, style=style
+                    )
+
+    def render(self, max_depth=None, max_children=None, files=False, compress=True, style=False):
+        """Yield the tree as text a line at a time
 
-        return string
+        :param max_depth: do not show the contents of directories deeper than this
+        :param max_children: show at most this many entries per directory followed by '... N more'
+        :param files: list the names of the files below the files line of each directory
+        :param compress: list numbered runs of files as one sequence e.g. 'image_[001-100].tif (100 files)'
+        :param style: highlight directory names with ANSI escapes (for terminals)
+        """
+        # the contents of a directory start with a space; an empty directory passes it on to the next line
+        pending = ""
+        for line in self._render(
+                ROOT, max_depth=max_depth, max_children=max_children, files=files, compress=compress, style=style
+        ):
+            if line is _DESCEND:
+                pending = " "
+                continue
+            yield pending + line
+            pending = ""
+        if pending:
+            yield pending
 
     def __str__(self):
         """Print as tree"""
-        string = self._recursive_string(self.data)
-        return string
+        return "".join(self.render())
 
     @staticmethod
     def evaluate_predicate(tree_dict, predicate, parent=""):
@@ -98,204 +707,338 @@ class Tree(UserDict):
             # - tree_dict: the parent directory dictionary
             # - parent_path: string with the path to the dir_entry:
             output += predicate(dir_entry, children_dict, tree_dict, parent)
-            if isinstance(children_dict, (dict, Tree)):
+            if isinstance(children_dict, Mapping):
                 output += Tree.evaluate_predicate(children_dict, predicate, parent=f"{parent}{dir_entry}/")
         return output
 
-    def find_empty_directories(self, include_root=True) -> list:
-        """Identify directories with no files"""
+    def evaluate_rules(self, rules_: list, jobs: int = 1, records=None, backend: str = 'auto', timings=None) -> dict:
+        """Apply all the rules in a single traversal of the tree
+
+        Each directory and file is visited once and only passed to the rules which declared an interest in it; names are
+        classified against all the naming rules in one call. Hits are appended to a list per rule; the lists are also
+        kept on the tree so that the `find_*` methods do not traverse the tree again.
+
+        With `jobs` greater than one the subtrees are evaluated in a pool of processes (see `_evaluate_rules_parallel`).
+        `records` is called with every hit in tree order (see `rules.Dispatch`). Otherwise, unless `backend` is
+        'python', the naming rules are applied to all the names at once with NumPy when it is available (see
+        `_evaluate_names_columnar`). Given `timings`, the seconds spent in the checks of each rule are added to it by
+        rule name.
+        """
+        if jobs > 1:
+            findings = self._evaluate_rules_parallel(rules_, jobs, records=records, timings=timings)
+        else:
+            findings = {rule.name: list() for rule in rules_}
+            if records is None and columnar.use(backend):
+                rules_ = self._evaluate_names_columnar(rules_, findings, timings=timings)
+            sinks = {name: found.append for name, found in findings.items()}
+            if any(rule.targets & rules.BOTH for rule in rules_):
+                dispatch = rules.Dispatch(rules_, self._configs, sinks, records=records, timings=timings)
+                self._evaluate_rules(self.data, dispatch.files, lambda *args_: _on_directory(dispatch, *args_))
+            rules.evaluate_links(rules_, self._links, sinks, records=records, timings=timings)
+        self._findings.update(findings)
+        return findings
+
+    def _evaluation_order(self) -> list:
+        """Node ids in the order `_evaluate_rules` visits them: each directory before its contents and the files of a
+        directory together where the first of them is"""
+        kinds = self._kinds
+        order = list()
+
+        def _visit(index):
+            children = self.children(index)
+            files_seen = False
+            for child in children:
+                if kinds[child] == DIRECTORY:
+                    order.append(child)
+                    _visit(child)
+                elif kinds[child] == FILE and not files_seen:
+                    files_seen = True
+                    order.extend(other for other in children if kinds[other] == FILE)
+
+        _visit(ROOT)
+        return order
+
+    def _evaluate_names_columnar(self, rules_: list, findings: dict, timings=None) -> list:
+        """Apply the naming rules to all the names at once (see `columnar`); returns the rules left to the traversal
+
+        The hits of each rule are picked out of the names in the order of the traversal so that the findings are the
+        same as from `Dispatch`.
+        """
+        named = [rule for rule in rules_ if rule.classified]
+        if not named:
+            return rules_
+        numpy = columnar.numpy
+        ruleset = rules.RuleSet.from_configs(self._configs)
+        order = numpy.array(self._evaluation_order(), dtype=numpy.int64)
+        names = self._strings.get_many(self._names[index] for index in order)
+        is_directory = numpy.frombuffer(self._kinds, dtype=numpy.int8)[order] == DIRECTORY
+        file_positions, directory_positions = numpy.flatnonzero(~is_directory), numpy.flatnonzero(is_directory)
+        file_verdicts = columnar.classify(
+            ruleset, [names[position] for position in file_positions], directory=False,
+            rule_names={rule.name for rule in named if rule.targets & rules.FILES}, timings=timings
+        )
+        directory_verdicts = columnar.classify(
+            ruleset, [names[position] for position in directory_positions], directory=True,
+            rule_names={rule.name for rule in named if rule.targets & rules.DIRECTORIES}, timings=timings
+        )
+        # the path of the parent of each name; a directory is visited before its contents
+        parents, directories = self._parents, is_directory.tolist()
+        paths, parent_paths = {ROOT: ""}, list()
+        for index, name, directory in zip(order.tolist(), names, directories):
+            parent_path = paths[parents[index]]
+            parent_paths.append(parent_path)
+            if directory:
+                paths[index] = f"{parent_path}{name}/"
+        for rule in named:
+            hits = [positions[verdicts[rule.name]] for positions, verdicts in (
+                (file_positions, file_verdicts), (directory_positions, directory_verdicts)
+            ) if rule.name in verdicts]
+            if not hits:
+                continue
+            file_finding, directory_finding = rule.file_finding, rule.directory_finding
+            findings[rule.name].extend(
+                directory_finding(parent_paths[position], names[position]) if directories[position]
+                else file_finding(parent_paths[position], names[position])
+                for position in numpy.sort(numpy.concatenate(hits)).tolist()
+            )
+        return [rule for rule in rules_ if not rule.classified]
+
+    def _evaluate_rules_parallel(self, rules_: list, jobs: int, records=None, timings=None) -> dict:
+        """Evaluate the subtrees in a pool of processes
+
+        The tree is split at the top-level directories or, if there are fewer of them than jobs, at the second level.
+        Each worker gets the node table once (see `_table`) and then only the node of each subtree to evaluate while the
+        few entries above the split are evaluated here. Findings are merged in the order of the tree so they are the
+        same as from a single process.
+        """
+        findings = {rule.name: list() for rule in rules_}
+        recorder = _Recorder(findings)
+        dispatch = rules.Dispatch(
+            rules_, self._configs, dict.fromkeys(findings, _discard), records=recorder.record, timings=timings
+        )
+        top_level = sum(isinstance(children, Mapping) for children in self.data.values())
+        depth = 1 if top_level >= jobs else 2
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs, initializer=_init_worker,
+                initargs=(self._configs, list(findings), self._table(), timings is not None)
+        ) as executor:
+            parts = list()
+
+            def _split(node, parent, level):
+                for name, children in node.items():
+                    if not isinstance(children, Mapping):  # the list of files
+                        parts.append(recorder.collect_records(
+                            dispatch.files, parent, children, node.listing(), node.sizes()
+                        ))
+                    elif level < depth:
+                        parts.append(recorder.collect_records(_on_directory, dispatch, parent, name, children))
+                        _split(children, f"{parent}{name}/", level + 1)
+                    else:
+                        parts.append(executor.submit(_evaluate_subtree, parent, children.index))
 
-        def empty_directories_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if len(children_dict) == 0:  # terminal empty folder
-                output.append(f"{parent_path}{dir_entry}/")
-            if len(children_dict) == 1:  # non-terminal folder with files only
-                if "_files" not in children_dict and not isinstance(children_dict, list):
-                    output.append(f"{parent_path}{dir_entry}/")
-            return output
+            _split(self.data, "", 1)
+            for part in parts:
+                if isinstance(part, concurrent.futures.Future):
+                    part, spent = part.result()
+                    for rule_name, seconds in (spent or dict()).items():
+                        timings[rule_name] = timings.get(rule_name, 0.0) + seconds
+                for rule_name, kind, finding in part:
+                    findings[rule_name].append(finding)
+                    if records is not None:
+                        records(rule_name, kind, finding)
+        rules.evaluate_links(
+            rules_, self._links, {name: found.append for name, found in findings.items()}, records=records,
+            timings=timings
+        )
+        return findings
 
-        empty_dirs = Tree.evaluate_predicate(self, empty_directories_predicate)
+    def evaluate_rules_since(self, rules_: list, previous: dict = None, timings=None) -> tuple:
+        """Apply the rules reusing the results of a previous run for unchanged directories
+
+        The results of a run are kept per directory together with a signature of its children. A directory whose
+        signature has not changed gets the findings it had before without calling any rule; only added or changed
+        directories are evaluated and directories which have gone are dropped. Findings are the same, in the same order,
+        as `evaluate_rules` would give. Previous results made with other rules or configs are ignored.
+
+        :param rules_: the rules to apply
+        :param previous: the results of a previous run as returned by this method
+        :param timings: add the seconds spent in the checks of each rule to this dictionary
+        :return: the findings per rule name and the results to pass to the next run
+        """
+        fingerprint = rules.fingerprint(rules_, self._configs)
+        old = dict()
+        if previous is not None and previous.get('fingerprint') == fingerprint:
+            old = previous['directories']
+        findings = {rule.name: list() for rule in rules_}
+        directories = dict()
+        recorder = _Recorder(findings)
+        dispatch = rules.Dispatch(rules_, self._configs, recorder.sinks(), timings=timings)
+
+        def _replay(recorded):
+            for rule_name, found in recorded.items():
+                findings[rule_name].extend(found)
+
+        def _evaluate(function, *args_):
+            recorded = recorder.collect(function, *args_)
+            _replay(recorded)
+            return recorded
+
+        def _walk(node, path, signature, own_findings, record):
+            # record: [signature, findings on the directory itself, findings on its files] or None if changed
+            files_findings = dict()
+            for name, children in node.items():
+                if not isinstance(children, Mapping):  # the list of files
+                    if record is not None:
+                        files_findings = record[2]
+                        _replay(files_findings)
+                    else:
+                        files_findings = _evaluate(dispatch.files, path, children, node.listing(), node.sizes())
+                    continue
+                child_path = f"{path}{name}/"
+                child_signature = self._signature(children)
+                child_record = old.get(child_path)
+                if child_record is not None and child_record[0] == child_signature:
+                    child_own = child_record[1]
+                    _replay(child_own)
+                else:
+                    child_record = None
+                    child_own = _evaluate(_on_directory, dispatch, path, name, children)
+                _walk(children, child_path, child_signature, child_own, child_record)
+            directories[path] = [signature, own_findings, files_findings]
+
+        root_signature = self._signature(self.data)
+        root_record = old.get("")
+        if root_record is None or root_record[0] != root_signature:
+            root_record = None
+        _walk(self.data, "", root_signature, dict(), root_record)
+        # links are found among all the entries; they are not kept per directory
+        rules.evaluate_links(
+            rules_, self._links, {name: found.append for name, found in findings.items()}, timings=timings
+        )
+        self._findings.update(findings)
+        return findings, {'fingerprint': fingerprint, 'directories': directories}
+
+    @staticmethod
+    def _signature(node) -> str:
+        """Identify the names (and sizes if known) of the children of a directory"""
+        digest = hashlib.blake2b(digest_size=16)
+        for name, children in node.items():
+            if isinstance(children, Mapping):
+                digest.update(f"{name}/\0".encode('utf-8', 'surrogatepass'))
+            else:
+                digest.update("\0".join(children).encode('utf-8', 'surrogatepass'))
+                digest.update(b"\0\0")
+                sizes = node.sizes() if isinstance(node, Node) else None
+                if sizes is not None:
+                    digest.update(array.array('q', sizes).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _evaluate_rules(tree_dict, on_files, on_directory, parent=""):
+        """Call `on_files` with the files of every directory and `on_directory` with every directory, in tree order"""
+        for name, children in tree_dict.items():
+            if not isinstance(children, Mapping):  # the list of files
+                if isinstance(tree_dict, Node):
+                    on_files(parent, children, tree_dict.listing(), tree_dict.sizes())
+                else:
+                    on_files(parent, children)
+                continue
+            on_directory(parent, name, children)
+            Tree._evaluate_rules(children, on_files, on_directory, parent=f"{parent}{name}/")
+
+    def _find(self, rule_class) -> list:
+        """Findings for a single rule; evaluated on demand unless already available"""
+        if rule_class.name not in self._findings:
+            self.evaluate_rules([rule_class(self._configs)])
+        return self._findings[rule_class.name]
+
+    def find_empty_directories(self, include_root=True) -> list:
+        """Identify directories with no files"""
+        empty_dirs = self._find(rules.EmptyDirectories)
         if include_root:
             return empty_dirs
-        return empty_dirs[1:]
+        return [empty_dir for empty_dir in empty_dirs if rules.EmptyDirectories.below_root(empty_dir, sep=self.sep)]
 
     def find_obvious_directories(self, include_root=True) -> list:
         """Identify directories with obvious names"""
-
-        def obvious_directories_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if self._configs.getcre('regex', 'obvious_files_re').match(dir_entry):
-                output.append(f"{parent_path}{dir_entry}/")
-            return output
-
-        obvious_directories = Tree.evaluate_predicate(self, obvious_directories_predicate)
-        return obvious_directories
+        return self._find(rules.ObviousDirectories)
 
     def find_excessive_files_per_directory(self) -> list:
         """Identify directories with excessive files"""
-
-        def excessive_files_per_directory_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if dir_entry == '_files':  # in parent_dict:
-                if len(parent_dict['_files']) > self._configs.getint('bandbox', 'max_files'):
-                    # fixme: presentation logic bled in ---> remove
-                    # dir_name = parent_path.ljust(LEFT_COL_WIDTH)
-                    # num_files = f"[{len(parent_dict['_files'])} files]"
-                    # output.append(f"{dir_name}{num_files.rjust(RIGHT_COL_WIDTH - 3)}")
-                    output.append(f"{parent_path}")
-            return output
-
-        excess = Tree.evaluate_predicate(self, excessive_files_per_directory_predicate)
-        return excess
+        return self._find(rules.ExcessiveFilesPerDirectory)
 
     def find_long_names(self) -> list:
         """Identify path elements with long names"""
-
-        def long_names_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if dir_entry == '_files':
-                for file in parent_dict['_files']:
-                    if len(file) > self._configs.getint('bandbox', 'max_name_length'):
-                        output.append(f"{parent_path}{file}")
-            if len(dir_entry) > self._configs.getint('bandbox', 'max_name_length'):
-                output.append(f"{parent_path}{dir_entry}/")
-            return output
-
-        long_names = Tree.evaluate_predicate(self, long_names_predicate)
-        return long_names
+        return self._find(rules.LongNames)
 
     def find_directories_with_mixed_files(self) -> list:
-        def directories_with_mixed_files_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if dir_entry == '_files':
-                files = self.file_counts(parent_dict['_files'])
-                if len(files) > 1:
-                    output.append(f"{parent_path}")
-            return output
-
-        mixed_dirs = Tree.evaluate_predicate(self, directories_with_mixed_files_predicate)
-        return mixed_dirs
+        return self._find(rules.DirectoriesWithMixedFiles)
 
     def find_with_date_names(self) -> list:
-
-        def date_names_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if dir_entry == '_files':
-                for file in parent_dict['_files']:
-                    for date_re in map(lambda r: re.compile(r), self._configs.getlist('regex', 'date_re')):
-                        if date_re.match(file):
-                            output.append(f"{parent_path}{file}")
-            return output
-
-        date_names = list(set(Tree.evaluate_predicate(self, date_names_predicate)))
-        return date_names
+        return self._find(rules.DateNames)
 
     def find_accessions_in_names(self) -> list:
-        def accessions_in_names_predicate(dir_entry, chidren_dict, parent_dict, parent_path):
-            output = list()
-            if dir_entry == '_files':
-                for file in parent_dict['_files']:
-                    if self._configs.getcre('regex', 'accession_names_re').match(file):
-                        output.append(f"{parent_path}{file}")
-            return output
-
-        accession_names = Tree.evaluate_predicate(self, accessions_in_names_predicate)
-        return accession_names
+        return self._find(rules.AccessionsInNames)
 
     def find_mixed_case(self) -> list:
         """Find elements of the tree with names having mixed case"""
-
-        def mixed_case_predicate(dir_entry, children_dict, parent_dict,
-                                 parent_path):  # assertion callback for this 'find...' method
-            output = list()
-            if dir_entry == '_files':  # file contents
-                for file in parent_dict['_files']:
-                    # exclude the file extension
-                    _file = file.rsplit('.', 1)[0]
-                    if re.match(r".*[A-Z].*", _file) and re.match(r".*[a-z].*", _file):  # mixed case
-                        output.append(f"{parent_path}{file}")
-            if re.match(r".*[A-Z].*", dir_entry) and re.match(r".*[a-z].*", dir_entry):  # if the dirname has mixed case
-                output.append(f"{parent_path}{dir_entry}/")
-            return output
-
-        mixed_case = Tree.evaluate_predicate(self, mixed_case_predicate)
-        return mixed_case
+        return self._find(rules.MixedCase)
 
     def find_odd_characters_in_names(self):
         """Find odd characters in path components"""
-
-        def odd_characters_in_names_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if dir_entry == '_files':
-                for file in parent_dict['_files']:
-                    if self._configs.getcre('regex', 'odd_chars_re').match(file):
-                        output.append(f"{parent_path}{file}")
-            if self._configs.getcre('regex', 'odd_chars_re').match(dir_entry):
-                output.append(f"{parent_path}{dir_entry}/")
-            return output
-
-        odd_characters = Tree.evaluate_predicate(self, odd_characters_in_names_predicate)
-        return odd_characters
+        return self._find(rules.OddCharactersInNames)
 
     def find_excessive_periods_in_names(self):
         """Find odd characters in path components"""
-
-        def excessive_periods_in_names_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if dir_entry == '_files':
-                for file in parent_dict['_files']:
-                    if self._configs.getcre('regex', 'periods_in_name_fewer_than_re').match(file):
-                        output.append(f"{parent_path}{file}")
-            if self._configs.getcre('regex', 'periods_in_name_fewer_than_re').match(dir_entry):
-                output.append(f"{parent_path}{dir_entry}/")
-            return output
-
-        odd_characters = Tree.evaluate_predicate(self, excessive_periods_in_names_predicate)
-        return odd_characters
+        return self._find(rules.ExcessivePeriodsInNames)
 
     def find_external_references_in_names(self):
         """Find external references in names"""
-
-        def external_references_in_names_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if dir_entry == '_files':
-                for file in parent_dict['_files']:
-                    if self._configs.getcre('regex', 'external_refs_re').match(file):
-                        output.append(f"{parent_path}{file}")
-            if self._configs.getcre('regex', 'external_refs_re').match(dir_entry):
-                output.append(f"{parent_path}{dir_entry}/")
-            return output
-
-        external_refs = Tree.evaluate_predicate(self, external_references_in_names_predicate)
-        return external_refs
+        return self._find(rules.ExternalReferencesInNames)
 
     def find_unknown_file_extensions(self):
         """Find unknown file extensions"""
-        def unknown_file_extensions_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if dir_entry == '_files':
-                for file in parent_dict['_files']:
-                    if not self._configs.getcre('regex', 'file_extension_re').match(file):
-                        output.append(f"{parent_path}{file}")
-            return output
-
-        unknown_exts = Tree.evaluate_predicate(self, unknown_file_extensions_predicate)
-        return unknown_exts
+        return self._find(rules.UnknownFileExtensions)
 
     def find_non_ascii_characters(self):
         """Find files/folders with non-ascii characters
 
         The heuristic is that if the length of the string is equal to utf-8-encoded byte string then it's ascii
         """
-        def non_ascii_character_predicate(dir_entry, children_dict, parent_dict, parent_path):
-            output = list()
-            if dir_entry == '_files':
-                for file in parent_dict['_files']:
-                    if len(file) != len(file.encode('utf-8')):
-                        output.append(file)
-            if len(dir_entry) != len(dir_entry.encode('utf-8')):
-                output.append(dir_entry)
-            return output
-
-        non_ascii_characters = Tree.evaluate_predicate(self, non_ascii_character_predicate)
-        return non_ascii_characters
+        return self._find(rules.NonAsciiCharacters)
+
+    def find_cryptic_names(self):
+        """Find names in which most of the words are not known"""
+        return self._find(rules.CrypticNames)
+
+    def find_inconsistent_names(self):
+        """Find files named unlike most of their siblings"""
+        return self._find(rules.InconsistentNames)
+
+    def find_missing_padding(self):
+        """Find numbered files without leading zeros"""
+        return self._find(rules.MissingPadding)
+
+    def find_hard_links(self):
+        """Find groups of paths to the same file (hard links); only files whose inode was read are checked"""
+        return self._find(rules.HardLinks)
+
+    def find_symbolic_links(self):
+        """Find symbolic links"""
+        return self._find(rules.SymbolicLinks)
+
+    def find_broken_symbolic_links(self):
+        """Find symbolic links which point to nothing"""
+        return self._find(rules.BrokenSymbolicLinks)
+
+    def find_small_files(self):
+        """Find files smaller than the minimum size; only files whose size is known are checked"""
+        return self._find(rules.SmallFiles)
+
+    def find_large_files(self):
+        """Find files larger than the maximum size"""
+        return self._find(rules.LargeFiles)
+
+    def find_large_directories(self):
+        """Find directories whose files add up to more than the maximum size"""
+        return self._find(rules.LargeDirectories)
@@ -0,0 +1,162 @@
+"""
+Profiling of a run (`--profile`)
+
+A `Profile` times the phases of a run (wall and CPU time), keeps counters and records the peak memory. Phases are
+timed with `Profile.phase` or, for the scan which is consumed lazily while the tree is built, by timing each step of
+the iteration with `Profile.iterate`. The time of a phase excludes the phases within it so that e.g. building the tree
+does not include the scan feeding it. The time spent in the checks of each rule is reported too (see `rules.timed`).
+A disabled profile does nothing so that the code paths stay the same.
+"""
+import contextlib
+import cProfile
+import collections
+import json
+import sys
+import time
+import tracemalloc
+
+
+def peak_rss_kb():
+    """The peak resident set size of the process in KiB or None if it cannot be read
+
+    `resource` only exists on Unix so it is imported here rather than with the module.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS
+
+
+class Profile:
+    """Per-phase timings, counters and peak memory of a run
+
+    :param enabled: whether to record anything at all
+    :param trace_memory: trace Python allocations with `tracemalloc` (slow) in addition to the peak RSS; always on if
+        the peak RSS cannot be read
+    :param cprofile_path: also run `cProfile` and dump its statistics to this file
+    """
+
+    def __init__(self, enabled: bool = False, trace_memory: bool = False, cprofile_path: str = None):
+        self.enabled = enabled
+        self.trace_memory = enabled and (trace_memory or peak_rss_kb() is None)
+        self.cprofile_path = cprofile_path if enabled else None
+        self.phases = dict()  # name -> [wall, cpu]
+        self.counters = collections.Counter()
+        self.results = dict()  # rule name -> number of findings
+        self.rules = dict()  # rule name -> seconds spent in its checks
+        self._nested = list()  # [wall, cpu] of the phases within each open phase
+        self._profiler = None
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            enabled=getattr(args, 'profile', False), trace_memory=getattr(args, 'trace_memory', False),
+            cprofile_path=getattr(args, 'cprofile', None)
+        )
+
+    def start(self) -> None:
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.cprofile_path:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self) -> None:
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.cprofile_path)
+            self._profiler = None
+
+    def add(self, name: str, wall: float, cpu: float) -> None:
+        """Add time to a phase"""
+        times = self.phases.setdefault(name, [0.0, 0.0])
+        times[0] += wall
+        times[1] += cpu
+        if self._nested:
+            self._nested[-1][0] += wall
+            self._nested[-1][1] += cpu
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block"""
+        if not self.enabled:
+            yield
+            return
+        self._nested.append([0.0, 0.0])
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            nested_wall, nested_cpu = self._nested.pop()
+            self.add(name, wall - nested_wall, cpu - nested_cpu)
+            if self._nested:
+                self._nested[-1][0] += nested_wall
+                self._nested[-1][1] += nested_cpu
+
+    def iterate(self, iterable, name: str):
+        """Yield from `iterable` timing only the time spent producing the items; counts items and directories"""
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        wall = cpu = 0.0
+        entries = directories = 0
+        perf_counter, process_time = time.perf_counter, time.process_time
+        try:
+            while True:
+                wall_start, cpu_start = perf_counter(), process_time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    wall += perf_counter() - wall_start
+                    cpu += process_time() - cpu_start
+                entries += 1
+                directories += item.is_dir()
+                yield item
+        finally:
+            self.add(name, wall, cpu)
+            self.counters['entries'] += entries
+            self.counters['directories'] += directories
+
+    def summary(self) -> dict:
+        """The profile as a dictionary"""
+        phases = {name: {'wall': wall, 'cpu': cpu} for name, (wall, cpu) in self.phases.items()}
+        counters = dict(self.counters)
+        scan_wall = self.phases.get('scan', [0.0])[0]
+        if scan_wall:
+            counters['entries_per_second'] = self.counters['entries'] / scan_wall
+        memory = dict()
+        peak_rss = peak_rss_kb()
+        if peak_rss is not None:
+            memory['peak_rss_kb'] = peak_rss
+        if self.trace_memory and tracemalloc.is_tracing():
+            memory['peak_traced_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        return {
+            'phases': phases, 'counters': counters, 'rules': dict(self.rules), 'results': dict(self.results),
+            'memory': memory
+        }
+
+    def report(self, path: str = None) -> None:
+        """Print the summary to stderr or write it as JSON to `path`"""
+        summary = self.summary()
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(summary, f, indent=4)
+            return
+        print("profile:", file=sys.stderr)
+        for name, times in summary['phases'].items():
+            print(f"  {name:<50} {times['wall']:>10.3f}s wall {times['cpu']:>10.3f}s cpu", file=sys.stderr)
+        for name, value in summary['counters'].items():
+            value = f"{value:.1f}" if isinstance(value, float) else value
+            print(f"  {name:<50} {value:>10}", file=sys.stderr)
+        for name, seconds in sorted(summary['rules'].items(), key=lambda item: -item[1]):
+            print(f"  rule {name:<45} {seconds:>10.3f}s wall", file=sys.stderr)
+        for name, value in summary['results'].items():
+            print(f"  results {name:<42} {value:>10}", file=sys.stderr)
+        for name, value in summary['memory'].items():
+            print(f"  {name:<50} {value:>10}", file=sys.stderr)
@@ -0,0 +1,935 @@
+"""
+Rules are the individual checks that engines report on.
+
+Each rule declares the entries it looks at (`FILES`, `DIRECTORIES` or `BOTH`) so that `Tree.evaluate_rules` can apply
+every enabled rule in a single traversal of the tree and only call the checks that apply to each entry. A rule
+implements one or more of the following checks, each returning a boolean:
+
+- `check_file(name)`: called for every file name;
+- `check_size(size)`: called with the size in bytes of every file whose size is known (see `utils.Entry`);
+- `check_listing(listing)`: called once with the `Listing` summary (file count and extensions) of a directory;
+- `check_directory(name, children)`: called for every directory with its children.
+
+Hits are sent to a per-rule sink as path strings: files as `parent/name`, directories as `parent/name/` and file
+listings as the path of the containing directory `parent/`.
+
+Rules on links (`LINKS`) look at all the entries at once: `check_links(links)` is called once all of them have been
+seen with the `Links` found among them and returns the findings.
+
+Rules which only look at a name (`classified = True`) are not called one by one during the traversal. Instead, the
+`RuleSet` built once from the configs classifies each name against all of them in one call using precompiled
+patterns.
+
+The time spent in the checks of each rule can be added up in a `timings` dictionary (see `timed`) to find the slow ones.
+
+Rules can also be applied while entries are being scanned (`evaluate_stream`) without building a tree: names are
+checked as they arrive and only a `Listing` per open directory is kept until the directory is finished.
+"""
+import hashlib
+import re
+import time
+
+from bandbox import utils, words
+
+FILES = 1
+DIRECTORIES = 2
+BOTH = FILES | DIRECTORIES
+LINKS = 4
+# the key of the file names of a directory in the nested tree; names never hold the separator so no directory has it
+FILES_KEY = '_files/'
+
+# default size thresholds
+MIN_FILE_SIZE = '1'
+MAX_FILE_SIZE = '100G'
+MAX_DIRECTORY_SIZE = '1T'
+# names of checksum manifests for configs which do not set checksum_manifest_re
+CHECKSUM_ALGORITHMS = 'md5|sha1|sha224|sha256|sha384|sha512'
+# directories with fewer files of a type are not checked for inconsistent names
+MIN_SIBLINGS = '5'
+# names shaped like at most this fraction of their siblings (of the same type) are inconsistent
+MINORITY_SHAPE_FRACTION = '0.1'
+# names in which fewer than this fraction of the words are known are cryptic; 0 switches the check off
+MIN_KNOWN_WORDS = '0'
+CHECKSUM_MANIFEST_RE = rf"(?i)^(.*\.({CHECKSUM_ALGORITHMS})|({CHECKSUM_ALGORITHMS})sums?(\.txt)?|checksums?(\.txt)?)$"
+
+# kinds of entries in records
+FILE = 'file'
+DIRECTORY = 'directory'
+
+_UPPER_RE = re.compile(r".*[A-Z].*")
+_LOWER_RE = re.compile(r".*[a-z].*")
+_GLOBAL_FLAGS_RE = re.compile(r"^\(\?([aiLmsux]+)\)")
+_BACKREFERENCE_RE = re.compile(r"\\\d|\(\?P=")
+_LETTERS_RE = re.compile(r"[^\W\d_]+")
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def _scoped(pattern: str) -> str:
+    """Turn leading global flags e.g. '(?i)...' into a scoped group '(?i:...)' so patterns can be combined"""
+    flags = _GLOBAL_FLAGS_RE.match(pattern)
+    if flags:
+        return f"(?{flags.group(1)}:{pattern[flags.end():]})"
+    return f"(?:{pattern})"
+
+
+class RuleSet:
+    """The configured patterns compiled once
+
+    Holds the compiled regular expressions and thresholds used by the rules and classifies a name against all the
+    naming rules in one call. The date patterns are combined into a single alternation so that a name is scanned once
+    for all of them.
+    """
+
+    def __init__(self, configs):
+        self._configs = configs
+        self.max_files = configs.getint('bandbox', 'max_files')
+        self.max_name_length = configs.getint('bandbox', 'max_name_length')
+        # sizes may be given with units e.g. '100G'; configs from before size rules existed get the defaults
+        self.min_file_size = utils.parse_size(configs.get('bandbox', 'min_file_size', fallback=MIN_FILE_SIZE))
+        self.max_file_size = utils.parse_size(configs.get('bandbox', 'max_file_size', fallback=MAX_FILE_SIZE))
+        self.max_directory_size = utils.parse_size(
+            configs.get('bandbox', 'max_directory_size', fallback=MAX_DIRECTORY_SIZE)
+        )
+        self.file_re = configs.getcre('regex', 'file_re')
+        self.file_extension_re = configs.getcre('regex', 'file_extension_re')
+        self.obvious_files_re = configs.getcre('regex', 'obvious_files_re')
+        self.accession_names_re = configs.getcre('regex', 'accession_names_re')
+        self.odd_chars_re = configs.getcre('regex', 'odd_chars_re')
+        self.periods_in_name_fewer_than_re = configs.getcre('regex', 'periods_in_name_fewer_than_re')
+        self.external_refs_re = configs.getcre('regex', 'external_refs_re')
+        self.checksum_manifest_re = configs.getcre('regex', 'checksum_manifest_re', fallback=None) or re.compile(
+            CHECKSUM_MANIFEST_RE
+        )
+        self.min_siblings = int(configs.get('bandbox', 'min_siblings', fallback=MIN_SIBLINGS))
+        self.minority_shape_fraction = float(
+            configs.get('bandbox', 'minority_shape_fraction', fallback=MINORITY_SHAPE_FRACTION)
+        )
+        self.min_known_words = float(configs.get('bandbox', 'min_known_words', fallback=MIN_KNOWN_WORDS))
+        self.word_lists = [path for path in configs.getlist('bandbox', 'word_lists', fallback=[]) if path]
+        self.vocabulary = [word for word in configs.get('bandbox', 'vocabulary', fallback='').split('|') if word]
+        self.date_res = list(map(lambda r: re.compile(r), configs.getlist('regex', 'date_re')))
+        self.date_re = _alternation(self.date_res)
+        self._classifiers = dict()
+        self._words = None
+
+    @property
+    def words(self) -> words.WordIndex:
+        """The index of known words; opened on first use so that it is only loaded if a rule needs it"""
+        if self._words is None:
+            self._words = words.WordIndex.open(word_lists=self.word_lists, vocabulary=self.vocabulary)
+        return self._words
+
+    def is_cryptic(self, name: str) -> bool:
+        """True if fewer than `min_known_words` of the words in the name are known; never if it is 0"""
+        if not self.min_known_words:
+            return False
+        known = self.words.known_fraction(name)
+        return known is not None and known < self.min_known_words
+
+    @classmethod
+    def from_configs(cls, configs):
+        """The rule set for these configs; compiled on first use only"""
+        ruleset = getattr(configs, '_ruleset', None)
+        if ruleset is None:
+            ruleset = cls(configs)
+            configs._ruleset = ruleset
+        return ruleset
+
+    def _predicates(self, directory=False) -> list:
+        """(rule name, predicate) for every naming rule applicable to files or directories"""
+        max_name_length = self.max_name_length
+        file_extension_match = self.file_extension_re.match
+        predicates = [
+            ('long_names', lambda name: len(name) > max_name_length),
+            ('odd_characters_in_names', self.odd_chars_re.match),
+            ('excessive_periods_in_names', self.periods_in_name_fewer_than_re.match),
+            ('external_references_in_names', self.external_refs_re.match),
+            ('non_ascii_characters', lambda name: len(name) != len(name.encode('utf-8'))),
+        ]
+        if directory:
+            predicates += [
+                ('obvious_directories', self.obvious_files_re.match),
+                ('mixed_case', is_mixed_case),
+                ('cryptic_names', self.is_cryptic),
+            ]
+        else:
+            predicates += [
+                ('date_names', self.date_re.match),
+                ('accessions_in_names', self.accession_names_re.match),
+                ('mixed_case', lambda name: is_mixed_case(name.rsplit('.', 1)[0])),
+                ('unknown_file_extensions', lambda name: file_extension_match(name) is None),
+                ('cryptic_names', lambda name: self.is_cryptic(name.rsplit('.', 1)[0])),
+            ]
+        return predicates
+
+    def classifier(self, directory: bool = False, names=None, timings: dict = None):
+        """A function returning the names of all the naming rules matching a name
+
+        :param directory: whether the names to classify are directories
+        :param names: restrict the classification to these rules
+        :param timings: add the time spent in each rule to this dictionary (see `timed`)
+        """
+        key = (directory, None if names is None else frozenset(names))
+        if key not in self._classifiers or timings is not None:
+            predicates = [
+                (rule_name, predicate if timings is None else timed(predicate, rule_name, timings))
+                for rule_name, predicate in self._predicates(directory=directory)
+                if key[1] is None or rule_name in key[1]
+            ]
+
+            def classify(name):
+                return [rule_name for rule_name, predicate in predicates if predicate(name)]
+
+            if timings is not None:  # not kept
+                return classify
+            self._classifiers[key] = classify
+        return self._classifiers[key]
+
+    def classify(self, name: str, directory: bool = False, names=None) -> list:
+        """The names of all the naming rules matching `name`"""
+        return self.classifier(directory=directory, names=names)(name)
+
+
+def _alternation(patterns: list):
+    """Combine patterns into a single alternation; patterns using backreferences are matched one after the other"""
+    if not any(_BACKREFERENCE_RE.search(p.pattern) for p in patterns):
+        try:
+            return re.compile("|".join(_scoped(p.pattern) for p in patterns))
+        except re.error:
+            pass
+
+    class _Any:
+        pattern = None
+
+        @staticmethod
+        def match(name):
+            for p in patterns:
+                found = p.match(name)
+                if found:
+                    return found
+            return None
+
+    return _Any()
+
+
+class Listing:
+    """Summary of the files in a directory: how many, how many per extension and their total size in bytes (of those
+    whose size is known)"""
+    __slots__ = ('count', 'extensions', 'size', '_file_re')
+
+    def __init__(self, file_re=None):
+        self.count = 0
+        self.extensions = dict()
+        self.size = 0
+        self._file_re = file_re
+
+    @classmethod
+    def from_files(cls, files: list, file_re, sizes=None):
+        listing = cls(file_re)
+        listing.count = len(files)
+        listing.extensions = file_counts(files, file_re)
+        if sizes is not None:
+            listing.size = sum(size for size in sizes if size > 0)
+        return listing
+
+    def add(self, name: str, size: int = -1) -> None:
+        self.count += 1
+        if size > 0:
+            self.size += size
+        if self._file_re is not None and self._file_re.match(name):
+            ext = name.split('.')[-1]
+            self.extensions[ext] = self.extensions.get(ext, 0) + 1
+
+
+class Links:
+    """The links among the entries: symbolic links, those which are broken and the paths of files sharing an inode"""
+    __slots__ = ('symlinks', 'broken', 'inodes')
+
+    def __init__(self):
+        self.symlinks = list()
+        self.broken = list()
+        self.inodes = dict()  # (st_dev, st_ino) -> paths
+
+    def add(self, path: str, entry) -> None:
+        """Record an entry if it is a link; `path` is how it is reported"""
+        link = getattr(entry, 'link', None)
+        if link is not None:
+            self.symlinks.append(path)
+            if link == utils.BROKEN_SYMLINK:
+                self.broken.append(path)
+        inode = getattr(entry, 'inode', None)
+        if inode is not None:
+            self.inodes.setdefault(inode, list()).append(path)
+
+    def hard_links(self) -> list:
+        """The paths of the files with more than one hard link grouped by inode in the order they were found"""
+        return list(self.inodes.values())
+
+
+class Siblings:
+    """The files of a directory grouped by the shape of their names
+
+    The shape of a name is its stem with every run of letters replaced by 'a' and every run of digits by '9' e.g.
+    'FoilHole_1234_Data_0001.mrc' -> 'a_9_a_9'. Names are grouped by extension and shape in one pass so that
+    comparing siblings costs about the number of files rather than the number of pairs of files.
+    """
+    __slots__ = ('names', '_groups')
+
+    def __init__(self, names: list):
+        self.names = names
+        self._groups = None
+
+    @property
+    def groups(self) -> dict:
+        """extension -> shape -> positions of the names with that shape"""
+        if self._groups is None:
+            groups = dict()
+            for position, name in enumerate(self.names):
+                extension, shape = name_shape(name)
+                groups.setdefault(extension, dict()).setdefault(shape, list()).append(position)
+            self._groups = groups
+        return self._groups
+
+
+def _split_extension(name: str) -> tuple:
+    stem, period, extension = name.rpartition('.')
+    if not period or not stem:  # no extension or a hidden file
+        return name, ''
+    return stem, extension
+
+
+def name_shape(name: str) -> tuple:
+    """The lower case extension of a name and the shape of its stem (see `Siblings`)"""
+    stem, extension = _split_extension(name)
+    return extension.lower(), _LETTERS_RE.sub('a', _DIGITS_RE.sub('9', stem))
+
+
+def file_counts(file_list, file_re) -> dict:
+    """Count the files in the list by extension"""
+    counts = dict()
+    for file_ in file_list:
+        if file_re.match(file_):
+            ext = file_.split('.')[-1]
+            if ext not in counts:
+                counts[ext] = 1
+            else:
+                counts[ext] += 1
+    return counts
+
+
+def is_mixed_case(name: str) -> bool:
+    """True if the name has both upper and lower case characters"""
+    return bool(_UPPER_RE.match(name) and _LOWER_RE.match(name))
+
+
+class Rule:
+    """Base class for all rules"""
+    name = None
+    targets = BOTH
+    classified = False  # verdict given by RuleSet.classify
+    stat = False  # needs what the scan reads with stat (sizes, inodes...)
+
+    def __init__(self, configs):
+        self._configs = configs
+        self._ruleset = RuleSet.from_configs(configs)
+
+    def check_file(self, name: str) -> bool:
+        return False
+
+    def check_size(self, size: int) -> bool:
+        return False
+
+    def check_listing(self, listing: Listing) -> bool:
+        return False
+
+    def check_directory(self, name: str, children) -> bool:
+        return False
+
+    def check_links(self, links: Links) -> list:
+        return list()
+
+    def check_siblings(self, siblings: Siblings) -> list:
+        """The names of the files of a directory which stand out from their siblings"""
+        return list()
+
+    def file_finding(self, parent_path: str, name: str) -> str:
+        """The string sent to the sink for a file hit"""
+        return f"{parent_path}{name}"
+
+    def directory_finding(self, parent_path: str, name: str) -> str:
+        """The string sent to the sink for a directory hit"""
+        return f"{parent_path}{name}/"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} '{self.name}'>"
+
+
+class EmptyDirectories(Rule):
+    """Directories with no files"""
+    name = 'empty_directories'
+    targets = DIRECTORIES
+
+    def check_directory(self, name, children):
+        if len(children) == 0:  # terminal empty folder
+            return True
+        if len(children) == 1:  # non-terminal folder with a single directory
+            return FILES_KEY not in children and not isinstance(children, list)
+        return False
+
+    @staticmethod
+    def below_root(finding: str, sep: str = '/') -> bool:
+        """Whether the directory is below the top level; top-level directories have a single separator"""
+        return finding.count(sep) > 1
+
+
+class ObviousDirectories(Rule):
+    """Directories with obvious names"""
+    name = 'obvious_directories'
+    targets = DIRECTORIES
+    classified = True
+
+    def check_directory(self, name, children):
+        return bool(self._ruleset.obvious_files_re.match(name))
+
+
+class ExcessiveFilesPerDirectory(Rule):
+    """Directories with more files than allowed"""
+    name = 'excessive_files_per_directory'
+    targets = FILES
+
+    def check_listing(self, listing):
+        return listing.count > self._ruleset.max_files
+
+
+class DirectoriesWithMixedFiles(Rule):
+    """Directories with files of more than one type"""
+    name = 'directories_with_mixed_files'
+    targets = FILES
+
+    def check_listing(self, listing):
+        return len(listing.extensions) > 1
+
+
+class LongNames(Rule):
+    """Path elements with long names"""
+    name = 'long_names'
+    targets = BOTH
+    classified = True
+
+    def check_file(self, name):
+        return len(name) > self._ruleset.max_name_length
+
+    def check_directory(self, name, children):
+        return len(name) > self._ruleset.max_name_length
+
+
+class DateNames(Rule):
+    """Files with dates in their names"""
+    name = 'date_names'
+    targets = FILES
+    classified = True
+
+    def check_file(self, name):
+        return bool(self._ruleset.date_re.match(name))
+
+
+class AccessionsInNames(Rule):
+    """Files with accessions in their names"""
+    name = 'accessions_in_names'
+    targets = FILES
+    classified = True
+
+    def check_file(self, name):
+        return bool(self._ruleset.accession_names_re.match(name))
+
+
+class MixedCase(Rule):
+    """Names with mixed case; file extensions are excluded"""
+    name = 'mixed_case'
+    targets = BOTH
+    classified = True
+
+    def check_file(self, name):
+        return is_mixed_case(name.rsplit('.', 1)[0])
+
+    def check_directory(self, name, children):
+        return is_mixed_case(name)
+
+
+class _RegexNameRule(Rule):
+    """Names of files and directories matching a configured regex"""
+    option = None
+    classified = True
+
+    def check_file(self, name):
+        return bool(getattr(self._ruleset, self.option).match(name))
+
+    def check_directory(self, name, children):
+        return bool(getattr(self._ruleset, self.option).match(name))
+
+
+class OddCharactersInNames(_RegexNameRule):
+    """Names with odd characters"""
+    name = 'odd_characters_in_names'
+    option = 'odd_chars_re'
+
+
+class ExcessivePeriodsInNames(_RegexNameRule):
+    """Names with too many periods"""
+    name = 'excessive_periods_in_names'
+    option = 'periods_in_name_fewer_than_re'
+
+
+class ExternalReferencesInNames(_RegexNameRule):
+    """Names referring to external material e.g. figures"""
+    name = 'external_references_in_names'
+    option = 'external_refs_re'
+
+
+class UnknownFileExtensions(Rule):
+    """Files whose extension is not in the configured list"""
+    name = 'unknown_file_extensions'
+    targets = FILES
+    classified = True
+
+    def check_file(self, name):
+        return not self._ruleset.file_extension_re.match(name)
+
+
+class NonAsciiCharacters(Rule):
+    """Names with non-ascii characters
+
+    The heuristic is that if the length of the string is equal to utf-8-encoded byte string then it's ascii. Hits are
+    reported by name only.
+    """
+    name = 'non_ascii_characters'
+    targets = BOTH
+    classified = True
+
+    def check_file(self, name):
+        return len(name) != len(name.encode('utf-8'))
+
+    def check_directory(self, name, children):
+        return len(name) != len(name.encode('utf-8'))
+
+    def file_finding(self, parent_path, name):
+        return name
+
+    def directory_finding(self, parent_path, name):
+        return name
+
+
+class CrypticNames(Rule):
+    """Names in which most of the words are not known e.g. 'TrtTs_x3'; file extensions and numbers are excluded"""
+    name = 'cryptic_names'
+    targets = BOTH
+    classified = True
+
+    def check_file(self, name):
+        return self._ruleset.is_cryptic(name.rsplit('.', 1)[0])
+
+    def check_directory(self, name, children):
+        return self._ruleset.is_cryptic(name)
+
+
+class InconsistentNames(Rule):
+    """Files named unlike most of their siblings of the same type e.g. 'movie_0001_old.tif' among 'movie_0001.tif'..."""
+    name = 'inconsistent_names'
+    targets = FILES
+
+    def check_siblings(self, siblings):
+        min_siblings, fraction = self._ruleset.min_siblings, self._ruleset.minority_shape_fraction
+        positions = list()
+        for shapes in siblings.groups.values():
+            if len(shapes) < 2:
+                continue
+            count = sum(map(len, shapes.values()))
+            if count < min_siblings:
+                continue
+            largest = max(map(len, shapes.values()))
+            for shaped in shapes.values():
+                if len(shaped) < largest and len(shaped) <= count * fraction:
+                    positions.extend(shaped)
+        return [siblings.names[position] for position in sorted(positions)]
+
+
+class MissingPadding(Rule):
+    """Files numbered without leading zeros e.g. 'image_9.tif' next to 'image_10.tif'"""
+    name = 'missing_padding'
+    targets = FILES
+
+    def check_siblings(self, siblings):
+        names, positions = siblings.names, set()
+        for shapes in siblings.groups.values():
+            for shaped in shapes.values():
+                if len(shaped) < 2:
+                    continue
+                numbers = [_DIGITS_RE.findall(_split_extension(names[position])[0]) for position in shaped]
+                for run in range(len(numbers[0])):
+                    widths = [len(number[run]) for number in numbers]
+                    width = max(widths)
+                    if min(widths) < width:
+                        positions.update(position for position, width_ in zip(shaped, widths) if width_ < width)
+        return [names[position] for position in sorted(positions)]
+
+
+class SmallFiles(Rule):
+    """Files smaller than the minimum size e.g. empty files left by a failed transfer"""
+    name = 'small_files'
+    targets = FILES
+    stat = True
+
+    def check_size(self, size):
+        return size < self._ruleset.min_file_size
+
+
+class LargeFiles(Rule):
+    """Files larger than the maximum size"""
+    name = 'large_files'
+    targets = FILES
+    stat = True
+
+    def check_size(self, size):
+        return size > self._ruleset.max_file_size
+
+
+class LargeDirectories(Rule):
+    """Directories whose files add up to more than the maximum size"""
+    name = 'large_directories'
+    targets = FILES
+    stat = True
+
+    def check_listing(self, listing):
+        return listing.size > self._ruleset.max_directory_size
+
+
+class HardLinks(Rule):
+    """Files with more than one hard link; each finding is a group of paths to the same data"""
+    name = 'hard_links'
+    targets = LINKS
+    stat = True
+
+    def check_links(self, links):
+        return [" = ".join(paths) for paths in links.hard_links()]
+
+
+class SymbolicLinks(Rule):
+    """Symbolic links"""
+    name = 'symbolic_links'
+    targets = LINKS
+
+    def check_links(self, links):
+        return list(links.symlinks)
+
+
+class BrokenSymbolicLinks(Rule):
+    """Symbolic links which point to nothing"""
+    name = 'broken_symbolic_links'
+    targets = LINKS
+    stat = True
+
+    def check_links(self, links):
+        return list(links.broken)
+
+
+RULES = [
+    EmptyDirectories,
+    ObviousDirectories,
+    ExcessiveFilesPerDirectory,
+    DirectoriesWithMixedFiles,
+    LongNames,
+    DateNames,
+    AccessionsInNames,
+    MixedCase,
+    OddCharactersInNames,
+    ExcessivePeriodsInNames,
+    ExternalReferencesInNames,
+    UnknownFileExtensions,
+    NonAsciiCharacters,
+    CrypticNames,
+    InconsistentNames,
+    MissingPadding,
+    SmallFiles,
+    LargeFiles,
+    LargeDirectories,
+    HardLinks,
+    SymbolicLinks,
+    BrokenSymbolicLinks,
+]
+
+
+def get_rules(configs, names=None) -> list:
+    """Instantiate the rules with the given names or all rules"""
+    return [rule(configs) for rule in RULES if names is None or rule.name in names]
+
+
+def name_checks(rules_: list, files: int, directories: int) -> int:
+    """An estimate of the checks on names the rules make on a tree, derived from the numbers of files and directories
+    rather than counted"""
+    checks, listings = 0, False
+    for rule in rules_:
+        if rule.targets & FILES:
+            if rule.classified or type(rule).check_file is not Rule.check_file \
+                    or type(rule).check_siblings is not Rule.check_siblings:
+                checks += files
+            listings = listings or type(rule).check_listing is not Rule.check_listing
+        if rule.targets & DIRECTORIES and rule.classified:
+            checks += directories
+    return checks + (files if listings else 0)
+
+
+def fingerprint(rules_: list, configs) -> str:
+    """Identify the rules and the configs they were created from; saved results are only valid for the same one"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\0".join(rule.name for rule in rules_).encode('utf-8'))
+    digest.update(str(configs).encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def timed(check, rule_name: str, timings: dict = None):
+    """The check itself or, given `timings`, a check which adds the seconds it takes to `timings[rule_name]`"""
+    if timings is None:
+        return check
+    perf_counter = time.perf_counter
+
+    def timed_check(*args):
+        start = perf_counter()
+        try:
+            return check(*args)
+        finally:
+            timings[rule_name] = timings.get(rule_name, 0.0) + perf_counter() - start
+
+    return timed_check
+
+
+def _recording_sink(sink, rule_name: str, kind: str, records=None):
+    """The sink itself or, given `records`, a sink which also passes the hit on to `records`"""
+    if records is None:
+        return sink
+
+    def record(finding):
+        sink(finding)
+        records(rule_name, kind, finding)
+
+    return record
+
+
+class Dispatch:
+    """Route entries to the rules interested in them and their hits to the per-rule sinks
+
+    :param rules_: the rules to apply
+    :param configs: configs the rules were created from
+    :param sinks: a callable per rule name receiving the finding strings
+    :param records: an optional callable also receiving the rule name, the kind (`FILE` or `DIRECTORY`) of the entry and
+        the finding string for every hit
+    :param timings: add the time spent in the checks of each rule to this dictionary (see `timed`)
+    """
+
+    def __init__(self, rules_: list, configs, sinks: dict, records=None, timings: dict = None):
+        self._ruleset = RuleSet.from_configs(configs)
+        self.file_rules, self.size_rules, self.listing_rules, self.directory_rules = list(), list(), list(), list()
+        self.sibling_rules = list()
+        self.file_dispatch, self.directory_dispatch = dict(), dict()
+        for rule in rules_:
+            file_sink = _recording_sink(sinks[rule.name], rule.name, FILE, records)
+            directory_sink = _recording_sink(sinks[rule.name], rule.name, DIRECTORY, records)
+            if rule.targets & FILES:
+                if rule.classified:
+                    self.file_dispatch[rule.name] = (rule.file_finding, file_sink)
+                elif type(rule).check_file is not Rule.check_file:
+                    self.file_rules.append((timed(rule.check_file, rule.name, timings), rule.file_finding, file_sink))
+                if type(rule).check_size is not Rule.check_size:
+                    self.size_rules.append((timed(rule.check_size, rule.name, timings), rule.file_finding, file_sink))
+                if type(rule).check_listing is not Rule.check_listing:
+                    # hits on listings are the containing directory
+                    self.listing_rules.append((timed(rule.check_listing, rule.name, timings), directory_sink))
+                if type(rule).check_siblings is not Rule.check_siblings:
+                    self.sibling_rules.append(
+                        (timed(rule.check_siblings, rule.name, timings), rule.file_finding, file_sink)
+                    )
+            if rule.targets & DIRECTORIES:
+                if rule.classified:
+                    self.directory_dispatch[rule.name] = (rule.directory_finding, directory_sink)
+                else:
+                    self.directory_rules.append(
+                        (timed(rule.check_directory, rule.name, timings), rule.directory_finding, directory_sink)
+                    )
+        self._classify_file = self._ruleset.classifier(directory=False, names=self.file_dispatch, timings=timings)
+        self._classify_directory = self._ruleset.classifier(
+            directory=True, names=self.directory_dispatch, timings=timings
+        )
+
+    def new_listing(self) -> Listing:
+        """An empty listing; extensions are only counted if a rule needs them"""
+        return Listing(self._ruleset.file_re if self.listing_rules else None)
+
+    def listing(self, parent: str, listing: Listing) -> None:
+        for check, sink in self.listing_rules:
+            if check(listing):
+                sink(parent)
+
+    def files(self, parent: str, files: list, listing: Listing = None, sizes: list = None) -> None:
+        """Rules on the files of a directory; `listing` is their summary if it is already known and `sizes` their
+        sizes if known"""
+        if self.listing_rules:
+            if listing is None:
+                listing = Listing.from_files(files, self._ruleset.file_re, sizes=sizes)
+            self.listing(parent, listing)
+        if sizes is None or not self.size_rules:
+            for file in files:
+                self.file(parent, file)
+        else:
+            for file, size in zip(files, sizes):
+                self.file(parent, file, size=size)
+        if self.sibling_rules:
+            self.siblings(parent, files)
+
+    def siblings(self, parent: str, files: list) -> None:
+        """Rules comparing the files of a directory with each other"""
+        siblings = Siblings(files)
+        for check, finding, sink in self.sibling_rules:
+            for name in check(siblings):
+                sink(finding(parent, name))
+
+    def file(self, parent: str, name: str, size: int = -1) -> None:
+        if self.file_dispatch:
+            for rule_name in self._classify_file(name):
+                finding, sink = self.file_dispatch[rule_name]
+                sink(finding(parent, name))
+        for check, finding, sink in self.file_rules:
+            if check(name):
+                sink(finding(parent, name))
+        if size >= 0:
+            for check, finding, sink in self.size_rules:
+                if check(size):
+                    sink(finding(parent, name))
+
+    def directory_name(self, parent: str, name: str) -> None:
+        """Rules which only need the name of the directory"""
+        if self.directory_dispatch:
+            for rule_name in self._classify_directory(name):
+                finding, sink = self.directory_dispatch[rule_name]
+                sink(finding(parent, name))
+
+    def directory(self, parent: str, name: str, children, defer=None) -> None:
+        """Rules which need the children of the directory
+
+        :param defer: called with the sink and the finding instead of sending the finding straight away
+        """
+        for check, finding, sink in self.directory_rules:
+            if check(name, children):
+                if defer is None:
+                    sink(finding(parent, name))
+                else:
+                    defer(sink, finding(parent, name))
+
+
+def evaluate_links(rules_: list, links: Links, sinks: dict, records=None, timings: dict = None) -> None:
+    """Apply the rules on links (see `Rule.check_links`) once all the entries have been seen"""
+    for rule in rules_:
+        if rule.targets & LINKS:
+            sink = _recording_sink(sinks[rule.name], rule.name, FILE, records)
+            for finding in timed(rule.check_links, rule.name, timings)(links):
+                sink(finding)
+
+
+class _OpenDirectory:
+    """What the streaming evaluator keeps about a directory until all its entries have been seen
+
+    Stands in for the children of the directory in `Rule.check_directory`. The names of its files are only kept if a
+    rule compares them with each other (`names` is None otherwise).
+    """
+    __slots__ = ('name', 'parent', 'path', 'directories', 'listing', 'order', 'names')
+
+    def __init__(self, name: str, parent: str, listing: Listing, order: int = 0, names: list = None):
+        self.name = name
+        self.order = order
+        self.parent = parent
+        self.path = f"{parent}{name}/" if name is not None else ""
+        self.directories = 0
+        self.listing = listing
+        self.names = names
+
+    def __len__(self):
+        return self.directories + (self.listing.count > 0)
+
+    def __contains__(self, key):
+        return key == FILES_KEY and self.listing.count > 0
+
+
+def evaluate_stream(entries, rules_: list, configs, prefix: str = '', sep: str = '/', sinks: dict = None,
+                    records=None, timings: dict = None) -> dict:
+    """Apply the rules to entries as they are yielded by a depth-first walker
+
+    Names are checked as soon as they arrive. Rules on file listings and on the children of a directory are applied
+    once the walker leaves the directory, after which its state is dropped, so memory depends on the depth of the tree
+    rather than the number of entries (and, with rules comparing siblings, on the number of files per directory).
+    Findings on directories are held back until the enclosing top-level directory is finished so that they come out in
+    the order the directories were found. Returns the findings per rule name when no
+    sinks are given. `records` and `timings` are passed on to `Dispatch`.
+    """
+    findings = None
+    if sinks is None:
+        findings = {rule.name: list() for rule in rules_}
+        sinks = {name: found.append for name, found in findings.items()}
+    dispatch = Dispatch(rules_, configs, sinks, records=records, timings=timings)
+    links = Links() if any(rule.targets & LINKS for rule in rules_) else None
+    siblings = bool(dispatch.sibling_rules)
+    stack = [_OpenDirectory(None, "", dispatch.new_listing(), names=[] if siblings else None)]  # the virtual root
+    deferred = list()
+    opened = 0
+
+    def _close():
+        directory = stack.pop()
+        if directory.listing.count:
+            dispatch.listing(directory.path, directory.listing)
+        if directory.names:
+            dispatch.siblings(directory.path, directory.names)
+        dispatch.directory(
+            directory.parent, directory.name, directory,
+            defer=lambda sink, finding: deferred.append((directory.order, sink, finding))
+        )
+        if len(stack) == 1 and deferred:  # a top-level directory is done
+            for _, sink, finding in sorted(deferred, key=lambda item: item[0]):
+                sink(finding)
+            deferred.clear()
+
+    def _open(name):
+        nonlocal opened
+        parent = stack[-1]
+        parent.directories += 1
+        dispatch.directory_name(parent.path, name)
+        opened += 1
+        stack.append(
+            _OpenDirectory(name, parent.path, dispatch.new_listing(), order=opened, names=[] if siblings else None)
+        )
+
+    for entry in entries:
+        components = utils.split_path(entry.path, prefix=prefix, sep=sep)
+        target = components if entry.is_dir() else components[:-1]
+        # leave the directories the walker has finished with
+        depth = 0
+        while depth < len(target) and depth + 1 < len(stack) and stack[depth + 1].name == target[depth]:
+            depth += 1
+        while len(stack) > depth + 1:
+            _close()
+        # enter the directories (including implied ones) leading to the entry
+        for name in target[depth:]:
+            _open(name)
+        if links is not None:
+            links.add(sep.join(components) + (sep if entry.is_dir() else ''), entry)
+        if entry.is_file():  # links which are not followed are neither files nor directories
+            size = getattr(entry, 'size', -1)
+            stack[-1].listing.add(components[-1], size=size)
+            dispatch.file(stack[-1].path, components[-1], size=size)
+            if siblings:
+                stack[-1].names.append(components[-1])
+    while len(stack) > 1:
+        _close()
+    if stack[0].listing.count:
+        dispatch.listing("", stack[0].listing)
+    if stack[0].names:
+        dispatch.siblings("", stack[0].names)
+    if links is not None:
+        evaluate_links(rules_, links, sinks, records=records, timings=timings)
+    return findings
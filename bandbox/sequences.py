@@ -0,0 +1,139 @@
+"""
+Numbered sequences of names
+
+Directories of EM data hold runs of names which only differ in a number e.g. 'FoilHole_1234_Data_0001.mrc' to
+'FoilHole_1234_Data_9999.mrc'. `compress` collapses each such run into a `Sequence` shown as
+'FoilHole_1234_Data_[0001-9999].mrc (9999 files, 3 gaps)' so that listings grow with the number of patterns rather
+than the number of files.
+
+Names are grouped on the text around their last number, then the names left over on the text around the number before
+it and so on; each name is looked at once per number it contains.
+"""
+import re
+
+MIN_RUN = 3  # fewer names than this are listed as they are
+
+_DIGITS_RE = re.compile(r"[0-9]+")
+
+
+class Sequence:
+    """Names which only differ in one number: `prefix` + the number (zero-padded to `width` if not 0) + `suffix`"""
+    __slots__ = ('prefix', 'suffix', 'width', 'numbers')
+
+    def __init__(self, prefix: str, suffix: str, width: int, numbers: list):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.width = width
+        self.numbers = sorted(numbers)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    @property
+    def gaps(self) -> int:
+        """The number of holes in the sequence e.g. 1, 2, 5, 7 has two"""
+        numbers = self.numbers
+        return sum(1 for previous, number in zip(numbers, numbers[1:]) if number - previous > 1)
+
+    def names(self) -> list:
+        return [f"{self.prefix}{number:0{self.width}d}{self.suffix}" for number in self.numbers]
+
+    def __str__(self):
+        first, last = self.numbers[0], self.numbers[-1]
+        if first == last:  # not a range
+            return self.names()[0]
+        gaps = self.gaps
+        gaps = "" if not gaps else f", {gaps} gap" if gaps == 1 else f", {gaps} gaps"
+        return f"{self.prefix}[{first:0{self.width}d}-{last:0{self.width}d}]{self.suffix} ({len(self)} files{gaps})"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self}>"
+
+
+def _sequences(prefix: str, suffix: str, members: list, min_run: int) -> tuple:
+    """(members, sequence) for the (position, digits) members sharing a prefix and suffix and the members left over
+
+    Numbers of different widths make one sequence unless some are zero-padded, then there is one per width.
+    """
+    widths = {len(digits) for _, digits in members}
+    if len(widths) > 1 and not any(len(digits) > 1 and digits[0] == '0' for _, digits in members):
+        # unpadded numbers e.g. 1 to 100
+        return [(members, Sequence(prefix, suffix, 0, [int(digits) for _, digits in members]))], []
+    by_width = dict()
+    for member in members:
+        by_width.setdefault(len(member[1]), list()).append(member)
+    sequences, left = list(), list()
+    for width, same_width in by_width.items():
+        if len(same_width) < min_run:
+            left.extend(same_width)
+        else:
+            sequences.append((same_width, Sequence(prefix, suffix, width, [int(digits) for _, digits in same_width])))
+    return sequences, left
+
+
+def compress(names: list, min_run: int = MIN_RUN) -> list:
+    """The names with every run of at least `min_run` names differing only in one number replaced by a `Sequence`
+
+    Each sequence takes the place of its first name; the other names keep their order. Repeated names are listed once.
+    """
+    names = list(dict.fromkeys(names))
+    if len(names) < min_run:
+        return list(names)
+    runs = [[(match.start(), match.end()) for match in _DIGITS_RE.finditer(name)] for name in names]
+    placed = dict()  # position -> sequence or None for the names absorbed in a sequence
+    remaining = [position for position, spans in enumerate(runs) if spans]
+    field = 1  # counting numbers from the end of the name
+    while len(remaining) >= min_run:
+        groups = dict()
+        for position in remaining:
+            name = names[position]
+            start, end = runs[position][-field]
+            groups.setdefault((name[:start], name[end:]), list()).append((position, name[start:end]))
+        remaining = list()
+        for (prefix, suffix), members in groups.items():
+            left = members
+            if len(members) >= min_run:
+                sequences, left = _sequences(prefix, suffix, members, min_run)
+                for absorbed, sequence in sequences:
+                    placed[absorbed[0][0]] = sequence
+                    for position, _ in absorbed[1:]:
+                        placed[position] = None
+            remaining.extend(position for position, _ in left if len(runs[position]) > field)
+        remaining.sort()
+        field += 1
+    if not placed:
+        return list(names)
+    compressed = list()
+    for position, name in enumerate(names):
+        item = placed.get(position, name)
+        if item is not None:
+            compressed.append(item)
+    return compressed
+
+
+def compress_paths(paths: list, sep: str = '/', min_run: int = MIN_RUN) -> list:
+    """Paths with the names of consecutive paths in the same directory compressed (see `compress`); as strings
+
+    Only give this paths: names without their directories would be compressed across directories. Repeated paths are
+    listed once.
+    """
+    paths = list(dict.fromkeys(paths))
+    compressed = list()
+    start = 0
+    while start < len(paths):
+        # directories (ending in `sep`) are listed as they are
+        parent = None if paths[start].endswith(sep) else paths[start].rpartition(sep)[0]
+        end = start + 1
+        while (parent is not None and end < len(paths) and not paths[end].endswith(sep)
+               and paths[end].rpartition(sep)[0] == parent):
+            end += 1
+        if end - start < min_run:
+            compressed.extend(paths[start:end])
+        else:
+            prefix = f"{parent}{sep}" if parent else ""
+            compressed.extend(
+                f"{prefix}{item}"
+                for item in compress([path[len(prefix):] for path in paths[start:end]], min_run=min_run)
+            )
+        start = end
+    return compressed
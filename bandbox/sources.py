@@ -0,0 +1,165 @@
+"""
+Sources of entries other than a walk of the filesystem. Like `utils.scandir_recursive` they yield `utils.Entry`
+objects, parents before their contents, so that they can be passed to `Tree.from_data` or `rules.evaluate_stream`.
+
+Listings are files of paths as produced by:
+
+- `find . -print0` ('print0'): NUL-separated paths;
+- `find . -printf '%y %s %p\\n'` ('printf'): the type, size and path of each entry on a line;
+- `find .` ('lines'): one path per line;
+- the legacy input format ('comma'): paths separated by ', '.
+
+Listings are read in chunks and may be gzipped; the format is detected from the first chunk unless given. Without
+types, an entry is taken to be a directory if it ends with a separator or if the next entry is inside it, which is
+always the case for non-empty directories in `find` output.
+
+Archives (tar, optionally compressed, and zip) are read from their index without extracting anything: the central
+directory of a zip file and the member headers of a tar file. Members are named `<archive>/<member>` so that the
+archive stands in for the directory it was made from.
+"""
+import gzip
+import os
+import re
+import sys
+import tarfile
+import time
+import typing
+import zipfile
+
+from bandbox import utils
+
+FORMATS = ['auto', 'print0', 'printf', 'lines', 'comma']
+CHUNK_SIZE = 1 << 20
+GZIP_MAGIC = b'\x1f\x8b'
+
+_PRINTF_RE = re.compile(rb"^[a-zA-Z] -?\d+ ")
+_DELIMITERS = {
+    'print0': b'\0',
+    'printf': b'\n',
+    'lines': b'\n',
+    'comma': b', ',
+}
+
+
+def _open(stream: typing.BinaryIO) -> typing.BinaryIO:
+    """Decompress gzipped streams"""
+    if stream.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    return stream
+
+
+def detect_format(head: bytes) -> str:
+    """Guess the format of a listing from its first bytes"""
+    if b'\0' in head:
+        return 'print0'
+    if _PRINTF_RE.match(head):
+        return 'printf'
+    if b', ' in head and b'\n' not in head.rstrip(b'\n'):
+        return 'comma'
+    return 'lines'
+
+
+def _records(stream: typing.BinaryIO, delimiter: bytes, head: bytes = b'') -> typing.Generator:
+    """Split a stream into records one chunk at a time"""
+    remainder, chunk = b'', head
+    while chunk:
+        records = (remainder + chunk).split(delimiter)
+        remainder = records.pop()
+        yield from records
+        chunk = stream.read(CHUNK_SIZE)
+    # the last record has no delimiter (or a newline left over from the comma format)
+    remainder = remainder.rstrip(b'\n') if delimiter != b'\n' else remainder
+    if remainder:
+        yield remainder
+
+
+def _untyped_entries(paths: typing.Iterable, sep: str = '/') -> typing.Generator:
+    """Entries for paths without types; a path is a directory if the next path is inside it"""
+    previous = None
+    for path in paths:
+        if not path:
+            continue
+        if previous is not None:
+            yield utils.Entry(previous.rstrip(sep), is_dir=previous.endswith(sep) or path.startswith(previous + sep))
+        previous = path
+    if previous is not None:
+        yield utils.Entry(previous.rstrip(sep), is_dir=previous.endswith(sep))
+
+
+def _printf_entries(lines: typing.Iterable) -> typing.Generator:
+    """Entries for '%y %s %p' lines"""
+    for line in lines:
+        if not line:
+            continue
+        kind, size, path = line.split(' ', 2)
+        yield utils.Entry(path, is_dir=kind == 'd', size=int(size), link=utils.SYMLINK if kind == 'l' else None)
+
+
+def read_listing(path: str, format: str = 'auto', sep: str = '/') -> typing.Generator:
+    """Yield the entries in a listing file
+
+    :param path: the listing file or '-' for standard input
+    :param format: one of `FORMATS`
+    :param sep: the path separator used in the listing
+    """
+    raw = sys.stdin.buffer if str(path) == '-' else open(path, 'rb')
+    try:
+        stream = _open(raw)
+        head = stream.read(CHUNK_SIZE)
+        if format == 'auto':
+            format = detect_format(head)
+        paths = map(os.fsdecode, _records(stream, _DELIMITERS[format], head=head))
+        if format == 'printf':
+            yield from _printf_entries(paths)
+        else:
+            yield from _untyped_entries(paths, sep=sep)
+    finally:
+        if raw is not sys.stdin.buffer:
+            raw.close()
+
+
+def is_archive(path) -> bool:
+    """Whether the path is a tar or zip file"""
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def _member_path(archive: str, name: str, sep: str = '/') -> str:
+    while name.startswith('./'):
+        name = name[2:]
+    return f"{archive}{sep}{name.strip(sep)}"
+
+
+def _zip_entries(path: str, sep: str = '/') -> typing.Generator:
+    with zipfile.ZipFile(path) as archive:  # reads the central directory only
+        for info in archive.infolist():
+            if info.filename.strip('./'):
+                yield utils.Entry(_member_path(str(path), info.filename, sep=sep), is_dir=info.is_dir(),
+                                  size=-1 if info.is_dir() else info.file_size,
+                                  mtime=-1 if info.is_dir() else int(time.mktime(info.date_time + (0, 0, -1))))
+
+
+def _tar_entries(path: str, sep: str = '/') -> typing.Generator:
+    # headers are read one at a time; uncompressed archives are seeked over member data
+    with tarfile.open(path, 'r:*') as archive:
+        while True:
+            info = archive.next()
+            if info is None:
+                break
+            archive.members = []  # the headers read so far would otherwise be kept
+            if info.name.strip('./'):
+                yield utils.Entry(_member_path(str(path), info.name, sep=sep), is_dir=info.isdir(),
+                                  size=-1 if info.isdir() else info.size, mtime=-1 if info.isdir() else int(info.mtime),
+                                  link=utils.SYMLINK if info.issym() else None)
+
+
+def read_archive(path, sep: str = '/') -> typing.Generator:
+    """Yield the members of a tar or zip archive as entries
+
+    Members come out in the order they were archived, which is depth-first for archives made from a directory as
+    `rules.evaluate_stream` requires.
+    """
+    if zipfile.is_zipfile(path):
+        yield from _zip_entries(path, sep=sep)
+    else:
+        yield from _tar_entries(path, sep=sep)
+
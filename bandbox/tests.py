@@ -13,16 +13,27 @@ output:
 - save tree
 """
 import configparser
+import glob
+import gzip
+import hashlib
 import io
+import json
+import mmap
 import os
 import pathlib
 import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
 import types
 import unittest
+import unittest.mock
+import zipfile
 
 import requests
 
-from bandbox import cli, models, utils, managers
+from bandbox import cache, checksums, cli, columnar, engines, models, profiling, rules, sequences, sources, utils, managers, words
 
 BASE_DIR = pathlib.Path(__file__).parent.parent
 TEST_DATA = BASE_DIR / "test_data"
@@ -35,6 +46,12 @@ class Tests(unittest.TestCase):
     def setUp(self) -> None:
         # envvars
         os.environ['BANDBOX_CONFIG'] = str(TEST_CONFIG)
+        # the scan cache and the word index are written to a temporary directory instead of ~/.cache
+        cache_home = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_home.cleanup)
+        environ = unittest.mock.patch.dict(os.environ, {'XDG_CACHE_HOME': cache_home.name})
+        environ.start()
+        self.addCleanup(environ.stop)
 
 
 class Test(Tests):
@@ -61,6 +78,8 @@ class TestCLI(Tests):
         self.assertTrue(args.hide_file_counts)
         self.assertIsNone(args.input_file)
         self.assertIsNotNone(args.config_file)
+        self.assertEqual(1, args.scan_workers)
+        self.assertFalse(args.sort_entries)
 
     def test_analyse(self):
         """Analyse the given path"""
@@ -72,6 +91,9 @@ class TestCLI(Tests):
         self.assertEqual(5, args.summarise_size)
         self.assertFalse(args.verbose)
         self.assertIsNotNone(args.config_file)
+        self.assertFalse(args.stream)
+        # cannot show a tree that is never built
+        self.assertIsNone(cli.cli(f"bandbox analyse --stream --show-tree"))
 
 
 class TestCore(Tests):
@@ -112,6 +134,60 @@ class TestCore(Tests):
             # the best we can do is compare keys
             self.assertListEqual(list(data.keys()), list(tree.data.keys()))
 
+    def test_tree_arrays(self):
+        """Test the node table behind the tree"""
+        tree = models.Tree()
+        tree.insert(utils.Entry('data/raw', is_dir=True))
+        for i in range(40):
+            tree.insert(utils.Entry(f'data/raw/FoilHole_1234_Data_{i:04d}.mrc'))
+        tree.insert(utils.Entry('data/_files', is_dir=True))  # a real directory called '_files'
+        tree.insert(utils.Entry('data/_files/wïth_ñõn_æšçiį.txt'))
+        tree.insert(utils.Entry('data/README.md'))
+        tree.insert(utils.Entry('data/raw', is_dir=True))  # inserting again reuses the node
+        self.assertEqual(
+            {'data': {
+                'raw': {rules.FILES_KEY: [f'FoilHole_1234_Data_{i:04d}.mrc' for i in range(40)]},
+                '_files': {rules.FILES_KEY: ['wïth_ñõn_æšçiį.txt']},
+                rules.FILES_KEY: ['README.md'],
+            }},
+            # a real '_files' directory does not clash with the list of files
+            tree.to_dict()
+        )
+        items = list(tree['data'].items())
+        self.assertEqual(['raw', '_files', rules.FILES_KEY], [name for name, _ in items])
+        self.assertIsInstance(tree['data']['_files'], models.Node)
+        self.assertEqual(['wïth_ñõn_æšçiį.txt'], tree['data']['_files'][rules.FILES_KEY])
+        self.assertEqual(['README.md'], tree['data'][rules.FILES_KEY])
+        self.assertIn('_files', tree['data'])
+        self.assertNotIn('_files', tree['data']['raw'])
+        # names come back from the front-coded string table
+        raw = tree.lookup_directory(tree.lookup_directory(models.ROOT, 'data'), 'raw')
+        self.assertEqual('data/raw', tree.path(raw))
+        children = tree.children(raw)
+        self.assertEqual(40, len(children))
+        self.assertEqual('FoilHole_1234_Data_0037.mrc', tree.name(children[37]))
+        self.assertEqual(models.FILE, tree.kind(children[0]))
+        self.assertEqual(-1, tree.size(children[0]))
+
+    def test_tree_listings(self):
+        """Test that the file count and extensions of each directory are kept up to date by insert"""
+        args = cli.cli(f"bandbox view {TEST_DATA}")
+        tree = models.Tree.from_data(utils.scandir_recursive(TEST_DATA), prefix=str(TEST_DATA), args=args)
+        for index in range(len(tree._kinds)):
+            if tree.kind(index) == models.DIRECTORY:
+                files = tree.files(index)
+                listing = tree.listing(index)
+                self.assertEqual(len(files), listing.count)
+                self.assertEqual(tree.file_counts(files), listing.extensions)
+        data = tree.lookup_directory(tree.lookup_directory(models.ROOT, 'folder_with_multiple_file_types'), 'folder')
+        self.assertIs(tree.listing(data), tree['folder_with_multiple_file_types']['folder'].listing())
+        tree.insert(utils.Entry(f"{TEST_DATA}/folder_with_multiple_file_types/folder/added.mrc"), prefix=str(TEST_DATA))
+        self.assertEqual(tree.file_counts(tree.files(data)), tree.listing(data).extensions)
+        self.assertEqual(len(tree.files(data)), tree.listing(data).count)
+        self.assertEqual(0, tree.listing(tree.lookup_directory(models.ROOT, 'empty_folder')).count)
+        # the files line is rendered from the listing
+        self.assertIn(f"[{tree.listing(data).count} files: ", "".join(tree.render()))
+
     def test_all_find_methods(self):
         """Test all find methods
 
@@ -304,6 +380,85 @@ class TestCore(Tests):
             # print(data_dict['expected_value'])
             self.assertEqual(sorted(data_dict["expected_value"]), result)
 
+    def test_evaluate_rules(self):
+        """Test that a single fused pass gives the same findings as evaluating each rule on its own"""
+        args = cli.cli(f"bandbox analyse")
+        fused_tree = models.Tree.from_data(
+            utils.scandir_recursive(TEST_DATA / "folder_with_long_name_folders"), prefix=str(TEST_DATA), args=args
+        )
+        findings = fused_tree.evaluate_rules(rules.get_rules(args._configs))
+        self.assertEqual(len(rules.RULES), len(findings))
+        for rule in rules.get_rules(args._configs):
+            tree = models.Tree.from_data(
+                utils.scandir_recursive(TEST_DATA / "folder_with_long_name_folders"), prefix=str(TEST_DATA), args=args
+            )
+            self.assertEqual(tree.evaluate_rules([rule])[rule.name], findings[rule.name])
+        # find_* methods reuse the findings
+        self.assertIs(findings['long_names'], fused_tree.find_long_names())
+
+    def test_evaluate_rules_jobs(self):
+        """Test that evaluating subtrees in separate processes gives the same findings in the same order"""
+        args = cli.cli(f"bandbox analyse {TEST_DATA} -j 2")
+        self.assertEqual(2, args.jobs)
+        tree = models.Tree.from_data(utils.scandir_recursive(TEST_DATA), prefix=str(TEST_DATA), args=args)
+        findings = tree.evaluate_rules(rules.get_rules(args._configs))
+        for jobs in (2, 50):  # split at the top level and at the second level
+            self.assertEqual(findings, tree.evaluate_rules(rules.get_rules(args._configs), jobs=jobs))
+        # the time spent in each rule is collected from the workers too
+        timings = dict()
+        tree.evaluate_rules(rules.get_rules(args._configs), jobs=2, timings=timings)
+        self.assertTrue({'long_names', 'empty_directories', 'excessive_files_per_directory'} <= set(timings))
+        # a real directory called '_files' is evaluated as a directory by the workers too
+        tree = models.Tree.from_data([
+            utils.Entry('data/_files', is_dir=True), utils.Entry('data/_files/README'),
+            utils.Entry('data/_files/empty', is_dir=True), utils.Entry('data/raw.mrc'),
+            utils.Entry('other', is_dir=True), utils.Entry('other/notes.txt', size=0),
+        ], args=args)
+        findings = tree.evaluate_rules(rules.get_rules(args._configs))
+        self.assertIn('data/_files/empty/', findings['empty_directories'])
+        self.assertEqual(findings, tree.evaluate_rules(rules.get_rules(args._configs), jobs=2))
+        self.assertIsNone(cli.cli(f"bandbox analyse {TEST_DATA} -j 0"))
+
+    def test_ruleset_classify(self):
+        """Test that names are classified against all the naming rules in one call"""
+        args = cli.cli(f"bandbox analyse")
+        ruleset = rules.RuleSet.from_configs(args._configs)
+        self.assertIs(ruleset, rules.RuleSet.from_configs(args._configs))  # compiled once
+        self.assertCountEqual(
+            ['accessions_in_names', 'date_names', 'mixed_case', 'unknown_file_extensions'],
+            ruleset.classify('EMPIAR-Data-2000-12-31.wrx')
+        )
+        self.assertCountEqual(['obvious_directories'], ruleset.classify('files', directory=True))
+        self.assertCountEqual([], ruleset.classify('files.txt'))
+        self.assertCountEqual(
+            ['odd_characters_in_names'],
+            ruleset.classify('a name with spaces', directory=True, names=['odd_characters_in_names', 'date_names'])
+        )
+        # the classification agrees with the individual rules
+        for name in ['prefix-31-Dec-2000-suffix.txt', 'a.file.with.many.periods.txt', 'supplementary-figure3a.jpg',
+                     'wïth_ñõn_æšçiį', 'file-EMPIAR-someting.tif', 'README.md']:
+            for rule in rules.get_rules(args._configs):
+                if rule.classified and rule.targets & rules.FILES:
+                    self.assertEqual(rule.check_file(name), rule.name in ruleset.classify(name), (rule, name))
+
+    @unittest.skipUnless(columnar.AVAILABLE, "requires NumPy")
+    def test_evaluate_rules_columnar(self):
+        """Test that classifying all the names at once with NumPy gives the same findings in the same order"""
+        args = cli.cli(f"bandbox analyse {TEST_DATA} --backend numpy")
+        tree = models.Tree.from_data(utils.scandir_recursive(TEST_DATA), prefix=str(TEST_DATA), args=args)
+        rules_ = rules.get_rules(args._configs)
+        self.assertEqual(tree.evaluate_rules(rules_, backend='python'), tree.evaluate_rules(rules_, backend='numpy'))
+        ruleset = rules.RuleSet.from_configs(args._configs)
+        names = ['.bashrc', 'Name.txt', 'name.TXT', 'a.b.c.d', 'wïth_ñõn_æšçiį.Mrc', 'x' * 60, 'two\nLines',
+                 'a name with spaces', 'EMPIAR-Data-2000-12-31.wrx', 'files', '']
+        for directory in (False, True):
+            verdicts = columnar.classify(ruleset, names, directory=directory)
+            for index, name in enumerate(names):
+                self.assertCountEqual(
+                    ruleset.classify(name, directory=directory),
+                    [rule_name for rule_name, verdict in verdicts.items() if verdict[index]], (name, directory)
+                )
+
 
 class TestView(Tests):
     def test_view_tree(self):
@@ -316,6 +471,124 @@ class TestView(Tests):
         self.assertRegex(sys.stdout.getvalue(), r"(?s).*empty_folder.*folder.*")
 
 
+    def test_view_render(self):
+        """Test that the tree is rendered line by line with optional limits"""
+        args = cli.cli(f"bandbox view {TEST_DATA / 'folder_with_long_name_folders'}")
+        tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=str(TEST_DATA), args=args)
+        lines = tree.render()
+        self.assertIsInstance(lines, types.GeneratorType)
+        self.assertEqual(str(tree), "".join(lines))
+        # an empty directory passes the leading space of its contents to the next line
+        self.assertEqual("└── folder\n \t└── [3 files: txt=3; ]\n", str(models.Tree.from_data(
+            [utils.Entry(f"folder/{name}") for name in ("a.txt", "b.txt", "c.txt")], args=args
+        )))
+        self.assertEqual("└── a\n └── b\n ", str(models.Tree.from_data(
+            [utils.Entry("a", is_dir=True), utils.Entry("b", is_dir=True)], args=args
+        )))
+        tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=str(args.path), args=args)
+        top_level = list(tree.render(max_depth=1))
+        self.assertTrue(all(not line.strip(" ").startswith("\t") for line in top_level))
+        limited = list(tree.render(max_depth=1, max_children=2))
+        self.assertEqual(3, len(limited))
+        self.assertRegex(limited[-1], r"^ ?└── \.\.\. \d+ more\n$")
+        self.assertIn("\x1b[", "".join(tree.render(style=True)))
+        sys.stdout = io.StringIO()
+        managers.view(cli.cli(f"bandbox view {TEST_DATA / 'folder_with_long_name_folders'} --max-children 1"))
+        self.assertRegex(sys.stdout.getvalue(), r"(?s).*\.\.\. \d+ more.*")
+        self.assertNotIn("\x1b[", sys.stdout.getvalue())
+        self.assertIsNone(cli.cli(f"bandbox view {TEST_DATA} --max-depth 0"))
+
+    def test_view_sequences(self):
+        """Test that numbered runs of names are listed as one sequence"""
+        names = [f"FoilHole_1234_Data_{number:04d}.mrc" for number in range(1, 10000) if number not in (5, 6, 50, 51)]
+        compressed = sequences.compress(names + ["notes.txt", "x01", "x02"])
+        self.assertEqual(
+            ["FoilHole_1234_Data_[0001-9999].mrc (9995 files, 2 gaps)", "notes.txt", "x01", "x02"],
+            list(map(str, compressed))
+        )
+        self.assertEqual(names, compressed[0].names())
+        # unpadded numbers of any width make one sequence; padded ones one per width
+        self.assertEqual(["img_[1-10].tif (3 files, 1 gap)"], list(map(str, sequences.compress(
+            ["img_1.tif", "img_2.tif", "img_10.tif"]
+        ))))
+        self.assertEqual(["a_[01-03] (3 files)", "a_[001-003] (3 files)"], list(map(str, sequences.compress(
+            ["a_01", "a_02", "a_03", "a_001", "a_002", "a_003"]
+        ))))
+        # the last number that differs is the one collapsed
+        self.assertEqual(["run[1-3]_frame_007.tif (3 files)"], list(map(str, sequences.compress(
+            ["run1_frame_007.tif", "run2_frame_007.tif", "run3_frame_007.tif"]
+        ))))
+        self.assertEqual(
+            ["d/a_[1-3].mrc (3 files)", "e/", "f/b"],
+            sequences.compress_paths(["d/a_1.mrc", "d/a_2.mrc", "d/a_3.mrc", "e/", "f/b"])
+        )
+        # the names left out of a run keep their directory; a directory is not grouped with its own files
+        self.assertEqual(
+            ["a/x[1-3].txt (3 files)", "a/readme.md"],
+            sequences.compress_paths(["a/x1.txt", "a/x2.txt", "a/x3.txt", "a/readme.md"])
+        )
+        self.assertEqual(
+            ["T/Raw/", "T/Raw/a.txt", "T/Raw/b.txt", "T/Raw/c.txt"],
+            sequences.compress_paths(["T/Raw/", "T/Raw/a.txt", "T/Raw/b.txt", "T/Raw/c.txt"])
+        )
+        # repeated paths are listed once rather than as a range of one number
+        self.assertEqual(["d/a_1.mrc", "d/a_2.mrc"], sequences.compress_paths(["d/a_1.mrc"] * 3 + ["d/a_2.mrc"]))
+        self.assertEqual("a_7", str(sequences.Sequence("a_", "", 0, [7])))
+        # bare names (e.g. non-ASCII names from several directories) are not compressed in reports
+        report = engines.Report(["café_1", "café_2", "café_3"], "naming", paths=False)
+        sys.stdout = io.StringIO()
+        engines._render(report, args=cli.cli(f"bandbox analyse {TEST_DATA}"))
+        self.assertIn("* café_3", sys.stdout.getvalue())
+        args = cli.cli(f"bandbox view {TEST_DATA / 'folder_with_multiple_folders'} --show-files")
+        sys.stdout = io.StringIO()
+        managers.view(args)
+        self.assertIn("\t\t\t└── file[1-2001].jpeg (2001 files)\n", sys.stdout.getvalue())
+        args = cli.cli(f"bandbox view {TEST_DATA / 'folder_with_multiple_folders'} --show-files --no-compress")
+        sys.stdout = io.StringIO()
+        managers.view(args)
+        self.assertEqual(2001, sys.stdout.getvalue().count(".jpeg\n"))
+        sys.stdout = io.StringIO()
+        managers.analyse(cli.cli(f"bandbox analyse {TEST_DATA / 'folder_with_multiple_folders'} --all"))
+        self.assertRegex(sys.stdout.getvalue(), r"\* .*folder7/file\[1-2001\]\.jpeg \(2001 files\)")
+
+
+class TestSummary(Tests):
+    def test_summary(self):
+        """Test that a single bottom-up pass totals the contents of every directory"""
+        args = cli.cli(f"bandbox summary {TEST_DATA}")
+        tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=str(args.path), args=args)
+        totals = tree.subtree()
+        self.assertEqual(sum(1 for entry in utils.scandir_recursive(TEST_DATA) if entry.is_file()), totals['files'])
+        self.assertEqual(sum(1 for entry in utils.scandir_recursive(TEST_DATA) if entry.is_dir()), totals['directories'])
+        self.assertEqual(
+            sum(os.path.getsize(entry.path) for entry in utils.scandir_recursive(TEST_DATA) if entry.is_file()),
+            totals['bytes']
+        )
+        self.assertEqual(4000, tree['0_good'].subtree()['extensions']['tif'])
+        raw = tree['0_good']['brief_description']['treatment1_tissue']['raw']
+        self.assertEqual({'files': 1000, 'directories': 0, 'bytes': 0, 'max_depth': 1, 'extensions': {'tif': 1000}},
+                         raw.subtree())
+        self.assertEqual(0, tree['empty_folder']['folder'].subtree()['max_depth'])
+        heaviest = tree.heaviest(3)
+        self.assertEqual(3, len(heaviest))
+        self.assertEqual(['0_bad', '0_bad/data'], [tree.path(index) for index in heaviest[:2]])
+        # sizes are totalled when known
+        tree = models.Tree.from_data(
+            [utils.Entry('a', is_dir=True), utils.Entry('a/x.txt', size=10), utils.Entry('a/b/y.txt', size=5),
+             utils.Entry('z.txt', size=1)], args=args
+        )
+        self.assertEqual(16, tree.subtree()['bytes'])
+        self.assertEqual(15, tree['a'].subtree()['bytes'])
+        self.assertEqual(3, tree.subtree()['max_depth'])
+        self.assertEqual([tree.lookup_directory(models.ROOT, 'a')], tree.heaviest(1, by='bytes'))
+        sys.stdout = io.StringIO()
+        managers.summary(cli.cli(f"bandbox summary {TEST_DATA} --no-cache --format json -n 2"))
+        summary = json.loads(sys.stdout.getvalue())
+        self.assertEqual(totals['files'], summary['files'])
+        self.assertEqual(2, len(summary['heaviest']))
+        self.assertIsNone(cli.cli(f"bandbox summary {TEST_DATA} -n -1"))
+
+
 class TestAnalyse(Tests):
     def test_analyse_all_engines(self):
         """Run all engines"""
@@ -325,6 +598,391 @@ class TestAnalyse(Tests):
         self.assertRegex(sys.stdout.getvalue(),
                          r"(?s).*(unknown file extensions|accessions in names|entities with dates).*")
 
+    def test_analyse_engine_selection(self):
+        """Only the selected engines are run and their reports come out in the order of the engine names"""
+        engine_names = [name for name, _ in engines._get_engines()]
+        self.assertEqual(sorted(engine_names), engine_names)
+        self.assertEqual(
+            ['n2_detect_excessive_periods_in_names', 'n2_detect_long_names'],
+            [name for name, _ in engines._get_engines(include=['n2_*long*', 'n2_*periods*'])]
+        )
+        self.assertNotIn('n2_detect_mixed_case', [name for name, _ in engines._get_engines(exclude=['n2_*'])])
+        args = cli.cli(f"bandbox analyse {TEST_DATA} --engines n2_* --skip-engines n2_detect_mixed_case")
+        self.assertEqual(['n2_*'], args.engines)
+        tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=str(TEST_DATA), args=args)
+        sys.stdout = io.StringIO()
+        reports = managers._analyse_engines(tree, args)
+        self.assertEqual(
+            ['n2_detect_excessive_periods_in_names', 'n2_detect_long_names', 'n2_detect_non_ascii_characters_in_names',
+             'n2_detect_odd_characets_in_names'],
+            [report.engine for report in reports]
+        )
+        output = sys.stdout.getvalue()
+        self.assertLess(output.index("excessive periods"), output.index("long names"))
+        self.assertNotIn("mixed case", output)
+        self.assertIsNone(cli.cli(f"bandbox analyse {TEST_DATA} --engines no_such_engine"))
+
+    def test_analyse_formats(self):
+        """Findings can be written as NDJSON records or as a JSON document"""
+        args = cli.cli(f"bandbox analyse {TEST_DATA} --no-cache")
+        self.assertEqual('text', args.format)
+        tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=str(args.prefix), args=args)
+        findings = tree.evaluate_rules(rules.get_rules(args._configs))
+        # top-level empty directories are only reported with --include-root, whatever the format
+        findings['empty_directories'] = tree.find_empty_directories(include_root=False)
+        self.assertLess(len(findings['empty_directories']), len(tree.find_empty_directories()))
+        args = cli.cli(f"bandbox analyse {TEST_DATA} --no-cache --format ndjson")
+        sys.stdout = io.StringIO()
+        managers.analyse(args)
+        records = [json.loads(line) for line in sys.stdout.getvalue().splitlines()]
+        self.assertEqual(sum(map(len, findings.values())), len(records))
+        self.assertEqual(
+            findings['unknown_file_extensions'],
+            [record['path'] for record in records if record['rule'] == 'unknown_file_extensions']
+        )
+        self.assertEqual({'rule', 'path', 'kind'}, set(records[0]))
+        self.assertTrue(all(
+            record['kind'] == rules.DIRECTORY for record in records if record['rule'] == 'empty_directories'
+        ))
+        self.assertTrue(all(
+            record['kind'] == rules.FILE for record in records if record['rule'] == 'unknown_file_extensions'
+        ))
+        args = cli.cli(f"bandbox analyse {TEST_DATA} --no-cache --format json")
+        sys.stdout = io.StringIO()
+        managers.analyse(args)
+        document = json.loads(sys.stdout.getvalue())
+        self.assertEqual(
+            {rule_name: len(found) for rule_name, found in findings.items()},
+            {rule_name: result['count'] for rule_name, result in document['rules'].items()}
+        )
+        sys.stdout = io.StringIO()
+        managers.analyse(cli.cli(f"bandbox analyse {TEST_DATA} --no-cache --format json --include-root"))
+        self.assertEqual(
+            len(tree.find_empty_directories()), json.loads(sys.stdout.getvalue())['rules']['empty_directories']['count']
+        )
+        self.assertIsNone(cli.cli(f"bandbox analyse {TEST_DATA} --format json --show-tree"))
+
+    def test_analyse_stream(self):
+        """Rules applied during the scan give the same findings as rules applied to the tree"""
+        args = cli.cli(f"bandbox analyse {TEST_DATA}")
+        tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=str(TEST_DATA), args=args)
+        findings = tree.evaluate_rules(rules.get_rules(args._configs))
+        streamed = models.Tree.from_stream(utils.scandir_recursive(args.path), prefix=str(TEST_DATA), args=args)
+        self.assertEqual(0, len(streamed))  # nothing was inserted
+        for rule_name, found in findings.items():
+            self.assertEqual(found, streamed._findings[rule_name], rule_name)
+        self.assertEqual(tree.find_empty_directories(include_root=False),
+                         streamed.find_empty_directories(include_root=False))
+        args = cli.cli(f"bandbox analyse {TEST_DATA / 'folder_with_multiple_files'} --stream")
+        sys.stdout = io.StringIO()
+        managers.analyse(args)
+        self.assertRegex(sys.stdout.getvalue(), r"(?s).*accessions in names.*file-EMPIAR-someting.tif.*")
+
+    def test_analyse_since(self):
+        """Reusing the results of a previous run gives the same findings as a full run"""
+        args = cli.cli(f"bandbox analyse {TEST_DATA}")
+        rules_ = rules.get_rules(args._configs)
+        tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=str(TEST_DATA), args=args)
+        findings = tree.evaluate_rules(rules_)
+        tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=str(TEST_DATA), args=args)
+        first, results = tree.evaluate_rules_since(rules_)
+        self.assertEqual(findings, first)
+        # a changed directory is evaluated again; the others are taken from the previous results
+        tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=str(TEST_DATA), args=args)
+        tree.insert(utils.Entry(f"{TEST_DATA}/folder_with_multiple_files/EMPIAR-10001_2021-01-01.txt"), str(TEST_DATA))
+        tree.insert(utils.Entry(f"{TEST_DATA}/added_folder", is_dir=True), str(TEST_DATA))
+        expected = tree.evaluate_rules(rules_)
+        second, _ = tree.evaluate_rules_since(rules_, previous=results)
+        self.assertEqual(expected, second)
+        self.assertIn("folder_with_multiple_files/EMPIAR-10001_2021-01-01.txt", second['accessions_in_names'])
+        self.assertIn("added_folder/", second['empty_directories'])
+        # results are saved for the next run
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results_file = os.path.join(tmp_dir, 'results.json')
+            args = cli.cli(f"bandbox analyse {TEST_DATA} --since {results_file} --no-cache")
+            sys.stdout = io.StringIO()
+            managers.analyse(args)
+            self.assertTrue(os.path.exists(results_file))
+            self.assertIsNone(cli.cli(f"bandbox analyse {TEST_DATA} --since {results_file} --stream"))
+
+    def test_analyse_sizes(self):
+        """Sizes read during the scan are kept in the tree and checked against the configured thresholds"""
+        self.assertEqual(512, utils.parse_size('512'))
+        self.assertEqual(1536, utils.parse_size('1.5K'))
+        self.assertEqual(100 << 30, utils.parse_size('100GB'))
+        self.assertRaises(ValueError, utils.parse_size, '1X')
+        self.assertEqual(['0B', '1K', '1.5G'], [utils.format_size(size) for size in (0, 1024, 3 << 29)])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name, size in (('empty.txt', 0), ('big.mrc', 2048), ('sub/a.mrc', 1024), ('sub/b.mrc', 1024)):
+                os.makedirs(os.path.dirname(os.path.join(tmp_dir, name)), exist_ok=True)
+                with open(os.path.join(tmp_dir, name), 'wb') as f:
+                    f.write(b'\0' * size)
+            args = cli.cli(f"bandbox analyse {tmp_dir} --no-cache")
+            args._configs.set('bandbox', 'max_file_size', '1K')
+            args._configs.set('bandbox', 'max_directory_size', '1.5K')
+            tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=tmp_dir, args=args)
+            big = [index for index in range(1, len(tree._kinds)) if tree.name(index) == 'big.mrc'][0]
+            self.assertEqual(2048, tree.size(big))
+            self.assertEqual(int(os.stat(os.path.join(tmp_dir, 'big.mrc')).st_mtime), tree.mtime(big))
+            self.assertEqual([1024, 1024], tree['sub'].sizes())
+            self.assertEqual(2048, tree['sub'].listing().size)
+            size_rules = [rules.SmallFiles(args._configs), rules.LargeFiles(args._configs),
+                          rules.LargeDirectories(args._configs)]
+            findings = tree.evaluate_rules(size_rules)
+            self.assertEqual(['empty.txt'], findings['small_files'])
+            self.assertEqual(['big.mrc'], findings['large_files'])
+            self.assertEqual(['', 'sub/'], sorted(findings['large_directories']))
+            streamed = models.Tree.from_stream(utils.scandir_recursive(args.path), prefix=tmp_dir, args=args,
+                                               rules_=size_rules)
+            # the files at the top are only summarised once the stream ends
+            self.assertEqual({name: sorted(found) for name, found in findings.items()},
+                             {name: sorted(found) for name, found in streamed._findings.items()})
+            # without stat nothing is known about sizes and the size rules have nothing to go on
+            tree = models.Tree.from_data(utils.scandir_recursive(args.path, stat=False), prefix=tmp_dir, args=args)
+            self.assertIsNone(tree.sizes())
+            self.assertEqual([], tree.evaluate_rules(size_rules)['small_files'])
+            # the sizes of files listed from the scan cache come from it without a call per file until the directory
+            # changes or the cache is rebuilt
+            cache_path = os.path.join(tmp_dir, 'scan.sqlite')
+            scan_cache = cache.ScanCache(cache_path)
+            scan_cache.RACY_SECONDS = -1
+            list(utils.scandir_recursive(os.path.join(tmp_dir, 'sub'), cache=scan_cache))
+            with open(os.path.join(tmp_dir, 'sub', 'a.mrc'), 'ab') as f:
+                f.write(b'\0')
+            counter = utils.ScanCounter()
+            sizes = {entry.name: entry.size for entry in
+                     utils.scandir_recursive(os.path.join(tmp_dir, 'sub'), cache=scan_cache, counter=counter)}
+            self.assertEqual(1, scan_cache.hits)
+            self.assertEqual(1, counter['stat'])  # the directory only
+            self.assertEqual({'a.mrc': 1024, 'b.mrc': 1024}, sizes)
+            scan_cache.close()
+            scan_cache = cache.ScanCache(cache_path, rebuild=True)
+            sizes = {entry.name: entry.size for entry in
+                     utils.scandir_recursive(os.path.join(tmp_dir, 'sub'), cache=scan_cache)}
+            self.assertEqual({'a.mrc': 1025, 'b.mrc': 1024}, sizes)
+            scan_cache.close()
+            # the size engines are skipped without stat
+            sys.stdout = io.StringIO()
+            managers.analyse(cli.cli(f"bandbox analyse {tmp_dir} --no-cache"))
+            self.assertIn("files smaller than 1B", sys.stdout.getvalue())
+            sys.stdout = io.StringIO()
+            managers.analyse(cli.cli(f"bandbox analyse {tmp_dir} --no-cache --no-stat"))
+            self.assertNotIn("files smaller than", sys.stdout.getvalue())
+
+    def test_analyse_checksums(self):
+        """Files missing from or not listed in checksum manifests are found; --verify-checksums also hashes them"""
+        self.assertEqual(
+            ([('data/a b.txt', 'md5', '0' * 32), ('c.txt', 'sha256', 'f' * 64), ('data/x\\y', 'md5', '1' * 32)], 1),
+            checksums.parse(f"{'0' * 32}  a b.txt\n# comment\nSHA256 (../c.txt) = {'F' * 64}\n\\{'1' * 32} *x\\\\y\n"
+                            f"not a checksum\n", directory='data')
+        )
+        self.assertEqual('sha256', checksums.algorithm_from_name('SHA256SUMS'))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            contents = {'a.txt': b'a', 'sub/b.txt': b'b', 'sub/c.txt': b'c', 'unlisted.txt': b'u'}
+            for name, content in contents.items():
+                os.makedirs(os.path.dirname(os.path.join(tmp_dir, name)), exist_ok=True)
+                with open(os.path.join(tmp_dir, name), 'wb') as f:
+                    f.write(content)
+            with open(os.path.join(tmp_dir, 'MD5SUMS'), 'w') as f:
+                f.write(f"{hashlib.md5(b'a').hexdigest()}  a.txt\n{hashlib.md5(b'gone').hexdigest()}  gone.txt\n")
+            with open(os.path.join(tmp_dir, 'sub', 'files.sha256'), 'w') as f:
+                f.write(f"{hashlib.sha256(b'b').hexdigest()}  b.txt\n{hashlib.sha256(b'changed').hexdigest()} *c.txt\n")
+            self.assertEqual(
+                (hashlib.md5(b'a').hexdigest(), 1), checksums.hash_file(os.path.join(tmp_dir, 'a.txt'), 'md5')
+            )
+            args = cli.cli(f"bandbox analyse {tmp_dir} --prefix {tmp_dir} --no-cache")
+            tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=tmp_dir, args=args)
+            self.assertEqual(
+                {'MD5SUMS', 'a.txt', 'unlisted.txt', 'sub/files.sha256', 'sub/b.txt', 'sub/c.txt'},
+                set(tree.file_paths())
+            )
+            self.assertEqual(
+                ['missing: gone.txt', 'unlisted: unlisted.txt'], engines.m3_detect_checksums(tree, args).dirs
+            )
+            args = cli.cli(f"bandbox analyse {tmp_dir} --prefix {tmp_dir} --no-cache --verify-checksums "
+                           f"--checksum-workers 2 --reads-per-filesystem 1")
+            report = engines.m3_detect_checksums(tree, args)
+            self.assertEqual(['missing: gone.txt', 'unlisted: unlisted.txt', 'mismatched: sub/c.txt'], report.dirs)
+            self.assertIn("3 files at", report.rule_text)
+            # the JSON formats get the same findings
+            sys.stdout = io.StringIO()
+            managers.analyse(cli.cli(f"bandbox analyse {tmp_dir} --prefix {tmp_dir} --no-cache --format ndjson "
+                                     f"--engines m3_*"))
+            self.assertEqual(
+                [{'rule': 'checksums_missing', 'path': 'gone.txt', 'kind': rules.FILE},
+                 {'rule': 'checksums_unlisted', 'path': 'unlisted.txt', 'kind': rules.FILE}],
+                [json.loads(line) for line in sys.stdout.getvalue().splitlines()]
+            )
+            os.remove(os.path.join(tmp_dir, 'MD5SUMS'))
+            os.remove(os.path.join(tmp_dir, 'sub', 'files.sha256'))
+            tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=tmp_dir, args=args)
+            report = engines.m3_detect_checksums(tree, args)
+            self.assertEqual([], report.dirs)
+            self.assertIn("(none found)", report.rule_text)
+        # a manifest in one directory says nothing about the files of its siblings
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ('dep/a/f1.mrc', 'dep/a/f2.mrc', 'dep/b/g1.mrc', 'dep/b/g2.mrc'):
+                os.makedirs(os.path.dirname(os.path.join(tmp_dir, name)), exist_ok=True)
+                open(os.path.join(tmp_dir, name), 'w').close()
+            with open(os.path.join(tmp_dir, 'dep', 'a', 'MD5SUMS'), 'w') as f:
+                f.write(f"{hashlib.md5(b'').hexdigest()}  f1.mrc\n")
+            args = cli.cli(f"bandbox analyse {tmp_dir} --prefix {tmp_dir} --no-cache")
+            tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=tmp_dir, args=args)
+            self.assertEqual(['unlisted: dep/a/f2.mrc'], engines.m3_detect_checksums(tree, args).dirs)
+        # scanning '.' the paths in the tree start with './' while those in manifests do not
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, 'data'))
+            with open(os.path.join(tmp_dir, 'data', 'a.txt'), 'wb') as f:
+                f.write(b'a')
+            with open(os.path.join(tmp_dir, 'MD5SUMS'), 'w') as f:
+                f.write(f"{hashlib.md5(b'a').hexdigest()}  data/a.txt\n")
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                args = cli.cli("bandbox analyse . --no-cache --verify-checksums --checksum-workers 1")
+                tree = models.Tree.from_data(utils.scandir_recursive(args.path), prefix=str(args.prefix), args=args)
+                self.assertIn('./data/a.txt', set(tree.file_paths()))
+                report = engines.m3_detect_checksums(tree, args)
+            finally:
+                os.chdir(cwd)
+            self.assertEqual([], report.dirs)
+            self.assertIn("1 files at", report.rule_text)
+            # the manifests of an archive are not on disk so the engine is left out
+            archive = os.path.join(tmp_dir, 'data.tar')
+            with tarfile.open(archive, 'w') as tar:
+                tar.add(os.path.join(tmp_dir, 'MD5SUMS'), arcname='MD5SUMS')
+            sys.stdout = io.StringIO()
+            managers.analyse(cli.cli(f"bandbox analyse {archive} --no-cache --engines m3_*"))
+            self.assertNotIn("checksums", sys.stdout.getvalue())
+        self.assertIsNone(cli.cli(f"bandbox analyse {TEST_DATA} --stream --verify-checksums"))
+        self.assertIsNone(cli.cli(f"bandbox analyse {TEST_DATA} --reads-per-filesystem 0"))
+
+    def test_analyse_cryptic_names(self):
+        """Names are split into words which are looked up once each in a memory-mapped index"""
+        self.assertEqual(
+            ['Foil', 'Hole', '1234', 'raw', 'Data', 'HTML', 'File', 'tomo', '3', 'd'],
+            words.tokenize("FoilHole_1234_rawData-HTMLFile.tomo3d")
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            word_list = os.path.join(tmp_dir, 'words.txt')
+            with open(word_list, 'w') as f:
+                f.write("# zebra\nzygote\n")
+            index = words.WordIndex.open(word_lists=[word_list], vocabulary=['apoferritin'], directory=tmp_dir)
+            self.assertIsInstance(index._data, mmap.mmap)
+            self.assertEqual(1, len(glob.glob(os.path.join(tmp_dir, 'words-*.idx'))))
+            self.assertTrue(all(word in index for word in ('apoferritin', 'zygote', 'tomogram', 'the')))
+            self.assertNotIn('zebra', index)
+            self.assertTrue(index.known('Tomograms') and index.known('aligned') and not index.known('xqz'))
+            index.lookups = 0
+            self.assertEqual(
+                [1.0, 1.0, 0.0], [index.known_fraction(f"motion_corrected_{i:05d}") for i in range(2)] + [
+                    index.known_fraction("Tr1_xqz")]
+            )
+            self.assertIsNone(index.known_fraction("0001"))
+            self.assertLessEqual(index.lookups, 2 * len(words._ENDINGS) + 2)  # each distinct token once
+            # the same word lists give the same index; a changed one another
+            self.assertEqual(len(index), len(words.WordIndex.open(
+                word_lists=[word_list], vocabulary=['apoferritin'], directory=tmp_dir
+            )))
+            self.assertEqual(len(index) - 1, len(words.WordIndex.open(vocabulary=['apoferritin'], directory=tmp_dir)))
+            # the index of another config is kept until it has not been used for a while
+            indexes = glob.glob(os.path.join(tmp_dir, 'words-*.idx'))
+            self.assertEqual(2, len(indexes))
+            unused = time.time() - words.MAX_INDEX_AGE - 60
+            for path in indexes:
+                os.utime(path, (unused, unused))
+            words.WordIndex.open(vocabulary=['nucleosome'], directory=tmp_dir)
+            self.assertEqual(1, len(glob.glob(os.path.join(tmp_dir, 'words-*.idx'))))
+        args = cli.cli(f"bandbox analyse {TEST_DATA}")
+        tree = models.Tree.from_data(utils.scandir_recursive(TEST_DATA / '0_bad'), prefix=str(TEST_DATA), args=args)
+        # off unless min_known_words is set
+        self.assertEqual([], tree.find_cryptic_names())
+        args = cli.cli(f"bandbox analyse {TEST_DATA}")
+        args._configs.set('bandbox', 'min_known_words', '0.5')
+        ruleset = rules.RuleSet.from_configs(args._configs)
+        self.assertIsNone(ruleset._words)  # only loaded when needed
+        tree = models.Tree.from_data(utils.scandir_recursive(TEST_DATA / '0_bad'), prefix=str(TEST_DATA), args=args)
+        found = tree.find_cryptic_names()
+        self.assertIn('0_bad/data/A U Thör et al - A very long relevant title that has most of the key words in your '
+                      'paper/A Folder with an overall description/0923480928 - Treatement Tr1-323 Tissue/', found)
+        self.assertFalse(any('Control Tissue' in finding for finding in found))
+
+    def test_analyse_siblings(self):
+        """Files are compared with their siblings by the shape of their names"""
+        self.assertEqual(('mrc', 'a_9_a_9'), rules.name_shape('FoilHole_1234_Data_0001.mrc'))
+        self.assertEqual(('', '.a'), rules.name_shape('.hidden'))
+        args = cli.cli(f"bandbox analyse")
+        names = [f"movie_{i:04d}.tif" for i in range(1, 20)] + ['movie_0001_old.tif', 'notes.txt'] + [
+            f"frame_{i}.mrc" for i in range(1, 12)] + ['gain.mrc']
+        siblings = rules.Siblings(names)
+        self.assertEqual({'tif', 'txt', 'mrc'}, set(siblings.groups))
+        self.assertEqual(
+            ['movie_0001_old.tif', 'gain.mrc'], rules.InconsistentNames(args._configs).check_siblings(siblings)
+        )
+        self.assertEqual(
+            [f"frame_{i}.mrc" for i in range(1, 10)], rules.MissingPadding(args._configs).check_siblings(siblings)
+        )
+        # too few siblings to tell
+        self.assertEqual([], rules.InconsistentNames(args._configs).check_siblings(rules.Siblings(names[-4:])))
+        tree = models.Tree()
+        tree._configs = args._configs
+        for name in names:
+            tree.insert(utils.Entry(f"data/{name}"))
+        self.assertEqual(['data/movie_0001_old.tif', 'data/gain.mrc'], tree.find_inconsistent_names())
+        self.assertEqual(9, len(tree.find_missing_padding()))
+        streamed = rules.evaluate_stream(
+            [utils.Entry(f"data/{name}") for name in names], [rules.MissingPadding(args._configs)], args._configs
+        )
+        self.assertEqual(tree.find_missing_padding(), streamed['missing_padding'])
+
+    def test_analyse_profile(self):
+        """The profile times each phase without the phases within it and counts entries and findings"""
+        profile = profiling.Profile(enabled=True)
+        start = time.perf_counter()
+        with profile.phase('outer'):
+            entries = list(profile.iterate(utils.scandir_recursive(TEST_DATA), 'scan'))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(len(entries), profile.counters['entries'])
+        self.assertEqual(sum(entry.is_dir() for entry in entries), profile.counters['directories'])
+        self.assertGreater(profile.phases['scan'][0], 0)
+        self.assertLessEqual(profile.phases['outer'][0] + profile.phases['scan'][0], elapsed)
+        disabled = profiling.Profile()
+        self.assertEqual(entries[:3], list(disabled.iterate(entries[:3], 'scan')))
+        with disabled.phase('outer'):
+            pass
+        self.assertEqual(dict(), disabled.phases)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profile_file = os.path.join(tmp_dir, 'profile.json')
+            stats_file = os.path.join(tmp_dir, 'profile.stats')
+            sys.stdout = io.StringIO()
+            managers.analyse(cli.cli(
+                f"bandbox analyse {TEST_DATA} --no-cache --profile --profile-output {profile_file} "
+                f"--cprofile {stats_file}"
+            ))
+            with open(profile_file) as f:
+                summary = json.load(f)
+            self.assertTrue({'scan', 'from_data', 'evaluate_rules', 'render'} <= set(summary['phases']))
+            self.assertIn('engines', summary['phases'])
+            self.assertIn('long_names', summary['rules'])
+            self.assertGreater(summary['counters']['name_checks_estimate'], summary['counters']['entries'])
+            self.assertGreater(summary['results']['empty_directories'], 0)
+            self.assertGreater(summary['memory']['peak_rss_kb'], 0)
+            # without the resource module (Windows) the peak is traced instead
+            with unittest.mock.patch.dict(sys.modules, {'resource': None}):
+                self.assertIsNone(profiling.peak_rss_kb())
+                without_rss = profiling.Profile(enabled=True)
+                without_rss.start()
+                self.assertNotIn('peak_rss_kb', without_rss.summary()['memory'])
+                self.assertIn('peak_traced_kb', without_rss.summary()['memory'])
+                without_rss.stop()
+                tracemalloc.stop()
+            self.assertTrue(os.path.exists(stats_file))
+            sys.stderr = io.StringIO()
+            managers.view(cli.cli(f"bandbox view {TEST_DATA} --no-cache --profile --trace-memory"))
+            self.assertRegex(sys.stderr.getvalue(), r"(?s)profile:.*render.*peak_traced_kb")
+            sys.stderr = sys.__stderr__
+        self.assertIsNone(cli.cli(f"bandbox view {TEST_DATA} --cprofile {stats_file}"))
+
 
 class TestUtils(Tests):
     def test_scandir_recursive(self):
@@ -334,3 +992,247 @@ class TestUtils(Tests):
         self.assertIsInstance(path_generator, types.GeneratorType)
         for dir_entry in path_generator:
             print(dir_entry, dir_entry.path)
+
+    def test_scandir_single_pass(self):
+        """Test that every directory is listed exactly once"""
+        base_dir = TEST_DATA / "folder_with_long_name_folders"
+        counter = utils.ScanCounter()
+        entries = list(utils.scandir_recursive(base_dir, counter=counter, stat=False))
+        directories = [entry for entry in entries if entry.is_dir()]
+        self.assertTrue(all(isinstance(entry, utils.Entry) for entry in entries))
+        self.assertEqual(len(directories) + 1, counter['scandir'])  # +1 for the base directory
+        self.assertEqual(len(entries), counter['entries'])
+        self.assertEqual(0, counter['stat'])
+        # the threaded walker does the same amount of work
+        parallel_counter = utils.ScanCounter()
+        list(utils.scandir_parallel(base_dir, workers=4, counter=parallel_counter, stat=False))
+        self.assertEqual(counter, parallel_counter)
+        # reading sizes costs at most one call per file
+        stat_counter = utils.ScanCounter()
+        list(utils.scandir_recursive(base_dir, counter=stat_counter))
+        self.assertEqual(len(entries) - len(directories), stat_counter['stat'])
+        self.assertEqual(counter['scandir'], stat_counter['scandir'])
+
+    def test_scandir_links(self):
+        """Test that links are not followed by default and that following them never enters a directory twice"""
+        with tempfile.TemporaryDirectory() as tmp_dir, tempfile.TemporaryDirectory() as outside, \
+                tempfile.TemporaryDirectory() as cache_dir:
+            os.makedirs(os.path.join(tmp_dir, 'data'))
+            open(os.path.join(tmp_dir, 'data', 'a.txt'), 'w').close()
+            os.link(os.path.join(tmp_dir, 'data', 'a.txt'), os.path.join(tmp_dir, 'data', 'hard.txt'))
+            os.symlink(tmp_dir, os.path.join(tmp_dir, 'data', 'loop'))  # to an ancestor
+            os.symlink(os.path.join(tmp_dir, 'missing'), os.path.join(tmp_dir, 'broken'))
+            os.symlink(outside, os.path.join(tmp_dir, 'ext'))
+            open(os.path.join(outside, 'x.txt'), 'w').close()
+            os.symlink(outside, os.path.join(outside, 'back'))  # to itself
+            os.makedirs(os.path.join(outside, 'sub'))
+            open(os.path.join(outside, 'sub', 'y.txt'), 'w').close()
+            os.symlink(os.path.join(outside, 'sub'), os.path.join(tmp_dir, 'ext_sub'))  # also reached through 'ext'
+
+            def _scan(**kwargs):
+                return {os.path.relpath(entry.path, tmp_dir): (entry.is_dir(), entry.link, entry.inode is not None)
+                        for entry in utils.scandir_recursive(tmp_dir, **kwargs)}
+
+            entries = _scan()
+            self.assertEqual({
+                'data': (True, None, False), 'data/a.txt': (False, None, True), 'data/hard.txt': (False, None, True),
+                'data/loop': (False, utils.SYMLINK, False), 'broken': (False, utils.BROKEN_SYMLINK, False),
+                'ext': (False, utils.SYMLINK, False), 'ext_sub': (False, utils.SYMLINK, False),
+            }, entries)
+            # without stat nothing is known about inodes or targets
+            self.assertEqual(
+                {'data/loop', 'broken', 'ext', 'ext_sub'},
+                {path for path, (_, link, inode) in _scan(stat=False).items() if link == utils.SYMLINK and not inode}
+            )
+            # links out of the directory are entered once; links back into it or to a directory entered before are not
+            followed = _scan(follow_symlinks=True)
+            self.assertEqual(
+                {'ext': (True, utils.SYMLINK, False), 'ext/x.txt': (False, None, False),
+                 'ext/back': (False, utils.SYMLINK, False), 'data/loop': (False, utils.SYMLINK, False)},
+                {path: followed[path] for path in ('ext', 'ext/x.txt', 'ext/back', 'data/loop')}
+            )
+            # a directory reached again through another link is left out rather than listed as a file
+            self.assertNotIn('ext/sub', followed)
+            self.assertEqual((True, utils.SYMLINK, False), followed['ext_sub'])
+            self.assertEqual(len(entries) + 3, len(followed))
+            # the threaded walker enters the same directories in the same order whichever listing is read first
+            walked = [(entry.path, entry.is_dir()) for entry in utils.scandir_recursive(tmp_dir, follow_symlinks=True)]
+            for _ in range(5):
+                self.assertEqual(walked, [
+                    (entry.path, entry.is_dir())
+                    for entry in utils.scandir_parallel(tmp_dir, workers=4, follow_symlinks=True, lookahead=8)
+                ])
+            # links are kept as such in the scan cache whichever way they were scanned
+            scan_cache = cache.ScanCache(os.path.join(cache_dir, 'scan.sqlite'))
+            scan_cache.RACY_SECONDS = -1
+            self.assertEqual(entries, _scan(cache=scan_cache))
+            self.assertEqual(followed, _scan(cache=scan_cache, follow_symlinks=True))
+            self.assertEqual(entries, _scan(cache=scan_cache))
+            self.assertGreater(scan_cache.hits, 0)
+            scan_cache.close()
+            # the link rules
+            args = cli.cli(f"bandbox analyse {tmp_dir} --no-cache")
+            tree = models.Tree.from_data(utils.scandir_recursive(tmp_dir), prefix=tmp_dir, args=args)
+            link_rules = [rules.HardLinks(args._configs), rules.SymbolicLinks(args._configs),
+                          rules.BrokenSymbolicLinks(args._configs)]
+            findings = tree.evaluate_rules(link_rules)
+            self.assertEqual(1, len(findings['hard_links']))
+            self.assertEqual({'data/a.txt', 'data/hard.txt'}, set(findings['hard_links'][0].split(" = ")))
+            self.assertEqual(['broken', 'data/loop', 'ext', 'ext_sub'], sorted(findings['symbolic_links']))
+            self.assertEqual(['broken'], findings['broken_symbolic_links'])
+            self.assertEqual(findings, tree.evaluate_rules(link_rules, jobs=2))
+            streamed = models.Tree.from_stream(utils.scandir_recursive(tmp_dir), prefix=tmp_dir, args=args,
+                                               rules_=link_rules)
+            self.assertEqual(findings, streamed._findings)
+            # links are neither files nor directories to the other rules
+            self.assertEqual(
+                {'data': models.DIRECTORY, 'broken': models.LINK, 'ext': models.LINK, 'ext_sub': models.LINK},
+                {tree.name(index): tree.kind(index) for index in tree.children()}
+            )
+            self.assertEqual([], tree.files())
+            self.assertEqual(['data'], list(tree))
+            self.assertEqual(2, tree.subtree()['files'])
+            self.assertEqual(['data/a.txt', 'data/hard.txt'], sorted(tree.file_paths()))
+            file_rules = [rules.UnknownFileExtensions(args._configs)]
+            self.assertEqual([], tree.evaluate_rules(file_rules)['unknown_file_extensions'])
+            streamed = models.Tree.from_stream(utils.scandir_recursive(tmp_dir), prefix=tmp_dir, args=args,
+                                               rules_=file_rules)
+            self.assertEqual([], streamed._findings['unknown_file_extensions'])
+            sys.stdout = io.StringIO()
+            managers.analyse(cli.cli(f"bandbox analyse {tmp_dir} --no-cache --no-stat --engines m4_*"))
+            output = sys.stdout.getvalue()
+            self.assertIn("symbolic links", output)
+            self.assertNotIn("hard links", output)
+
+    def test_scandir_parallel(self):
+        """Test that the threaded walker yields the same entries in the same order"""
+        base_dir = TEST_DATA / "folder_with_long_name_folders"
+        path_generator = utils.scandir_parallel(base_dir, workers=4)
+        self.assertIsInstance(path_generator, types.GeneratorType)
+        expected = [dir_entry.path for dir_entry in utils.scandir_recursive(base_dir)]
+        self.assertEqual(expected, [dir_entry.path for dir_entry in path_generator])
+        # sorted on request
+        sorted_paths = [dir_entry.path for dir_entry in utils.scandir_parallel(base_dir, workers=4, sort=True)]
+        self.assertEqual(
+            [dir_entry.path for dir_entry in utils.scandir_recursive(base_dir, sort=True)],
+            sorted_paths
+        )
+        top_level = [p for p in sorted_paths if os.path.dirname(p) == str(base_dir)]
+        self.assertEqual(sorted(top_level), top_level)
+        # the walker only reads a few directories ahead of the consumer
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for i in range(50):
+                os.makedirs(os.path.join(tmp_dir, f"folder{i}", "inner"))
+            self.assertEqual(
+                [dir_entry.path for dir_entry in utils.scandir_recursive(tmp_dir)],
+                [dir_entry.path for dir_entry in utils.scandir_parallel(tmp_dir, workers=2, lookahead=1)]
+            )
+            counter = utils.ScanCounter()
+            path_generator = utils.scandir_parallel(tmp_dir, workers=2, counter=counter, lookahead=4)
+            next(path_generator)
+            path_generator.close()
+            self.assertLessEqual(counter['scandir'], 1 + 4)
+
+    def test_scan_cache(self):
+        """Test that unchanged directories are taken from the cache on the second scan"""
+        base_dir = TEST_DATA / "folder_with_long_name_folders"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_path = os.path.join(tmp_dir, 'scan.sqlite')
+            scan_cache = cache.ScanCache(cache_path)
+            scan_cache.RACY_SECONDS = -1  # cache freshly created test directories too
+            expected = [(e.path, e.is_dir()) for e in utils.scandir_recursive(base_dir, cache=scan_cache)]
+            self.assertEqual(0, scan_cache.hits)
+            directories = scan_cache.misses
+            scan_cache.close()
+            scan_cache = cache.ScanCache(cache_path)
+            counter = utils.ScanCounter()
+            entries = [
+                (e.path, e.is_dir()) for e in utils.scandir_recursive(base_dir, counter=counter, cache=scan_cache)
+            ]
+            self.assertEqual(expected, entries)
+            self.assertEqual(directories, scan_cache.hits)
+            self.assertEqual(0, counter['scandir'])
+            scan_cache.close()
+            # rebuilding starts from scratch
+            scan_cache = cache.ScanCache(cache_path, rebuild=True)
+            list(utils.scandir_recursive(base_dir, cache=scan_cache))
+            self.assertEqual(0, scan_cache.hits)
+            scan_cache.close()
+        args = cli.cli(f"bandbox view {TEST_DATA}")
+        self.assertIsNone(args.cache)
+        self.assertFalse(args.no_cache)
+        self.assertFalse(args.rebuild_cache)
+
+
+class TestSources(Tests):
+    def test_read_listing(self):
+        """Test that listings in each format give the same tree as a scan"""
+        base_dir = TEST_DATA / "folder_with_multiple_files"
+        args = cli.cli(f"bandbox view {base_dir}")
+        entries = list(utils.scandir_recursive(base_dir))
+        expected = str(models.Tree.from_data(entries, prefix=str(TEST_DATA), args=args))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            listings = {
+                'print0': b"\0".join(os.fsencode(e.path + ('/' if e.is_dir() else '')) for e in entries),
+                'lines': b"\n".join(os.fsencode(e.path) for e in entries) + b"\n",
+                'comma': b", ".join(os.fsencode(e.path + ('/' if e.is_dir() else '')) for e in entries) + b"\n",
+                'printf': b"".join(
+                    b"%s %d %s\n" % (b'd' if e.is_dir() else b'f', 4096 if e.is_dir() else 10, os.fsencode(e.path))
+                    for e in entries
+                ),
+            }
+            for listing_format, content in listings.items():
+                listing = os.path.join(tmp_dir, f"listing.{listing_format}.gz")
+                with gzip.open(listing, 'wb') as f:
+                    f.write(content)
+                self.assertEqual(listing_format, sources.detect_format(content[:sources.CHUNK_SIZE]))
+                for detected in (listing_format, 'auto'):
+                    tree = models.Tree.from_data(
+                        sources.read_listing(listing, format=detected), prefix=str(TEST_DATA), args=args
+                    )
+                    if listing_format == 'lines':  # empty directories cannot be told apart from files
+                        self.assertEqual(len(entries), len(list(sources.read_listing(listing))))
+                    else:
+                        self.assertEqual(expected, str(tree), listing_format)
+            sizes = [e.size for e in sources.read_listing(os.path.join(tmp_dir, "listing.printf.gz"))]
+            self.assertEqual({10, 4096}, set(sizes))
+            with open(os.path.join(tmp_dir, "links.printf"), 'wb') as f:
+                f.write(b"d 4096 a\nl 7 a/link\nf 10 a/b.txt\n")
+            links = list(sources.read_listing(os.path.join(tmp_dir, "links.printf")))
+            self.assertEqual([None, utils.SYMLINK, None], [e.link for e in links])
+            # analyse reads listings too
+            args = cli.cli(f"bandbox analyse -f {os.path.join(tmp_dir, 'listing.printf.gz')} --format json")
+            sys.stdout = io.StringIO()
+            managers.analyse(args)
+            self.assertEqual(1, json.loads(sys.stdout.getvalue())['rules']['accessions_in_names']['count'])
+
+    def test_read_archive(self):
+        """Test that the members of tar and zip archives give the same tree as a scan of the archived directory"""
+        base_dir = TEST_DATA / "folder_with_multiple_files"
+        args = cli.cli(f"bandbox view {base_dir}")
+        # tarfile adds entries sorted by name
+        expected = str(models.Tree.from_data(
+            utils.scandir_recursive(base_dir, sort=True), prefix=str(base_dir.parent), args=args
+        )).split("\n", 1)[1]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for archive_name in ("archive.tar", "archive.tar.gz", "archive.zip"):
+                archive = os.path.join(tmp_dir, archive_name)
+                if archive_name.endswith(".zip"):
+                    with zipfile.ZipFile(archive, 'w') as zip_file:
+                        for entry in utils.scandir_recursive(base_dir, sort=True):
+                            zip_file.write(entry.path, arcname=os.path.relpath(entry.path, base_dir))
+                else:
+                    with tarfile.open(archive, 'w:gz' if archive_name.endswith('.gz') else 'w') as tar_file:
+                        tar_file.add(base_dir, arcname='.')
+                self.assertTrue(sources.is_archive(archive))
+                tree = models.Tree.from_data(sources.read_archive(archive), prefix=tmp_dir, args=args)
+                root, rest = str(tree).split("\n", 1)
+                self.assertEqual(f"└── {archive_name}", root)
+                self.assertEqual(expected, rest, archive_name)
+            args = cli.cli(f"bandbox analyse {os.path.join(tmp_dir, 'archive.zip')} --format json")
+            sys.stdout = io.StringIO()
+            managers.analyse(args)
+            self.assertEqual(1, json.loads(sys.stdout.getvalue())['rules']['accessions_in_names']['count'])
+        self.assertFalse(sources.is_archive(BASE_DIR / "README.md"))
+        self.assertIsNone(cli.cli(f"bandbox view {BASE_DIR / 'README.md'}"))
+
@@ -1,22 +1,316 @@
+import collections
+import concurrent.futures
+import functools
 import os
 import pathlib
+import threading
 import typing
-import sys
 
+import bandbox.cache
 
-def scandir_recursive(path: pathlib.Path, recursive=True) -> typing.Generator:
+# links
+SYMLINK = 'symlink'
+BROKEN_SYMLINK = 'broken symlink'
+# listings held per thread by `scandir_parallel`
+LOOKAHEAD = 16
+
+
+class Entry:
+    """A directory entry whose type was resolved once during the scan
+
+    Quacks like `os.DirEntry` for everything the tree uses but never goes back to the filesystem. The size and
+    modification time (in whole seconds) of files are those found during the scan or -1 if they were not read.
+
+    `link` is `SYMLINK` for a symbolic link, `BROKEN_SYMLINK` if it is known to point to nothing and None otherwise; a
+    link to a directory is only a directory if the scan follows links and a link is never a file. `inode` is the
+    (st_dev, st_ino) of a file with more than one hard link if it was read.
+    """
+    __slots__ = ('path', 'name', '_is_dir', 'size', 'mtime', 'link', 'inode')
+
+    def __init__(self, path: str, is_dir: bool = False, name: typing.Optional[str] = None, size: int = -1,
+                 mtime: int = -1, link: typing.Optional[str] = None, inode: typing.Optional[tuple] = None):
+        self.path = path
+        self.name = os.path.basename(path.rstrip('/')) if name is None else name
+        self._is_dir = is_dir
+        self.size = size  # -1 if unknown
+        self.mtime = mtime  # -1 if unknown
+        self.link = link
+        self.inode = inode
+
+    @classmethod
+    def from_dir_entry(cls, dir_entry: os.DirEntry, stat: bool = False):
+        """The entry for an `os.DirEntry` without following symbolic links; with `stat` the size, mtime and inode of a
+        file are read too (free on some filesystems, otherwise one call)"""
+        entry = cls(dir_entry.path, is_dir=dir_entry.is_dir(follow_symlinks=False), name=dir_entry.name,
+                    link=SYMLINK if dir_entry.is_symlink() else None)
+        if stat and not entry._is_dir:
+            entry._stat(dir_entry.stat)
+        return entry
+
+    def _stat(self, stat) -> None:
+        try:
+            result = stat(follow_symlinks=False)
+        except OSError:  # e.g. removed since it was listed
+            return
+        self.size, self.mtime = result.st_size, int(result.st_mtime)
+        if result.st_nlink > 1:
+            self.inode = (result.st_dev, result.st_ino)
+
+    def is_dir(self) -> bool:
+        return self._is_dir
+
+    def is_file(self) -> bool:
+        return not self._is_dir and self.link is None
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} '{self.name}'>"
+
+
+class ScanCounter(collections.Counter):
+    """Count the filesystem calls made during a scan
+
+    Safe to share between the threads of `scandir_parallel`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def add(self, key: str, count: int = 1) -> None:
+        with self._lock:
+            self[key] += count
+
+    def __str__(self):
+        return f"{self['entries']} entries; {self['scandir']} scandir calls; {self['stat']} stat calls"
+
+
+_SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40, 'P': 1 << 50}
+
+
+def parse_size(value: str) -> int:
+    """A number of bytes from e.g. '512', '100K' or '1.5T'; units are powers of 1024 and a trailing 'B' is optional"""
+    text = value.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    unit = text[-1:] if text[-1:].isalpha() else ''
+    try:
+        return int(float(text[:len(text) - len(unit)]) * _SIZE_UNITS[unit])
+    except (KeyError, ValueError):
+        raise ValueError(f"invalid size '{value}'") from None
+
+
+def format_size(size: int) -> str:
+    """A number of bytes in the largest unit it reaches e.g. '1.5G'"""
+    for unit in ('P', 'T', 'G', 'M', 'K'):
+        if size >= _SIZE_UNITS[unit]:
+            value = size / _SIZE_UNITS[unit]
+            return f"{value:.0f}{unit}" if value == int(value) else f"{value:.1f}{unit}"
+    return f"{size}B"
+
+
+class InodeIndex:
+    """The (st_dev, st_ino) of the directories entered by a scan which follows symbolic links
+
+    Every directory is entered at most once: a link to a directory which was already entered (e.g. to one of its own
+    ancestors) stays a link and a directory reached again by another path is left out so that cycles end and no data
+    is scanned twice. Links into the scanned directory
+    are never followed since their targets are scanned under their own paths. Safe to share between threads.
+    """
+
+    def __init__(self, root):
+        self._root = os.path.realpath(root)
+        self._entered = set()
+        self._lock = threading.Lock()
+        self.enter(root)
+
+    def _inside(self, path) -> bool:
+        real = os.path.realpath(path)
+        return real == self._root or real.startswith(self._root.rstrip(os.sep) + os.sep)
+
+    def enter(self, path, symlink: bool = False) -> bool:
+        """Whether to enter a directory, which is then recorded as entered"""
+        if symlink and self._inside(path):
+            return False
+        try:
+            result = os.stat(path)
+        except OSError:
+            return False
+        key = (result.st_dev, result.st_ino)
+        with self._lock:
+            if key in self._entered:
+                return False
+            self._entered.add(key)
+        return True
+
+
+def split_path(path: str, prefix: str = '', sep: str = '/') -> list:
+    """The components of a path once the prefix has been removed"""
+    if prefix == '.':
+        return path.strip(sep).split(sep)
+    return path[len(prefix):].strip(sep).split(sep)
+
+
+def _cached_kind(entry: Entry) -> str:
+    if entry.link is not None:
+        return bandbox.cache.SYMLINK
+    return bandbox.cache.DIRECTORY if entry.is_dir() else bandbox.cache.FILE
+
+
+def _resolve_links(entries: list, stat: bool = True, index: typing.Optional[InodeIndex] = None) -> int:
+    """Find out where the symbolic links in a listing lead; returns the number of stat calls made
+
+    With `stat` each link is checked for a target. With an `index` (following links) a link to a directory becomes a
+    directory if the index lets it be entered and a directory which was already entered through a link is removed from
+    `entries`.
+    """
+    calls = 0
+    revisited = list()  # positions of the directories entered before
+    for position, entry in enumerate(entries):
+        if entry.link is not None:
+            if stat or index is not None:
+                calls += 1
+                if not os.path.exists(entry.path):
+                    entry.link = BROKEN_SYMLINK
+                    continue
+            if index is not None and os.path.isdir(entry.path):
+                calls += 2
+                if index.enter(entry.path, symlink=True):
+                    entry._is_dir = True
+                    entry.size = entry.mtime = -1
+                    entry.inode = None
+        elif index is not None and entry.is_dir():
+            calls += 1
+            if not index.enter(entry.path):
+                revisited.append(position)
+    for position in reversed(revisited):
+        del entries[position]
+    return calls
+
+
+def _list_directory(path, sort=False, counter: typing.Optional[ScanCounter] = None, cache=None,
+                    stat: bool = True, index: typing.Optional[InodeIndex] = None, resolve: bool = True) -> list:
+    """Read a directory exactly once or take its listing from the cache if it has not changed
+
+    With `stat` the size, mtime and inode of every file are read too. Those of files listed from the cache are taken
+    from it (see `cache.ScanCache`) unless they were not read when the listing was cached. Symbolic links are then
+    resolved unless `resolve` is false, in which case the caller does it (see `_resolve`).
+    """
+    entries = None
+    if cache is not None:
+        directory_stat = os.stat(path)
+        cached = cache.get(path, directory_stat)
+        if counter is not None:
+            counter.add('stat')
+        if cached is not None:
+            entries = [
+                Entry(os.path.join(path, name), is_dir=kind == bandbox.cache.DIRECTORY, name=name,
+                      link=SYMLINK if kind == bandbox.cache.SYMLINK else None,
+                      **(dict(size=size, mtime=mtime, inode=inode) if stat else dict()))
+                for name, kind, size, mtime, inode in cached
+            ]
+            if stat:
+                # e.g. cached by a scan without stat
+                files = [entry for entry in entries if not entry.is_dir() and entry.size < 0]
+                for entry in files:
+                    entry._stat(functools.partial(os.stat, entry.path))
+                if counter is not None and files:
+                    counter.add('stat', len(files))
+    if entries is None:
+        with os.scandir(path) as dir_entries:
+            entries = [Entry.from_dir_entry(dir_entry, stat=stat) for dir_entry in dir_entries]
+        if counter is not None:
+            counter.add('scandir')
+            if stat:
+                counter.add('stat', sum(1 for entry in entries if not entry.is_dir()))
+        if cache is not None:
+            cache.put(path, directory_stat, (
+                (entry.name, _cached_kind(entry), entry.size, entry.mtime, entry.inode) for entry in entries
+            ))
+    if sort:
+        entries.sort(key=lambda e: e.name)
+    if resolve:
+        _resolve(entries, counter=counter, stat=stat, index=index)
+    return entries
+
+
+def _resolve(entries: list, counter: typing.Optional[ScanCounter] = None, stat: bool = True,
+             index: typing.Optional[InodeIndex] = None) -> None:
+    """Resolve the links of a listing (see `_resolve_links`) and count the calls made and the entries kept"""
+    calls = _resolve_links(entries, stat=stat, index=index)
+    if counter is not None:
+        if calls:
+            counter.add('stat', calls)
+        counter.add('entries', len(entries))
+
+
+def scandir_recursive(path: pathlib.Path, recursive=True, sort=False, counter: typing.Optional[ScanCounter] = None,
+                      cache=None, stat: bool = True, follow_symlinks: bool = False) -> typing.Generator:
     """Recursively scan a directory
 
-    Recursion can be switchef off
+    Each directory is listed once and yielded as `Entry` objects which carry the type found in the listing and, unless
+    `stat` is false, the size, mtime and inode of files. With a `cache.ScanCache` unchanged directories are not listed
+    at all. Recursion can be switched off. Symbolic links to directories are only entered with `follow_symlinks`, in
+    which case no directory is entered twice (see `InodeIndex`).
+    """
+    index = InodeIndex(path) if follow_symlinks else None
+
+    def _walk(path_):
+        for entry in _list_directory(path_, sort=sort, counter=counter, cache=cache, stat=stat, index=index):
+            yield entry
+            if recursive and entry.is_dir():
+                yield from _walk(entry.path)
+
+    yield from _walk(path)
+
+
+def scandir_parallel(path: pathlib.Path, workers=4, sort=False, counter: typing.Optional[ScanCounter] = None,
+                     cache=None, stat: bool = True, follow_symlinks: bool = False,
+                     lookahead: typing.Optional[int] = None) -> typing.Generator:
+    """Recursively scan a directory using a pool of threads
+
+    Directories are listed by the pool in the order the walk reaches them so that many metadata requests are in flight
+    at once. At most `lookahead` listings [default: `LOOKAHEAD` per worker] are held at a time, being read or waiting
+    for the walk to reach them, so memory does not grow with the size of the tree. Entries are still yielded
+    depth-first in the same order as `scandir_recursive`; use `sort=True` to order the entries of each directory by
+    name. With `follow_symlinks` the links of each listing are resolved by the walk rather than by the pool so that a
+    directory reached by two paths is always entered through the one walked first, as by `scandir_recursive`.
     """
-    with os.scandir(path) as dir_entries:
-        for dir_entry in dir_entries:
-            if dir_entry.is_dir():
-                if os.listdir(dir_entry.path):
-                    yield dir_entry
-                    if recursive:
-                        yield from scandir_recursive(dir_entry.path)
-                else:
-                    yield dir_entry
-            else:
-                yield dir_entry
+    index = InodeIndex(path) if follow_symlinks else None
+    if lookahead is None:
+        lookahead = LOOKAHEAD * workers
+    pending = list()  # directories found but not walked yet; the next one last
+    listings = dict()  # path -> future listing
+
+    def _list(path_):
+        return _list_directory(path_, sort=sort, counter=counter, cache=cache, stat=stat, resolve=index is None)
+
+    def _fill():
+        """Request the listings of the next directories the walk will enter"""
+        for path_ in reversed(pending):
+            if len(listings) >= lookahead:
+                break
+            if path_ not in listings:
+                listings[path_] = executor.submit(_list, path_)
+
+    def _walk(path_):
+        listing = listings.pop(path_, None)
+        _fill()  # keep the pool busy while waiting
+        entries = _list(path_) if listing is None else listing.result()
+        if index is not None:  # in the order of the walk
+            _resolve(entries, counter=counter, stat=stat, index=index)
+        pending.extend(reversed([entry.path for entry in entries if entry.is_dir()]))
+        _fill()
+        for entry in entries:
+            yield entry
+            if entry.is_dir():
+                pending.pop()  # the walk enters it now
+                yield from _walk(entry.path)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        yield from _walk(path)
+    finally:
+        # drop the listings nobody will read if the consumer bails out early
+        for listing in listings.values():
+            listing.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,184 @@
+"""
+Words in names (N1)
+
+Names are split into tokens on separators, camelCase boundaries and runs of digits (`tokenize`) and the tokens are
+looked up in a word index. The index is built from the word list shipped with bandbox (`words.txt`), any word lists
+named in the configs (e.g. /usr/share/dict/words) and the configured vocabulary.
+
+The index is a file of sorted, lower case, utf-8 words back to back after a table of where each starts. It is built
+once next to the scan cache, named after the word lists it was built from, and memory-mapped so that opening it costs
+nothing and only the pages touched by the lookups are read. Lookups are binary searches and every distinct token is
+looked up once (`WordIndex.known`) so checking millions of names costs about the number of distinct tokens.
+"""
+import array
+import glob
+import hashlib
+import mmap
+import os
+import re
+import struct
+import time
+
+import bandbox.cache
+
+WORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'words.txt')
+# bumped whenever the format of the index changes
+VERSION = 1
+_MAGIC = b'BBWORDS'
+_HEADER = struct.Struct('<7sBII')  # magic, version, number of words, unused (aligns the table)
+# indexes of other word lists not used for this long are removed
+MAX_INDEX_AGE = 30 * 24 * 3600
+
+_TOKEN_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+|[^\W\d_]+")
+# endings tried when a token is not found as is: (ending, replacement)
+_ENDINGS = (('ies', 'y'), ('es', ''), ('s', ''), ('ing', ''), ('ing', 'e'), ('ed', ''), ('ed', 'e'))
+
+
+def tokenize(name: str) -> list:
+    """The words and numbers in a name e.g. 'FoilHole_1234_rawData' -> ['Foil', 'Hole', '1234', 'raw', 'Data']"""
+    return _TOKEN_RE.findall(name)
+
+
+def read_words(path: str) -> list:
+    """The words in a word list: whitespace-separated, one or more per line; lines starting with '#' are comments"""
+    words = list()
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.startswith('#'):
+                words.extend(line.split())
+    return words
+
+
+def build_index(words) -> bytes:
+    """The index of a collection of words; see `WordIndex`"""
+    encoded = sorted({word.lower().encode('utf-8', 'surrogatepass') for word in words})
+    offsets = array.array('I', [0])
+    for word in encoded:
+        offsets.append(offsets[-1] + len(word))
+    if offsets.itemsize != 4:  # pragma: no cover
+        raise RuntimeError("unsigned int must be 4 bytes")
+    return _HEADER.pack(_MAGIC, VERSION, len(encoded), 0) + offsets.tobytes() + b''.join(encoded)
+
+
+def _remove_unused(directory: str, keep: str) -> None:
+    """Remove the indexes in a directory which have not been used for `MAX_INDEX_AGE` seconds"""
+    oldest = time.time() - MAX_INDEX_AGE
+    for path in glob.glob(os.path.join(directory, 'words-*.idx')):
+        try:
+            if path != keep and os.stat(path).st_mtime < oldest:
+                os.remove(path)
+        except OSError:  # e.g. removed by another run
+            continue
+
+
+class WordIndex:
+    """Sorted words looked up by binary search
+
+    :param data: an index made by `build_index`, either bytes or a memory map of an index file
+    """
+
+    def __init__(self, data):
+        magic, version, count, _ = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != VERSION:
+            raise ValueError("not a word index or made by another version")
+        self._data = data
+        self._count = count
+        self._start = _HEADER.size + 4 * (count + 1)
+        self._offsets = memoryview(data)[_HEADER.size:self._start].cast('I')
+        self._known = dict()  # token -> whether it is a word
+        self.lookups = 0
+
+    @classmethod
+    def open(cls, word_lists=(), vocabulary=(), directory: str = None):
+        """The index of the shipped word list, other word lists and a vocabulary; built on first use
+
+        The index file is named after the word lists (paths, sizes and modification times) and the vocabulary so that
+        it is rebuilt when any of them changes. Configs with other word lists have their own indexes side by side; an
+        index is touched whenever it is opened and those not used for `MAX_INDEX_AGE` seconds are removed when another
+        is built. If it cannot be written the index is kept in memory.
+
+        :param word_lists: paths of other word lists
+        :param vocabulary: more words
+        :param directory: where the index file is kept [default: next to the scan cache]
+        """
+        sources = [WORDS_PATH] + [os.path.expanduser(path) for path in word_lists]
+        key = hashlib.blake2b(digest_size=12)
+        key.update(f"{VERSION}\0{chr(0).join(sorted(vocabulary))}".encode('utf-8', 'surrogatepass'))
+        for path in sources:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # missing word lists are skipped when the index is built too
+            key.update(f"\0{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode('utf-8'))
+        if directory is None:
+            directory = os.path.dirname(bandbox.cache.default_path())
+        path = os.path.join(directory, f"words-{key.hexdigest()}.idx")
+        try:
+            index = cls._map(path)
+        except (OSError, ValueError):
+            pass
+        else:
+            try:
+                os.utime(path)  # in use
+            except OSError:
+                pass
+            return index
+        words = list(vocabulary)
+        for source in sources:
+            try:
+                words.extend(read_words(source))
+            except OSError:
+                continue
+        data = build_index(words)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            _remove_unused(directory, keep=path)
+            return cls._map(path)
+        except (OSError, ValueError):
+            return cls(data)
+
+    @classmethod
+    def _map(cls, path: str):
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return self._count
+
+    def _word(self, position: int) -> bytes:
+        return self._data[self._start + self._offsets[position]:self._start + self._offsets[position + 1]]
+
+    def __contains__(self, word: str) -> bool:
+        self.lookups += 1
+        key = word.encode('utf-8', 'surrogatepass')
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._word(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self._count and self._word(low) == key
+
+    def known(self, token: str) -> bool:
+        """Whether a token is a word, perhaps in the plural or with -ing/-ed; each distinct token is looked up once"""
+        known = self._known.get(token)
+        if known is None:
+            word = token.lower()
+            known = word in self or any(
+                word[:-len(ending)] + replacement in self for ending, replacement in _ENDINGS
+                if word.endswith(ending) and len(word) - len(ending) + len(replacement) > 2
+            )
+            self._known[token] = known
+        return known
+
+    def known_fraction(self, name: str):
+        """The fraction of the words in a name which are known or None if it has none (e.g. only digits)"""
+        tokens = [token for token in tokenize(name) if not token.isdigit()]
+        if not tokens:
+            return None
+        return sum(map(self.known, tokens)) / len(tokens)
@@ -0,0 +1,183 @@
+"""
+Time bandbox on synthetic datasets
+
+    python benchmarks/run.py --scales 10k 100k --output results.json
+    python benchmarks/run.py --scales 10k --on-disk /scratch/bandbox-bench  # also time the scan
+    python benchmarks/run.py --scales 100k 1M --memory  # bytes per entry of the tree and of the nested dicts
+
+Each scale runs in its own process so that its peak RSS can be measured. Entries are generated as the tree is built,
+as a scan would yield them, so the peak RSS is that of the tree rather than of a list of entries. With `--memory` the
+bytes kept by the tree and by the nested dictionaries bandbox used before the node table are also measured with
+`tracemalloc` (slow). Results are written as JSON together with the commit and Python version so that runs on
+different commits can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BASE_DIR)
+
+import synthetic  # noqa: E402
+from bandbox import cli, columnar, models, rules, utils  # noqa: E402
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _retained(function, *args, **kwargs):
+    """What a function returns and the bytes still allocated once it has returned i.e. the size of the result"""
+    tracemalloc.start()
+    try:
+        result = function(*args, **kwargs)
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def _nested_dict(entries, sep: str = '/') -> dict:
+    """The tree as the nested dictionaries bandbox kept before the node table: a dictionary per directory and a
+    '_files' list of names (see `Tree.to_dict`)"""
+    data = dict()
+    for entry in entries:
+        path_list = entry.path.strip(sep).split(sep)
+        insertion_point = data
+        for element in path_list[:-1]:
+            insertion_point = insertion_point.setdefault(element, dict())
+        if entry.is_file():
+            insertion_point.setdefault('_files', list()).append(path_list[-1])
+        else:
+            insertion_point.setdefault(path_list[-1], dict())
+    return data
+
+
+def _indexed_tree(entries, args) -> models.Tree:
+    """The tree with its index of children, which is part of its memory"""
+    tree = models.Tree.from_data(entries, args=args)
+    tree.children()
+    return tree
+
+
+def _memory(size: int, seed: int, args) -> dict:
+    """Bytes per entry kept by the tree and by the nested dictionaries for the same entries"""
+    tree, tree_bytes = _retained(_indexed_tree, synthetic.generate(size, seed=seed), args)
+    entry_count = len(tree._parents) - 1
+    del tree
+    nested, nested_bytes = _retained(_nested_dict, synthetic.generate(size, seed=seed))
+    del nested
+    return {
+        'tree_bytes_per_entry': tree_bytes / entry_count,
+        'nested_dict_bytes_per_entry': nested_bytes / entry_count,
+    }
+
+
+def run_scale(scale: str, seed: int = 0, on_disk: str = None, memory: bool = False) -> dict:
+    """Time each phase on one synthetic dataset; with `memory` also measure the bytes per entry (see `_memory`)"""
+    args = cli.cli(f"bandbox view . --config-file {os.path.join(BASE_DIR, 'bandbox.cfg')}")
+    size = synthetic.SCALES[scale]
+    timings = dict()
+    # the entries are generated again for each use rather than held in a list
+    entry_count, timings['generate'] = _timed(sum, (1 for _ in synthetic.generate(size, seed=seed)))
+    timings['scan'] = None
+    if on_disk:
+        base_dir = tempfile.mkdtemp(dir=on_disk)
+        try:
+            synthetic.materialise(synthetic.generate(size, seed=seed), base_dir)
+            scanned, timings['scan'] = _timed(list, utils.scandir_recursive(os.path.join(base_dir, synthetic.ROOT)))
+            del scanned
+        finally:
+            shutil.rmtree(base_dir)
+    # includes generating the entries (see 'generate')
+    tree, timings['from_data'] = _timed(models.Tree.from_data, synthetic.generate(size, seed=seed), args=args)
+    # each rule on its own, then all of them in one pass
+    results = dict()
+    for method_name in sorted(name for name in dir(tree) if name.startswith('find_')):
+        tree._findings.clear()
+        found, timings[method_name] = _timed(getattr(tree, method_name))
+        results[method_name] = len(found)
+    tree._findings.clear()
+    _, timings['evaluate_rules'] = _timed(tree.evaluate_rules, rules.get_rules(args._configs), backend='python')
+    timings['evaluate_rules_numpy'] = None
+    if columnar.AVAILABLE:
+        _, timings['evaluate_rules_numpy'] = _timed(
+            tree.evaluate_rules, rules.get_rules(args._configs), backend='numpy'
+        )
+    _, timings['render'] = _timed(sum, (len(line) for line in tree.render()))
+    return {
+        'scale': scale,
+        'entries': entry_count,
+        'seed': seed,
+        'timings': timings,
+        'results': results,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'memory': _memory(size, seed, args) if memory else None,
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time bandbox on synthetic datasets")
+    parser.add_argument('--scales', nargs='+', default=['10k', '100k'], choices=list(synthetic.SCALES),
+                        help="dataset sizes to run [default: 10k 100k]")
+    parser.add_argument('--seed', default=0, type=int, help="seed of the generator [default: 0]")
+    parser.add_argument('--on-disk', help="create the datasets under this directory to time the scan [default: None]")
+    parser.add_argument('--memory', action='store_true',
+                        help="measure the bytes per entry of the tree and of the nested dictionaries [default: False]")
+    parser.add_argument('-o', '--output', help="write the results to this JSON file [default: stdout]")
+    parser.add_argument('--single', help=argparse.SUPPRESS)  # run one scale in this process
+    args = parser.parse_args()
+    if args.single:
+        json.dump(run_scale(args.single, seed=args.seed, on_disk=args.on_disk, memory=args.memory), sys.stdout)
+        return 0
+    runs = list()
+    for scale in args.scales:
+        command = [sys.executable, __file__, '--single', scale, '--seed', str(args.seed)]
+        if args.on_disk:
+            command += ['--on-disk', args.on_disk]
+        if args.memory:
+            command.append('--memory')
+        run = json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout)
+        print(f"info: {scale}: {run['entries']} entries; " + "; ".join(
+            f"{phase} {seconds:.3f}s" for phase, seconds in run['timings'].items() if seconds is not None
+        ) + f"; peak RSS {run['peak_rss_kb'] / 1024:.1f} MB", file=sys.stderr)
+        if run['memory'] is not None:
+            print(f"info: {scale}: tree {run['memory']['tree_bytes_per_entry']:.1f} bytes/entry; nested dicts "
+                  f"{run['memory']['nested_dict_bytes_per_entry']:.1f} bytes/entry", file=sys.stderr)
+        runs.append(run)
+    document = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=4)
+    else:
+        json.dump(document, sys.stdout, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Deterministic synthetic EM datasets
+
+`generate(size)` yields about `size` entries laid out like a typical deposition, parents before their contents as a
+directory walk would give them:
+
+- `data/Movies`: grid squares with foil-hole movies and their metadata (deep, many medium-sized directories);
+- `data/Micrographs`: flat directories of up to 100,000 dated micrographs;
+- `processing`: job directories nested several levels deep with long, mixed-case names.
+
+The same size and seed always give the same entries. `materialise` writes them to disk as empty files so that the
+scan can be timed too.
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bandbox import utils  # noqa: E402
+
+SCALES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1M': 1_000_000,
+    '10M': 10_000_000,
+}
+MAX_FLAT_FILES = 100_000
+ROOT = "EMPIAR-SYNTH"
+
+
+def _date(rng: random.Random) -> str:
+    return f"20{rng.randint(15, 23):02d}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+
+
+def _movies(rng, parent, budget):
+    """Grid squares of foil holes each with a movie and its metadata"""
+    grid_square = 0
+    while budget > 0:
+        grid_square += 1
+        square = f"{parent}/GridSquare_{grid_square:05d}"
+        yield utils.Entry(square, is_dir=True)
+        yield utils.Entry(f"{square}/Data", is_dir=True)
+        yield utils.Entry(f"{square}/GridSquare_{grid_square:05d}_{_date(rng)}.jpg")
+        budget -= 3
+        for foil_hole in range(rng.randint(50, 400)):
+            if budget <= 0:
+                break
+            stem = f"{square}/Data/FoilHole_{rng.randint(10 ** 7, 10 ** 8 - 1)}_Data_{grid_square}_{foil_hole}_" \
+                   f"{_date(rng)}_{rng.randint(0, 235959):06d}"
+            yield utils.Entry(f"{stem}_Fractions.tiff")
+            yield utils.Entry(f"{stem}.xml")
+            budget -= 2
+
+
+def _micrographs(rng, parent, budget):
+    """Flat directories of dated micrographs"""
+    part = 0
+    while budget > 0:
+        part += 1
+        directory = f"{parent}/Micrographs_part{part:02d}"
+        yield utils.Entry(directory, is_dir=True)
+        budget -= 1
+        sample = rng.choice(['apoferritin', 'Ribosome80S', 'spike_RBD', 'TRPV1'])
+        for index in range(min(budget, MAX_FLAT_FILES)):
+            yield utils.Entry(f"{directory}/{_date(rng)}_{sample}_{index:06d}.mrc")
+        budget -= min(budget, MAX_FLAT_FILES)
+
+
+def _processing(rng, parent, budget):
+    """Deeply nested job directories with long, mixed-case names"""
+    job = 0
+    while budget > 0:
+        job += 1
+        job_type = rng.choice(['MotionCorr', 'CtfFind', 'AutoPick', 'Extract', 'Class2D', 'Refine3D', 'PostProcess'])
+        path = f"{parent}/{job_type}_job{job:03d}"
+        yield utils.Entry(path, is_dir=True)
+        budget -= 1
+        for depth in range(rng.randint(1, 6)):
+            path = f"{path}/Run{depth} - {job_type} of the {rng.choice(['Best', 'selected', 'ALL'])} particles " \
+                   f"v1.{depth}"
+            yield utils.Entry(path, is_dir=True)
+            budget -= 1
+        for index in range(min(budget, rng.randint(10, 2000))):
+            yield utils.Entry(f"{path}/run_it{index:03d}_data.star" if index % 3 else f"{path}/particles.{index}.mrcs")
+            budget -= 1
+        # some jobs leave an empty directory behind
+        if rng.random() < 0.05:
+            yield utils.Entry(f"{path}/empty", is_dir=True)
+            budget -= 1
+
+
+def generate(size: int, seed: int = 0, root: str = ROOT):
+    """Yield about `size` entries of a synthetic deposition"""
+    rng = random.Random(seed)
+    yield utils.Entry(f"{root}/README.txt")
+    yield utils.Entry(f"{root}/data", is_dir=True)
+    yield utils.Entry(f"{root}/data/Movies", is_dir=True)
+    yield from _movies(rng, f"{root}/data/Movies", size * 5 // 10)
+    yield utils.Entry(f"{root}/data/Micrographs", is_dir=True)
+    yield from _micrographs(rng, f"{root}/data/Micrographs", size * 3 // 10)
+    yield utils.Entry(f"{root}/processing", is_dir=True)
+    yield from _processing(rng, f"{root}/processing", size * 2 // 10)
+
+
+def materialise(entries, base_dir: str) -> None:
+    """Create the entries as empty files and directories under `base_dir`"""
+    for entry in entries:
+        path = os.path.join(base_dir, entry.path)
+        if entry.is_dir():
+            os.makedirs(path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()